@@ -1,10 +1,137 @@
 from django.contrib import admin
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+
+from api.normalization import normalize_search_text
 from .models import *
 
-admin.site.register(Country)
-admin.site.register(CountryTranslation)
-admin.site.register(RegionTranslation)
-admin.site.register(Region)
-admin.site.register(City)
-admin.site.register(CityTranslation)
-admin.site.register(ZipCode)
+
+class CountryFilter(admin.SimpleListFilter):
+    """Filters by country, listed by code, instead of a query per country name"""
+    title = _('Country')
+    parameter_name = 'country'
+
+    def lookups(self, request, model_admin):
+        return Country.objects.order_by('code').values_list('pk', 'code')
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(country_id=self.value())
+        return queryset
+
+
+class PlaceAdmin(admin.ModelAdmin):
+    """
+    Changelists of the places, with their English names (see
+    AbstractPlace.name), the search only runs indexed lookups: the exact
+    code, or the start of the English name
+    """
+    search_fields = ['code']
+    ordering = ['code']
+    # Counting every place of the table on each page is expensive
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.filter(
+            Q(code=search_term)
+            | Q(search_name__startswith=normalize_search_text(search_term))
+        ), False
+
+
+class TranslationAdmin(admin.ModelAdmin):
+    """
+    Changelists of the translations, the places they belong to are shown by
+    their codes, which come along with the translations
+    """
+    list_display = ['name', 'language_code', 'place_code']
+    list_filter = ['language_code']
+    search_fields = ['name']
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return queryset.filter(
+            search_name__startswith=normalize_search_text(search_term)
+        ), False
+
+    def place_code(self, translation):
+        return getattr(translation, translation.place_field).code
+    place_code.short_description = _('Code')
+
+
+@admin.register(Country)
+class CountryAdmin(PlaceAdmin):
+    list_display = ['code', 'name', 'currency_code']
+
+
+@admin.register(Region)
+class RegionAdmin(PlaceAdmin):
+    list_display = ['code', 'name', 'local_code', 'country_code']
+    list_select_related = ['country']
+    list_filter = [CountryFilter]
+    autocomplete_fields = ['country']
+
+    def country_code(self, region):
+        return region.country.code if region.country else None
+    country_code.short_description = _('Country')
+
+
+@admin.register(City)
+class CityAdmin(PlaceAdmin):
+    list_display = ['code', 'name', 'region_code', 'country_code']
+    list_select_related = ['region', 'country']
+    list_filter = [CountryFilter]
+    autocomplete_fields = ['region', 'country']
+
+    def region_code(self, city):
+        return city.region.code if city.region else None
+    region_code.short_description = _('Region')
+
+    def country_code(self, city):
+        return city.country.code
+    country_code.short_description = _('Country')
+
+
+@admin.register(CountryTranslation)
+class CountryTranslationAdmin(TranslationAdmin):
+    list_select_related = ['country']
+    autocomplete_fields = ['country']
+
+
+@admin.register(RegionTranslation)
+class RegionTranslationAdmin(TranslationAdmin):
+    list_select_related = ['region']
+    autocomplete_fields = ['region']
+
+
+@admin.register(CityTranslation)
+class CityTranslationAdmin(TranslationAdmin):
+    list_select_related = ['city']
+    # Hundreds of thousands of cities, they can't be listed in a dropdown
+    autocomplete_fields = ['city']
+
+
+@admin.register(ZipCode)
+class ZipCodeAdmin(admin.ModelAdmin):
+    list_display = ['zip_code', 'city_code']
+    list_select_related = ['city']
+    search_fields = ['zip_code']
+    ordering = ['zip_code']
+    show_full_result_count = False
+    autocomplete_fields = ['city']
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        # Through the pattern ops index of the zip codes
+        return queryset.filter(zip_code__startswith=search_term), False
+
+    def city_code(self, zip_code):
+        return zip_code.city.code
+    city_code.short_description = _('City')
@@ -0,0 +1,510 @@
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+
+from api.engines import VersionedEngine
+from api.models import (
+    City, Region, Country, CityTranslation, RegionTranslation,
+    CountryTranslation, ZipCode
+)
+
+__author__ = 'Bezur'
+
+__all__ = ['NameIndex', 'IndexState', 'AutocompleteEngine', 'engine']
+
+
+class NameIndex(object):
+    """
+    Compact, array backed, index of the normalized names of one language.
+
+    All the names are concatenated in a single string, separated by
+    SEPARATOR, and 'words' holds the offset of every word start within that
+    string, sorted by the text that follows it. A prefix query is then a
+    binary search over an array of integers, and every word of a name can
+    be matched by its prefix, e.g. 'guav' finds 'san jose del guaviare'.
+    Terms found anywhere else in a name, e.g. 'ogo' in 'bogota', are found
+    by scanning the whole string, so the index matches the same names the
+    database search does (see api.search).
+
+    Entries are kept sorted by city id, so a city is located with a binary
+    search as well. Changes made after the index was built go to 'pending'
+    (and the replaced entries to 'removed') until there are enough of them
+    to be worth a compaction.
+    """
+
+    SEPARATOR = '\x00'
+    COMPACT_THRESHOLD = 512
+
+    def __init__(self, entries=()):
+        self._build(entries)
+
+    def _build(self, entries):
+        """'entries' is an iterable of (city_id, name) sorted by city_id"""
+        names = []
+        self.city_ids = array('l')
+        self.starts = array('l')
+        position = 0
+        for city_id, name in entries:
+            if not name:
+                continue
+            self.city_ids.append(city_id)
+            self.starts.append(position)
+            names.append(name)
+            position += len(name) + 1
+        self.text = self.SEPARATOR.join(names) + self.SEPARATOR if names else ''
+
+        words = []
+        for start, name in zip(self.starts, names):
+            words.append(start)
+            words.extend(start + i + 1 for i, char in enumerate(name) if char == ' ')
+        words.sort(key=self._suffix)
+        self.words = array('l', words)
+
+        self.removed = set()
+        self.pending = {}
+
+    def __len__(self):
+        return len(self.city_ids) - len(self.removed) + len(self.pending)
+
+    def copy(self):
+        """
+        Copy to apply changes to, the arrays and the text are shared, as
+        they're never changed but replaced by the compactions
+        """
+        index = NameIndex.__new__(NameIndex)
+        index.__dict__.update(self.__dict__)
+        index.removed = set(self.removed)
+        index.pending = dict(self.pending)
+        return index
+
+    def _suffix(self, offset):
+        return self.text[offset:self.text.index(self.SEPARATOR, offset)]
+
+    def _entry(self, city_id):
+        i = bisect_left(self.city_ids, city_id)
+        if i < len(self.city_ids) and self.city_ids[i] == city_id and i not in self.removed:
+            return i
+        return None
+
+    def _lower_bound(self, term):
+        text, size = self.text, len(term)
+        lo, hi = 0, len(self.words)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = self.words[mid]
+            if text[offset:offset + size] < term:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def get(self, city_id):
+        if city_id in self.pending:
+            return self.pending[city_id]
+        i = self._entry(city_id)
+        if i is None:
+            return None
+        return self._suffix(self.starts[i])
+
+    def set(self, city_id, name):
+        self._remove(city_id)
+        if name:
+            self.pending[city_id] = name
+        self._maybe_compact()
+
+    def remove(self, city_id):
+        self._remove(city_id)
+        self._maybe_compact()
+
+    def _remove(self, city_id):
+        self.pending.pop(city_id, None)
+        i = self._entry(city_id)
+        if i is not None:
+            self.removed.add(i)
+
+    def _maybe_compact(self):
+        if len(self.pending) + len(self.removed) < self.COMPACT_THRESHOLD:
+            return
+        entries = dict(
+            (city_id, self._suffix(start))
+            for i, (city_id, start) in enumerate(zip(self.city_ids, self.starts))
+            if i not in self.removed
+        )
+        entries.update(self.pending)
+        self._build(sorted(entries.items()))
+
+    def search(self, term):
+        """
+        Yields the ids of the cities whose name contains 'term'. Names
+        starting with the term come first, then the ones with a word
+        starting with it, and then the rest, which are only looked for when
+        the caller asks for more
+        """
+        if not term:
+            return
+        text = self.text
+        first = self._lower_bound(term)
+        last = first
+        while last < len(self.words) and text.startswith(term, self.words[last]):
+            last += 1
+
+        pending = list(self.pending.items())
+        word_term = ' ' + term
+        for whole_name in (True, False):
+            for offset in self.words[first:last]:
+                i = bisect_right(self.starts, offset) - 1
+                if (offset == self.starts[i]) == whole_name and i not in self.removed:
+                    yield self.city_ids[i]
+            for city_id, name in pending:
+                if whole_name and name.startswith(term):
+                    yield city_id
+                elif not whole_name and word_term in name:
+                    yield city_id
+
+        # Word starts were already yielded, only the matches within a word
+        # are left
+        offset = text.find(term)
+        while offset != -1:
+            i = bisect_right(self.starts, offset) - 1
+            if (offset != self.starts[i] and text[offset - 1] != ' '
+                    and i not in self.removed):
+                yield self.city_ids[i]
+            offset = text.find(term, offset + 1)
+        for city_id, name in pending:
+            if term in name and not name.startswith(term) and word_term not in name:
+                yield city_id
+
+    def memory_footprint(self):
+        return (
+            sys.getsizeof(self.text)
+            + sys.getsizeof(self.words)
+            + sys.getsizeof(self.starts)
+            + sys.getsizeof(self.city_ids)
+            + sys.getsizeof(self.removed)
+            + sys.getsizeof(self.pending)
+            + sum(sys.getsizeof(name) for name in self.pending.values())
+        )
+
+
+class IndexState(object):
+    """Everything the engine needs to answer a query, swapped as a whole"""
+
+    def __init__(self):
+        self.names = {}
+        # Sorted city ids and, in parallel, the region and country of each
+        # one (0 when the city has no region)
+        self.cities = array('l')
+        self.city_regions = array('l')
+        self.city_countries = array('l')
+        self.city_codes = []
+        self.codes = {}
+        self.zip_codes = {}
+        self.region_names = {}
+        self.region_codes = {}
+        self.country_names = {}
+        self.country_codes = {}
+        # Structures copied from the state this one is a copy of, None if
+        # it isn't a copy and owns them all
+        self._owned = None
+
+    @classmethod
+    def load(cls):
+        state = cls()
+
+        entries = {}
+        translations = CityTranslation.objects.order_by('city_id').values_list(
+            'language_code', 'city_id', 'search_name'
+        )
+        for language, city_id, name in translations.iterator(chunk_size=5000):
+            entries.setdefault(language, []).append((city_id, name))
+        for language, language_entries in entries.items():
+            state.names[language] = NameIndex(language_entries)
+        del entries
+
+        cities = City.objects.order_by('pk').values_list('pk', 'code', 'region_id', 'country_id')
+        for city_id, code, region_id, country_id in cities.iterator(chunk_size=5000):
+            state.cities.append(city_id)
+            state.city_regions.append(region_id or 0)
+            state.city_countries.append(country_id)
+            state.city_codes.append(code)
+            state.codes.setdefault(code, []).append(city_id)
+
+        zip_codes = ZipCode.objects.values_list('zip_code', 'city_id')
+        state.zip_codes = dict(zip_codes.iterator(chunk_size=5000))
+
+        for language, region_id, name in RegionTranslation.objects.values_list(
+                'language_code', 'region_id', 'search_name'):
+            state.region_names.setdefault(language, {})[region_id] = name
+        state.region_codes = dict(
+            (region_id, code.casefold())
+            for region_id, code in Region.objects.values_list('pk', 'code')
+        )
+
+        for language, country_id, name in CountryTranslation.objects.values_list(
+                'language_code', 'country_id', 'search_name'):
+            state.country_names.setdefault(language, {})[country_id] = name
+        state.country_codes = dict(
+            (country_id, code.casefold())
+            for country_id, code in Country.objects.values_list('pk', 'code')
+        )
+        return state
+
+    def copy(self):
+        """
+        Copy to apply changes to, so the searches reading this state never
+        see a change half applied. Everything is shared until a change
+        writes to it (see _writable), so applying a few changes doesn't
+        copy the whole index
+        """
+        state = IndexState.__new__(IndexState)
+        state.__dict__.update(self.__dict__)
+        state._owned = set()
+        return state
+
+    def _writable(self, name, language=None):
+        """
+        The structure 'name' (its entry for 'language' if given), copied
+        first if it's still shared with the state this one was copied from.
+        Lists of cities by code are replaced, never changed, so they're
+        always shared
+        """
+        structure = getattr(self, name)
+        if self._owned is not None and name not in self._owned:
+            structure = structure[:] if isinstance(structure, (array, list)) else dict(structure)
+            setattr(self, name, structure)
+            self._owned.add(name)
+        if language is None:
+            return structure
+
+        entry = structure.get(language)
+        if entry is None:
+            entry = structure[language] = NameIndex() if name == 'names' else {}
+        elif self._owned is not None and (name, language) not in self._owned:
+            entry = structure[language] = entry.copy()
+        if self._owned is not None:
+            self._owned.add((name, language))
+        return entry
+
+    def _city_position(self, city_id):
+        i = bisect_left(self.cities, city_id)
+        if i < len(self.cities) and self.cities[i] == city_id:
+            return i
+        return None
+
+    def set_city(self, city_id, code, region_id, country_id):
+        self.remove_city(city_id, keep_names=True)
+        i = bisect_left(self.cities, city_id)
+        self._writable('cities').insert(i, city_id)
+        self._writable('city_regions').insert(i, region_id or 0)
+        self._writable('city_countries').insert(i, country_id)
+        self._writable('city_codes').insert(i, code)
+        codes = self._writable('codes')
+        codes[code] = codes.get(code, []) + [city_id]
+
+    def remove_city(self, city_id, keep_names=False):
+        i = self._city_position(city_id)
+        if i is not None:
+            code = self.city_codes[i]
+            codes = self._writable('codes')
+            city_ids = [other for other in codes.get(code, []) if other != city_id]
+            if city_ids:
+                codes[code] = city_ids
+            else:
+                codes.pop(code, None)
+            for name in ('cities', 'city_regions', 'city_countries', 'city_codes'):
+                del self._writable(name)[i]
+        if not keep_names:
+            for language, names in list(self.names.items()):
+                if names.get(city_id) is not None:
+                    self._writable('names', language).remove(city_id)
+
+    def set_city_name(self, language, city_id, name):
+        self._writable('names', language).set(city_id, name)
+
+    def remove_city_name(self, language, city_id):
+        if language in self.names:
+            self._writable('names', language).remove(city_id)
+
+    def set_zip_code(self, zip_code, city_id):
+        self._writable('zip_codes')[zip_code] = city_id
+
+    def remove_zip_code(self, zip_code):
+        if zip_code in self.zip_codes:
+            self._writable('zip_codes').pop(zip_code)
+
+    def set_region(self, region_id, code):
+        self._writable('region_codes')[region_id] = code.casefold()
+
+    def set_region_name(self, language, region_id, name):
+        self._writable('region_names', language)[region_id] = name
+
+    def remove_region_name(self, language, region_id):
+        if region_id in self.region_names.get(language, {}):
+            self._writable('region_names', language).pop(region_id)
+
+    def set_country(self, country_id, code):
+        self._writable('country_codes')[country_id] = code.casefold()
+
+    def set_country_name(self, language, country_id, name):
+        self._writable('country_names', language)[country_id] = name
+
+    def remove_country_name(self, language, country_id):
+        if country_id in self.country_names.get(language, {}):
+            self._writable('country_names', language).pop(country_id)
+
+    def in_region(self, language, city_id, term):
+        i = self._city_position(city_id)
+        if i is None:
+            return False
+        region_id = self.city_regions[i]
+        return (
+            term in self.region_names.get(language, {}).get(region_id, '')
+            or self.region_codes.get(region_id) == term
+        )
+
+    def in_country(self, language, city_id, term):
+        i = self._city_position(city_id)
+        if i is None:
+            return False
+        country_id = self.city_countries[i]
+        return (
+            term in self.country_names.get(language, {}).get(country_id, '')
+            or self.country_codes.get(country_id) == term
+        )
+
+    def memory_footprint(self):
+        footprint = {
+            'names': sum(index.memory_footprint() for index in self.names.values()),
+            'cities': sum(
+                sys.getsizeof(a) for a in (
+                    self.cities, self.city_regions, self.city_countries, self.city_codes
+                )
+            ),
+            'codes': sys.getsizeof(self.codes) + sum(
+                sys.getsizeof(code) + sys.getsizeof(ids) for code, ids in self.codes.items()
+            ),
+            'zip_codes': sys.getsizeof(self.zip_codes) + sum(
+                sys.getsizeof(zip_code) for zip_code in self.zip_codes
+            ),
+            'regions_and_countries': sum(
+                sys.getsizeof(names) + sum(sys.getsizeof(name) for name in names.values())
+                for names in list(self.region_names.values()) + list(self.country_names.values())
+            ),
+        }
+        footprint['total'] = sum(footprint.values())
+        return footprint
+
+
+class AutocompleteEngine(VersionedEngine):
+    """
+    Answers the cities search queries from worker memory.
+
+    The index is built in the background after the first query, which
+    falls back to the database meanwhile, and stamped with the dataset
+    version. Changes made through the models in this process are applied
+    incrementally once they're committed (see api.signals), every other
+    change bumps the dataset version, so workers notice (at most every
+    PLACES_AUTOCOMPLETE_REFRESH seconds) that they are stale and rebuild
+    their own index in the background, serving the old one in the meantime.
+    """
+
+    state_class = IndexState
+    refresh_setting = 'PLACES_AUTOCOMPLETE_REFRESH'
+    wait_for_first_build = False
+
+    def __init__(self):
+        super().__init__()
+        # Committed changes not applied yet, as (version, change, args)
+        self.pending = []
+        self.pending_lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'PLACES_AUTOCOMPLETE', False)
+
+    def search(self, language, city_query, region_query='', country_query='',
+               limit=20, offset=0):
+        """
+        Returns the ids of the matching cities, skipping the first 'offset'
+        ones, or None whenever the engine is disabled or can't answer the
+        query, in which case the caller should fall back to the database
+        """
+        if not self.enabled or not city_query or not self._ensure_fresh():
+            return None
+        self._apply_pending()
+        state = self.state
+
+        def candidates():
+            if city_query in state.zip_codes:
+                yield state.zip_codes[city_query]
+            for code in {city_query, city_query.upper()}:
+                yield from state.codes.get(code, [])
+            if language in state.names:
+                yield from state.names[language].search(city_query)
+
+        result = []
+        seen = set()
+        for city_id in candidates():
+            if city_id in seen:
+                continue
+            seen.add(city_id)
+            if region_query and not country_query:
+                if not (state.in_region(language, city_id, region_query)
+                        or state.in_country(language, city_id, region_query)):
+                    continue
+            else:
+                if region_query and not state.in_region(language, city_id, region_query):
+                    continue
+                if country_query and not state.in_country(language, city_id, country_query):
+                    continue
+            if offset:
+                offset -= 1
+                continue
+            result.append(city_id)
+            if len(result) >= limit:
+                break
+        return result
+
+    def memory_footprint(self):
+        if self.state is None:
+            return {'total': 0}
+        return self.state.memory_footprint()
+
+    def apply(self, version, change, *args):
+        """
+        Queues a committed change to the local index (if it was already
+        built), 'version' is the dataset version bumped by that change.
+        Queued changes are applied by the next search
+        """
+        if not self.enabled or self.state is None:
+            return
+        with self.pending_lock:
+            self.pending.append((version, change, args))
+
+    def _apply_pending(self):
+        """
+        Applies the queued changes to a copy of the state, which then
+        replaces it, searches running meanwhile keep reading the old one.
+        The copy shares everything the changes don't touch.
+        If there were no other changes in between, the index is still
+        current
+        """
+        if not self.pending:
+            return
+        with self.lock:
+            with self.pending_lock:
+                pending, self.pending = self.pending, []
+            if not pending or self.state is None:
+                return
+            state, version = self.state.copy(), self.version
+            for change_version, change, args in pending:
+                change(state, *args)
+                if version is not None and change_version == version + 1:
+                    version = change_version
+            self.state, self.version = state, version
+
+
+engine = AutocompleteEngine()
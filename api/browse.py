@@ -0,0 +1,142 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import NullIf
+
+from api.caching import browse_cache_key, get_cached_listing, set_cached_listing
+from api.models import (
+    Country, Region, City, ZipCode, CountryTranslation, RegionTranslation,
+    CityTranslation, LanguageChoices
+)
+from api.renderers import dumps
+
+__author__ = 'Bezur'
+
+__all__ = [
+    'render_countries', 'render_regions', 'render_cities', 'get_listing'
+]
+
+
+def _named(places, translations, owner, language):
+    """
+    Annotates the places with their 'display_name' in 'language' and sorts
+    them by it, places without a name go last, by code
+    """
+    if language == LanguageChoices.ENGLISH:
+        # Kept on the places themselves, see AbstractPlace.name
+        name = NullIf(F('name'), Value(''))
+    else:
+        name = Subquery(
+            translations.objects.filter(
+                language_code=language, **{owner: OuterRef('pk')}
+            ).values('name')[:1]
+        )
+    return places.annotate(display_name=name).order_by(
+        F('display_name').asc(nulls_last=True), 'code'
+    )
+
+
+def _counts(children, owner):
+    """Number of children by owner id, a single grouped query"""
+    return dict(
+        children.order_by().values_list(owner).annotate(count=Count('pk'))
+    )
+
+
+def render_countries(language):
+    """
+    Compact listing of all the countries, with their name in 'language' and
+    how many regions and cities they have
+    """
+    regions = _counts(Region.objects.all(), 'country_id')
+    cities = _counts(City.objects.all(), 'country_id')
+    countries = _named(
+        Country.objects.all(), CountryTranslation, 'country', language
+    ).values_list('pk', 'code', 'display_name', 'currency_code')
+    return dumps([
+        {
+            'code': code,
+            'name': name,
+            'currency_code': currency_code,
+            'regions': regions.get(country_id, 0),
+            'cities': cities.get(country_id, 0),
+        }
+        for country_id, code, name, currency_code in countries
+    ])
+
+
+def render_regions(country_code, language):
+    """
+    Compact listing of the regions of a country, with their name in
+    'language' and how many cities they have, or None if there's no such
+    country
+    """
+    country_id = Country.objects.filter(code=country_code).values_list(
+        'pk', flat=True
+    ).first()
+    if country_id is None:
+        return None
+    cities = _counts(City.objects.filter(country_id=country_id), 'region_id')
+    regions = _named(
+        Region.objects.filter(country_id=country_id),
+        RegionTranslation,
+        'region',
+        language
+    ).values_list('pk', 'code', 'local_code', 'display_name')
+    return dumps([
+        {
+            'code': code,
+            'local_code': local_code,
+            'name': name,
+            'cities': cities.get(region_id, 0),
+        }
+        for region_id, code, local_code, name in regions
+    ])
+
+
+def render_cities(country_code, region_code, language):
+    """
+    Compact listing of the cities of a region, with their name in
+    'language' and how many zip codes they have, or None if there's no such
+    region. The ids are the ones of the cities documents
+    """
+    region_id = Region.objects.filter(
+        country__code=country_code, code=region_code
+    ).values_list('pk', flat=True).first()
+    if region_id is None:
+        return None
+    zip_codes = _counts(ZipCode.objects.filter(city__region_id=region_id), 'city_id')
+    cities = _named(
+        City.objects.filter(region_id=region_id), CityTranslation, 'city', language
+    ).values_list('pk', 'code', 'display_name')
+    return dumps([
+        {
+            'id': city_id,
+            'code': code,
+            'name': name,
+            'zip_codes': zip_codes.get(city_id, 0),
+        }
+        for city_id, code, name in cities
+    ])
+
+
+def get_listing(language, *codes):
+    """
+    Returns the (body, compressed bodies) listing of the children of the
+    place given by its codes: the countries (no codes), the regions of a
+    country (its code) or the cities of a region (its country's code and
+    its own), or None if the place doesn't exist.
+
+    Listings, and misses, are cached per dataset version, so they're only
+    rendered once after every change of the data
+    """
+    key = browse_cache_key(language, codes)
+    listing = get_cached_listing(key)
+    if listing is None:
+        if not codes:
+            body = render_countries(language)
+        elif len(codes) == 1:
+            body = render_regions(codes[0], language)
+        else:
+            body = render_cities(codes[0], codes[1], language)
+        # Unknown places are cached as empty listings
+        listing = set_cached_listing(key, body or '')
+    return listing if listing[0] else None
@@ -0,0 +1,376 @@
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import transaction
+from django_redis import get_redis_connection
+
+from api.compression import compress_body
+from api.lru import LRUCache
+
+__author__ = 'Bezur'
+
+__all__ = [
+    'get_dataset_version', 'bump_dataset_version', 'get_dataset_state',
+    'cities_cache_key',
+    'get_cached_cities', 'set_cached_cities', 'get_many_cached_cities',
+    'set_many_cached_cities', 'uncached_keys', 'record_cities_query',
+    'popular_cities_queries', 'cities_cache_stats', 'browse_cache_key',
+    'get_cached_listing', 'set_cached_listing', 'get_cached_zip_codes',
+    'set_cached_zip_codes', 'set_job_progress', 'get_job_progress', 'clear_job_progress'
+]
+
+CACHE_TTL = getattr(settings, 'CACHE_TTL', DEFAULT_TIMEOUT)
+# Zip codes rarely change, and their entries are stamped with the dataset
+# version anyway, so they can be kept for longer
+ZIP_CACHE_TTL = getattr(settings, 'PLACES_ZIP_CACHE_TTL', 60 * 60 * 24 * 7)
+
+DATASET_VERSION_KEY = 'places:version'
+DATASET_MODIFIED_KEY = 'places:modified'
+HITS_KEY = 'cities:hits'
+MISSES_KEY = 'cities:misses'
+# Sorted set of the queries of the cities endpoint, by language, scored by
+# the number of requests
+POPULAR_KEY = 'cities:popular:%s'
+# Most distinct queries kept by the request log of a language
+POPULAR_MAX_QUERIES = 10000
+
+# Workers read the dataset version from the cache at most every
+# PLACES_VERSION_CHECK_INTERVAL seconds, so a change takes up to that long
+# to reach all of them
+VERSION_CHECK_INTERVAL = getattr(settings, 'PLACES_VERSION_CHECK_INTERVAL', 1)
+
+# Cities pages are kept in the memory of the worker too, in front of Redis
+local_cities = LRUCache(
+    getattr(settings, 'PLACES_LOCAL_CACHE_SIZE', 1000),
+    getattr(settings, 'PLACES_LOCAL_CACHE_TTL', 60)
+)
+
+# Version read by this process and when, see get_dataset_state
+_dataset_state = {'state': None, 'checked': 0.0}
+
+# Hits, misses and queries counted by this process since they were last
+# written to the cache, they're written along with the version checks
+_pending = {'hits': 0, 'misses': 0, 'queries': Counter()}
+_pending_lock = threading.Lock()
+
+
+def _incr_by(key, delta):
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # The key is not there yet (or the cache was flushed)
+        cache.add(key, 0, None)
+        return cache.incr(key, delta)
+
+
+def _incr(key):
+    return _incr_by(key, 1)
+
+
+def get_dataset_version():
+    """
+    Version of the places data, every cached response is stamped with it,
+    so bumping it invalidates all of them at once
+    """
+    return get_dataset_state()[0]
+
+
+def bump_dataset_version():
+    """
+    Should be called whenever the places data change. The version is bumped
+    once the current transaction commits, otherwise a request running in
+    between would cache the old data under the new version. Outside of
+    transactions it's bumped right away, and the new version is returned
+    """
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(_bump_dataset_version)
+        return None
+    return _bump_dataset_version()
+
+
+def _bump_dataset_version():
+    version = _incr(DATASET_VERSION_KEY)
+    modified = time.time()
+    cache.set(DATASET_MODIFIED_KEY, modified, None)
+    _set_local_state((version, modified))
+    return version
+
+
+def _read_dataset_state():
+    state = cache.get_many([DATASET_VERSION_KEY, DATASET_MODIFIED_KEY])
+    version = state.get(DATASET_VERSION_KEY)
+    if version is None:
+        cache.add(DATASET_VERSION_KEY, 1, None)
+        version = cache.get(DATASET_VERSION_KEY)
+    modified = state.get(DATASET_MODIFIED_KEY)
+    if modified is None:
+        cache.add(DATASET_MODIFIED_KEY, time.time(), None)
+        modified = cache.get(DATASET_MODIFIED_KEY)
+    return version, modified
+
+
+def _set_local_state(state):
+    previous = _dataset_state['state']
+    if previous is not None and previous[0] != state[0]:
+        # Pages of older versions won't be asked for anymore
+        local_cities.clear()
+    _dataset_state['state'] = state
+    _dataset_state['checked'] = time.monotonic()
+
+
+def get_dataset_state():
+    """
+    Version of the places data and the time (a timestamp) it was last
+    changed, read from the cache in a single round trip, at most every
+    VERSION_CHECK_INTERVAL seconds. If the cache was flushed, the time is
+    reset to now, as the version may start over
+    """
+    if (_dataset_state['state'] is None
+            or time.monotonic() - _dataset_state['checked'] >= VERSION_CHECK_INTERVAL):
+        _set_local_state(_read_dataset_state())
+        _flush_pending()
+    return _dataset_state['state']
+
+
+def _flush_pending():
+    global _pending
+    with _pending_lock:
+        pending, _pending = _pending, {'hits': 0, 'misses': 0, 'queries': Counter()}
+    if pending['hits']:
+        _incr_by(HITS_KEY, pending['hits'])
+    if pending['misses']:
+        _incr_by(MISSES_KEY, pending['misses'])
+    if pending['queries']:
+        redis = _popular_queries()
+        if redis is not None:
+            pipeline = redis.pipeline(transaction=False)
+            keys = set()
+            for (language, entry), count in pending['queries'].items():
+                key = cache.make_key(POPULAR_KEY % language)
+                pipeline.zincrby(key, count, entry)
+                keys.add(key)
+            # Every prefix typed is a query of its own, the log would grow
+            # without bounds
+            for key in keys:
+                pipeline.zremrangebyrank(key, 0, -POPULAR_MAX_QUERIES - 1)
+            pipeline.execute()
+
+
+def _count(hits=0, misses=0):
+    with _pending_lock:
+        _pending['hits'] += hits
+        _pending['misses'] += misses
+
+
+def cities_cache_key(shape, language, extra_lang, queries, limit, cursor='',
+                     flat=False, autocomplete=False):
+    """
+    Key of the cities endpoint responses, built out of the normalized query
+    sections, so 'q=Bogo', 'q=bogo ' and 'q=BOGO' share the same entry.
+    Every query shape (see api.planner) has its own key space, and the
+    pages of the autocomplete index have their own keys, as it ranks the
+    cities its own way
+    """
+    params = json.dumps(
+        [language, extra_lang or '', list(queries), limit, cursor, flat, autocomplete]
+    )
+    return 'cities:%s:%s:%s' % (
+        shape,
+        get_dataset_version(),
+        hashlib.md5(params.encode('utf-8')).hexdigest()
+    )
+
+
+def get_cached_cities(key):
+    """
+    Returns the cached (body, next cursor, compressed bodies) page, or None,
+    see api.compression.compress_body. Pages are looked up in the memory of
+    the worker first, then in Redis
+    """
+    page = local_cities.get(key)
+    if page is None:
+        page = cache.get(key)
+        if page is not None:
+            local_cities.set(key, page)
+    if page is not None:
+        _count(hits=1)
+    else:
+        _count(misses=1)
+    return page
+
+
+def set_cached_cities(key, body, next_cursor=None):
+    """Caches the page along with its compressed bodies, returns the latter"""
+    encoded = compress_body(body)
+    page = (body, next_cursor, encoded)
+    cache.set(key, page, CACHE_TTL)
+    local_cities.set(key, page)
+    return encoded
+
+
+def get_many_cached_cities(keys):
+    """Same as get_cached_cities, for many keys in a single round trip"""
+    pages = {}
+    for key in keys:
+        page = local_cities.get(key)
+        if page is not None:
+            pages[key] = page
+    missing = [key for key in keys if key not in pages]
+    if missing:
+        for key, page in cache.get_many(missing).items():
+            local_cities.set(key, page)
+            pages[key] = page
+    _count(hits=len(pages), misses=len(keys) - len(pages))
+    return pages
+
+
+def set_many_cached_cities(pages):
+    """Caches many pages, a dictionary of (body, next cursor) pairs by key"""
+    if pages:
+        pages = {
+            key: (body, next_cursor, compress_body(body))
+            for key, (body, next_cursor) in pages.items()
+        }
+        cache.set_many(pages, CACHE_TTL)
+        for key, page in pages.items():
+            local_cities.set(key, page)
+
+
+def uncached_keys(keys):
+    """The keys that aren't cached, without counting them as hits or misses"""
+    cached = cache.get_many(keys) if keys else {}
+    return [key for key in keys if key not in cached]
+
+
+def _popular_queries():
+    """
+    Redis connection for the request log, which needs sorted sets, or None
+    when the cache isn't Redis (e.g. in development), it's not kept then
+    """
+    try:
+        return get_redis_connection('default')
+    except NotImplementedError:
+        return None
+
+
+def record_cities_query(language, entry):
+    """
+    Counts a request for a query of the cities endpoint (see api.planner),
+    requests are counted by the worker and written along with the version
+    checks
+    """
+    with _pending_lock:
+        _pending['queries'][(language, entry)] += 1
+
+
+def popular_cities_queries(language, count):
+    """
+    Returns the 'count' most requested queries of a language, the log keeps
+    the POPULAR_MAX_QUERIES most requested ones (see _flush_pending)
+    """
+    _flush_pending()
+    redis = _popular_queries()
+    if redis is None:
+        return []
+    key = cache.make_key(POPULAR_KEY % language)
+    return [entry.decode('utf-8') for entry in redis.zrevrange(key, 0, count - 1)]
+
+
+def cities_cache_stats():
+    _flush_pending()
+    hits = cache.get(HITS_KEY) or 0
+    misses = cache.get(MISSES_KEY) or 0
+    return {
+        'version': get_dataset_version(),
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / (hits + misses) if hits + misses else 0,
+    }
+
+
+def browse_cache_key(language, codes):
+    """
+    Key of the browse endpoints responses, the listing of the place given
+    by its 'codes' path (none for the countries, see api.browse)
+    """
+    params = json.dumps([language, list(codes)])
+    return 'browse:%s:%s' % (
+        get_dataset_version(),
+        hashlib.md5(params.encode('utf-8')).hexdigest()
+    )
+
+
+def get_cached_listing(key):
+    """
+    Returns the cached (body, compressed bodies) listing, or None, looked up
+    in the memory of the worker first, then in Redis, like the cities pages
+    """
+    listing = local_cities.get(key)
+    if listing is None:
+        listing = cache.get(key)
+        if listing is not None:
+            local_cities.set(key, listing)
+    return listing
+
+
+def set_cached_listing(key, body):
+    """Caches the listing along with its compressed bodies, returns both"""
+    listing = (body, compress_body(body))
+    cache.set(key, listing, CACHE_TTL)
+    local_cities.set(key, listing)
+    return listing
+
+
+def _zip_code_key(version, language, zip_code):
+    return 'zip:%s:%s:%s' % (version, language, zip_code)
+
+
+def get_cached_zip_codes(zip_codes, language):
+    """
+    Returns a dictionary with the cached documents of the zip codes, the
+    unknown zip codes are cached as empty documents
+    """
+    version = get_dataset_version()
+    keys = {
+        _zip_code_key(version, language, zip_code): zip_code
+        for zip_code in zip_codes
+    }
+    cached = cache.get_many(list(keys)) if keys else {}
+    return {keys[key]: document for key, document in cached.items()}
+
+
+def set_cached_zip_codes(documents, language):
+    version = get_dataset_version()
+    cache.set_many(
+        {
+            _zip_code_key(version, language, zip_code): document
+            for zip_code, document in documents.items()
+        },
+        ZIP_CACHE_TTL
+    )
+
+
+def _job_progress_key(job_id):
+    return 'upload-job:%s:rows' % job_id
+
+
+def set_job_progress(job_id, rows):
+    """
+    Running imports report their progress through the cache, as the job
+    row won't change until the import's transaction ends
+    """
+    cache.set(_job_progress_key(job_id), rows, 60 * 60)
+
+
+def get_job_progress(job_id, default=0):
+    return cache.get(_job_progress_key(job_id), default)
+
+
+def clear_job_progress(job_id):
+    cache.delete(_job_progress_key(job_id))
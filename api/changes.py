@@ -0,0 +1,188 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from api.models import PlaceChange
+from api.snapshots import PLACE_KINDS, place_records
+
+__author__ = 'Bezur'
+
+__all__ = [
+    'START', 'record_changes', 'record_imported_changes', 'parse_position',
+    'latest_change', 'changes_since', 'ChangesExpired', 'prune_changes'
+]
+
+# Most changes read by a single page of the feed
+CHANGES_PAGE_SIZE = 1000
+# Days the changes are kept for, see prune_changes
+CHANGES_RETENTION_DAYS = getattr(settings, 'PLACES_CHANGES_RETENTION_DAYS', 30)
+
+# Position before the first change
+START = '0'
+
+
+class ChangesExpired(Exception):
+    """The changes after the position were pruned, see prune_changes"""
+
+
+def record_changes(kind, place_ids):
+    """Records that the places of 'kind' with the given ids changed"""
+    place_ids = list(place_ids)
+    if not place_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO {change} (kind, place_id, created_at, transaction_id)"
+            "  SELECT %s, place_id, now(), txid_current()"
+            "  FROM unnest(%s::integer[]) AS place_id".format(
+                change=PlaceChange._meta.db_table
+            ),
+            [kind, place_ids]
+        )
+
+
+def record_imported_changes(cursor, kind, result_table):
+    """
+    Records the changes of a streaming import, out of its result table of
+    (id, status) rows, see api.helpers
+    """
+    cursor.execute(
+        "INSERT INTO {change} (kind, place_id, created_at, transaction_id)"
+        "  SELECT %s, id, now(), txid_current()"
+        "  FROM (SELECT DISTINCT id FROM {result}) AS changed"
+        "  ORDER BY id".format(change=PlaceChange._meta.db_table, result=result_table),
+        [kind]
+    )
+
+
+def _format_position(transaction_id, change_id):
+    return '%d-%d' % (transaction_id, change_id)
+
+
+def parse_position(value):
+    """
+    Parses a position of the feed, a '<transaction>-<change id>' pair or
+    START, raises ValueError if it's not valid
+    """
+    if value == START:
+        return 0, 0
+    transaction_id, _separator, change_id = value.partition('-')
+    position = int(transaction_id), int(change_id)
+    if min(position) < 0:
+        raise ValueError('Negative position')
+    return position
+
+
+def _horizon():
+    """
+    Oldest transaction still in flight, every change recorded by an older
+    one is committed (or rolled back) for good, so nothing can show up
+    before them anymore
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+        return cursor.fetchone()[0]
+
+
+def _settled():
+    return PlaceChange.objects.filter(transaction_id__lt=_horizon())
+
+
+def latest_change():
+    """Position of the last change settled, START if there's none"""
+    last = _settled().order_by('-transaction_id', '-id').values_list(
+        'transaction_id', 'id'
+    ).first()
+    return _format_position(*last) if last else START
+
+
+def _expired(position):
+    """
+    Whether changes after the position may have been pruned: its change is
+    gone and older than every change left
+    """
+    if position == (0, 0) or PlaceChange.objects.filter(
+            transaction_id=position[0], id=position[1]).exists():
+        return False
+    first = PlaceChange.objects.order_by('transaction_id', 'id').values_list(
+        'transaction_id', 'id'
+    ).first()
+    return first is not None and position < first
+
+
+def changes_since(since, limit=CHANGES_PAGE_SIZE):
+    """
+    Returns the places that changed after the position 'since': a page of
+    at most 'limit' changes, with the current record of every place that
+    changed (see api.snapshots.place_records), or a {'type', 'id',
+    'deleted'} record if it doesn't exist anymore. Parents come first, and
+    places changed many times are sent once. Raises ChangesExpired if the
+    changes after 'since' were pruned.
+
+    Changes are ordered by their transaction, and only the ones of
+    transactions older than every transaction in flight are sent. A long
+    import commits its changes after shorter transactions that started
+    later, with lower ids, so following ids alone would skip them for good.
+
+    'version' is the position of the last change of the page, the 'since'
+    of the next one. Records are read after the changes, so they may be
+    newer than 'version', applying them again is harmless
+    """
+    position = parse_position(since)
+    if _expired(position):
+        raise ChangesExpired(since)
+
+    transaction_id, change_id = position
+    rows = list(
+        _settled().filter(
+            Q(transaction_id__gt=transaction_id)
+            | Q(transaction_id=transaction_id, id__gt=change_id)
+        ).order_by('transaction_id', 'id').values_list(
+            'transaction_id', 'id', 'kind', 'place_id'
+        )[:limit + 1]
+    )
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    changed = dict((kind, set()) for kind in PLACE_KINDS)
+    for _transaction_id, _change_id, kind, place_id in rows:
+        changed[kind].add(place_id)
+
+    changes = []
+    for kind in PLACE_KINDS:
+        if not changed[kind]:
+            continue
+        found = set()
+        for record in place_records(kind, changed[kind]):
+            found.add(record['id'])
+            changes.append(record)
+        changes.extend(
+            {'type': kind, 'id': place_id, 'deleted': True}
+            for place_id in sorted(changed[kind] - found)
+        )
+
+    return {
+        'since': since,
+        'version': _format_position(*rows[-1][:2]) if rows else since,
+        'more': more,
+        'changes': changes,
+    }
+
+
+def prune_changes(days=CHANGES_RETENTION_DAYS):
+    """
+    Deletes the changes older than 'days' days, but the last one, so
+    clients that are up to date can still follow the feed. Clients further
+    behind get ChangesExpired, and have to start over from a snapshot.
+    Returns the number of changes deleted
+    """
+    last = PlaceChange.objects.order_by('-transaction_id', '-id').values_list(
+        'pk', flat=True
+    ).first()
+    deleted, _deleted_by_model = PlaceChange.objects.filter(
+        created_at__lt=timezone.now() - timedelta(days=days)
+    ).exclude(pk=last).delete()
+    return deleted
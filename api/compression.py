@@ -0,0 +1,101 @@
+import gzip
+
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    # It's in the requirements, bodies are only gzipped without it
+    brotli = None
+
+__author__ = 'Bezur'
+
+__all__ = [
+    'compress_body', 'accepted_encoding', 'encode_response',
+    'CompressionMiddleware'
+]
+
+# Smaller bodies aren't worth compressing, the same limit GZipMiddleware has
+MIN_COMPRESSED_SIZE = 200
+# Cached bodies are compressed once and served many times, so they get the
+# highest levels
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# Content types compressed on the fly, responses of other types are either
+# compressed already (xlsx, zip) or pages with CSRF tokens, which shouldn't
+# be compressed (BREACH)
+COMPRESSED_CONTENT_TYPES = ('application/json', 'text/csv')
+
+
+def compress_body(body):
+    """
+    Compressed versions of a response body, by content encoding, the most
+    preferred first, or an empty dictionary for small bodies
+    """
+    data = body.encode('utf-8')
+    if len(data) < MIN_COMPRESSED_SIZE:
+        return {}
+    encoded = {}
+    if brotli is not None:
+        encoded['br'] = brotli.compress(data, quality=BROTLI_QUALITY)
+    encoded['gzip'] = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    return encoded
+
+
+def _accepted_encodings(request):
+    """The codings of the Accept-Encoding header, accepted and refused (q=0)"""
+    accepted, refused = set(), set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.partition(';')
+        coding, params = coding.strip().lower(), params.strip()
+        try:
+            quality = float(params[2:]) if params.startswith('q=') else 1
+        except ValueError:
+            quality = 0
+        (accepted if quality > 0 else refused).add(coding)
+    return accepted, refused
+
+
+def accepted_encoding(request, encoded):
+    """The first encoding of 'encoded' the client accepts, or None"""
+    accepted, refused = _accepted_encodings(request)
+    for encoding in encoded:
+        if encoding in accepted or ('*' in accepted and encoding not in refused):
+            return encoding
+    return None
+
+
+def encode_response(request, response, encoded):
+    """
+    Swaps the content of the response for the compressed version of it the
+    client prefers, if there's any. The ETag is weakened, as GZipMiddleware
+    does, since the bytes are not the ones it was computed for
+    """
+    patch_vary_headers(response, ('Accept-Encoding',))
+    encoding = accepted_encoding(request, encoded)
+    if encoding is None:
+        return response
+    response.content = encoded[encoding]
+    response['Content-Length'] = str(len(response.content))
+    response['Content-Encoding'] = encoding
+    if response.has_header('ETag') and not response['ETag'].startswith('W/'):
+        response['ETag'] = 'W/' + response['ETag']
+    return response
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    GZipMiddleware only for the JSON and CSV responses, the ones already
+    encoded by the views (see encode_response) are left as they are. Unlike
+    GZipMiddleware, it honours 'gzip;q=0'
+    """
+
+    def process_response(self, request, response):
+        if not response.get('Content-Type', '').startswith(COMPRESSED_CONTENT_TYPES):
+            return response
+        if accepted_encoding(request, ['gzip']) is None:
+            patch_vary_headers(response, ('Accept-Encoding',))
+            return response
+        return super().process_response(request, response)
@@ -0,0 +1,74 @@
+from datetime import datetime, timezone
+from functools import wraps
+
+from django.views.decorators.http import condition
+
+from api.caching import get_dataset_state
+from api.changes import latest_change
+
+__author__ = 'Bezur'
+
+__all__ = [
+    'dataset_etag', 'dataset_last_modified', 'dataset_condition',
+    'changes_etag', 'changes_condition'
+]
+
+
+def _dataset_state(request):
+    # Both the ETag and the Last-Modified come out of the same cache read
+    if not hasattr(request, '_dataset_state'):
+        request._dataset_state = get_dataset_state()
+    return request._dataset_state
+
+
+def dataset_etag(request, *args, **kwargs):
+    """
+    ETag of the responses built out of the places data, they only change
+    when the data do. The time of the last change is part of it, so the
+    ETags aren't reused if the version starts over
+    """
+    version, modified = _dataset_state(request)
+    return '"places-%s-%d"' % (version, modified)
+
+
+def dataset_last_modified(request, *args, **kwargs):
+    _version, modified = _dataset_state(request)
+    return datetime.fromtimestamp(modified, timezone.utc)
+
+
+# Answers conditional GETs with a 304, from the dataset version alone, before
+# the view runs any query, and adds the ETag and Last-Modified headers to the
+# responses
+_dataset_condition = condition(
+    etag_func=dataset_etag,
+    last_modified_func=dataset_last_modified
+)
+
+
+def dataset_condition(view):
+    """
+    Applies _dataset_condition to the GET (and HEAD) requests of the view
+    only: other methods, e.g. the POST lookups of api_zip_codes, would get a
+    412 for sending a matching If-None-Match
+    """
+    conditional_view = _dataset_condition(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            return conditional_view(request, *args, **kwargs)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def changes_etag(request, *args, **kwargs):
+    """
+    ETag of the pages of the changes feed. They change when a change
+    settles (see api.changes), which may be long after its transaction
+    bumped the dataset version, so the dataset ETag would keep answering
+    304s for pages that got more changes
+    """
+    return '"changes-%s"' % latest_change()
+
+
+changes_condition = condition(etag_func=changes_etag)
@@ -0,0 +1,262 @@
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.contrib.postgres.fields import ArrayField
+from django.core.files.storage import default_storage
+from django.db import connection, models, transaction
+from django.db.models import F, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import NullIf
+
+from api.models import (
+    City, CityDocument, CityTranslation, RegionTranslation, CountryTranslation,
+    ZipCode, PlaceChange, LanguageChoices, PlaceKindChoices
+)
+from api.renderers import FastJSONRenderer, dumps
+from api.serializers import CitySerializer
+
+__author__ = 'Bezur'
+
+__all__ = [
+    'city_prefetch', 'get_city_documents', 'get_city_documents_by_id',
+    'render_city_documents', 'render_flat_city_documents',
+    'join_documents', 'invalidate_city_documents'
+]
+
+
+def city_prefetch(language, extra_lang=None):
+    """
+    Prefetch objects to serialize cities with only the translations in
+    'language' and 'extra_lang'
+    """
+    languages = [language]
+    if extra_lang and extra_lang != language:
+        languages.append(extra_lang)
+
+    return [
+        Prefetch(
+            'city_translations',
+            queryset=CityTranslation.objects.filter(language_code__in=languages)
+        ),
+        Prefetch(
+            'country__country_translations',
+            queryset=CountryTranslation.objects.filter(language_code__in=languages)
+        ),
+        Prefetch(
+            'region__region_translations',
+            queryset=RegionTranslation.objects.filter(language_code__in=languages)
+        ),
+        Prefetch(
+            'zip_codes', queryset=ZipCode.objects.order_by('zip_code')
+        )
+    ]
+
+
+def _snapshot():
+    """Snapshot of the transactions committed so far, see _store_documents"""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT txid_current_snapshot()::text")
+        return cursor.fetchone()[0]
+
+
+def _store_documents(bodies, language, extra_lang, flat, snapshot):
+    """
+    Stores the documents rendered out of the data seen by 'snapshot', taken
+    before reading it, but the ones of cities whose city, region or country
+    changed since: they could be stored after the change was committed and
+    its documents invalidated, and kept for good
+    """
+    if not bodies:
+        return
+    city_ids, bodies = zip(*bodies.items())
+    with connection.cursor() as cursor:
+        # Another request could be rendering the same documents
+        cursor.execute(
+            "INSERT INTO {document} (city_id, language_code, extra_language_code, flat, body)"
+            "  SELECT c.id, %s, %s, %s, d.body"
+            "  FROM unnest(%s::integer[], %s::text[]) AS d (city_id, body)"
+            "  JOIN {city} c ON c.id = d.city_id"
+            "  WHERE NOT EXISTS ("
+            "    SELECT 1 FROM {change} p"
+            "    WHERE (p.kind = %s AND p.place_id = c.id"
+            "      OR p.kind = %s AND p.place_id = c.region_id"
+            "      OR p.kind = %s AND p.place_id = c.country_id)"
+            "    AND p.transaction_id >= txid_snapshot_xmin(%s::txid_snapshot)"
+            "    AND NOT txid_visible_in_snapshot(p.transaction_id, %s::txid_snapshot)"
+            "  )"
+            "  ON CONFLICT DO NOTHING".format(
+                document=CityDocument._meta.db_table,
+                city=City._meta.db_table,
+                change=PlaceChange._meta.db_table
+            ),
+            [
+                language, extra_lang, flat, list(city_ids), list(bodies),
+                PlaceKindChoices.CITY, PlaceKindChoices.REGION,
+                PlaceKindChoices.COUNTRY, snapshot, snapshot
+            ]
+        )
+
+
+def render_city_documents(city_ids, language, extra_lang=None):
+    """
+    Serializes the cities and stores their documents, returns a dictionary
+    with the rendered bodies by city id
+    """
+    extra_lang = extra_lang if extra_lang and extra_lang != language else ''
+    snapshot = _snapshot()
+    cities = City.objects.prefetch_related(
+        *city_prefetch(language, extra_lang)
+    ).filter(pk__in=city_ids)
+
+    renderer = FastJSONRenderer()
+    bodies = {}
+    for city in cities:
+        data = CitySerializer(city).data
+        bodies[city.pk] = renderer.render(data).decode('utf-8')
+
+    _store_documents(bodies, language, extra_lang, False, snapshot)
+    return bodies
+
+
+def _name(translations, owner, outer, language, place=''):
+    if language == LanguageChoices.ENGLISH:
+        # Kept on the places themselves, see AbstractPlace.name
+        return NullIf(F('%sname' % place), Value(''))
+    return Subquery(
+        translations.objects.filter(
+            language_code=language, **{owner: OuterRef(outer)}
+        ).values('name')[:1]
+    )
+
+
+def _flag(name):
+    return default_storage.url(name) if name else None
+
+
+def render_flat_city_documents(city_ids, language, extra_lang=None):
+    """
+    Renders, and stores, the flat documents of the cities: instead of the
+    translations lists, places have a 'name' in 'language' and, if given,
+    an 'extra_name' in 'extra_lang'. Everything comes from a single query,
+    names are subqueries over the (language_code, owner) unique indexes of
+    the translations, or the places' own columns in English, and the zip
+    codes an array subquery
+    """
+    extra_lang = extra_lang if extra_lang and extra_lang != language else ''
+    languages = {'name': language}
+    if extra_lang:
+        languages['extra_name'] = extra_lang
+
+    annotations = {
+        # Aggregated in the subquery, ARRAY() over it would lose the order
+        'zip_code_list': Subquery(
+            ZipCode.objects.filter(city=OuterRef('pk')).values('city').annotate(
+                zip_codes=ArrayAgg('zip_code', ordering='zip_code')
+            ).values('zip_codes'),
+            output_field=ArrayField(models.CharField())
+        )
+    }
+    for field, field_language in languages.items():
+        annotations.update({
+            'city_%s' % field: _name(CityTranslation, 'city', 'pk', field_language),
+            'region_%s' % field: _name(
+                RegionTranslation, 'region_id', 'region_id', field_language, 'region__'
+            ),
+            'country_%s' % field: _name(
+                CountryTranslation, 'country_id', 'country_id', field_language,
+                'country__'
+            ),
+        })
+
+    snapshot = _snapshot()
+    cities = City.objects.filter(pk__in=city_ids).annotate(**annotations).values(
+        'pk', 'code', 'flag', 'latitude', 'longitude', 'region_id',
+        'region__code', 'region__local_code', 'region__flag',
+        'region__latitude', 'region__longitude', 'country__code',
+        'country__flag', 'country__latitude', 'country__longitude',
+        *annotations
+    )
+
+    bodies = {}
+    for city in cities:
+        country = {'code': city['country__code']}
+        country.update((field, city['country_%s' % field]) for field in languages)
+        country.update({
+            'flag': _flag(city['country__flag']),
+            'latitude': city['country__latitude'],
+            'longitude': city['country__longitude'],
+        })
+
+        region = None
+        if city['region_id'] is not None:
+            region = {
+                'code': city['region__code'],
+                'local_code': city['region__local_code'],
+            }
+            region.update((field, city['region_%s' % field]) for field in languages)
+            region.update({
+                'flag': _flag(city['region__flag']),
+                'latitude': city['region__latitude'],
+                'longitude': city['region__longitude'],
+            })
+
+        document = {'id': city['pk'], 'code': city['code']}
+        document.update((field, city['city_%s' % field]) for field in languages)
+        document.update({
+            'zip_codes': city['zip_code_list'] or [],
+            'country': country,
+            'region': region,
+            'flag': _flag(city['flag']),
+            'latitude': city['latitude'],
+            'longitude': city['longitude'],
+        })
+        bodies[city['pk']] = dumps(document)
+
+    _store_documents(bodies, language, extra_lang, True, snapshot)
+    return bodies
+
+
+def get_city_documents_by_id(city_ids, language, extra_lang=None, flat=False):
+    """
+    Returns a dictionary with the documents (flat ones if 'flat') of the
+    cities by city id, rendering the ones that haven't been rendered yet
+    """
+    extra_lang = extra_lang if extra_lang and extra_lang != language else ''
+    bodies = dict(
+        CityDocument.objects.filter(
+            city_id__in=city_ids,
+            language_code=language,
+            extra_language_code=extra_lang,
+            flat=flat
+        ).values_list('city_id', 'body')
+    )
+
+    missing = [city_id for city_id in set(city_ids) if city_id not in bodies]
+    if missing:
+        render = render_flat_city_documents if flat else render_city_documents
+        bodies.update(render(missing, language, extra_lang))
+    return bodies
+
+
+def get_city_documents(city_ids, language, extra_lang=None, flat=False):
+    """
+    Returns the documents of the cities, in the same order than 'city_ids',
+    rendering the ones that haven't been rendered yet
+    """
+    bodies = get_city_documents_by_id(city_ids, language, extra_lang, flat)
+    return [bodies[city_id] for city_id in city_ids if city_id in bodies]
+
+
+def join_documents(documents):
+    """Builds a JSON array out of already rendered documents"""
+    return '[%s]' % ','.join(documents)
+
+
+def invalidate_city_documents(**filters):
+    """
+    Removes the documents of the cities matching the filters, e.g.
+    invalidate_city_documents(city__region_id=1), and again once the
+    transaction commits: other requests can still render them out of the
+    data before the change until then
+    """
+    documents = CityDocument.objects.filter(**filters)
+    documents.delete()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(documents.delete)
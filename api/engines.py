@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from api.caching import get_dataset_version
+
+__author__ = 'Bezur'
+
+__all__ = ['VersionedEngine']
+
+logger = logging.getLogger(__name__)
+
+
+class VersionedEngine(object):
+    """
+    Base of the engines answering queries from an in-process copy of the
+    places data.
+
+    The state is built on the first query (or explicitly with build()) and
+    stamped with the dataset version. Every change of the data bumps the
+    dataset version, so workers notice (at most every 'refresh_setting'
+    seconds) that they are stale and rebuild their own state in a
+    background thread, serving the old one until the new one replaces it.
+    """
+
+    # The state class, its 'load' class method builds it from the database
+    state_class = None
+    refresh_setting = None
+    # Whether the first queries wait for the first state, engines whose
+    # callers can fall back to the database build it in the background too
+    wait_for_first_build = True
+
+    def __init__(self):
+        self.state = None
+        self.version = None
+        self.checked_at = 0
+        # Held while the state is replaced, briefly
+        self.lock = threading.Lock()
+        # Held while a state is built, so only one is built at a time
+        self.building = threading.Lock()
+
+    def build(self):
+        """Builds the state and replaces the current one, returns the seconds it took"""
+        with self.building:
+            return self._build()
+
+    def _build(self):
+        started = time.monotonic()
+        version = get_dataset_version()
+        state = self.state_class.load()
+        with self.lock:
+            self.state, self.version = state, version
+        self.checked_at = time.monotonic()
+        return time.monotonic() - started
+
+    def _build_in_background(self):
+        """Starts building a new state, unless one is being built already"""
+        if not self.building.acquire(blocking=False):
+            return
+
+        def build():
+            try:
+                self._build()
+            except Exception:
+                # The current state is served until the next try
+                logger.exception('Could not build the state of %s', type(self).__name__)
+            finally:
+                self.building.release()
+                connections.close_all()
+
+        threading.Thread(
+            target=build, name='%s-build' % type(self).__name__, daemon=True
+        ).start()
+
+    def _ensure_fresh(self):
+        """
+        Makes sure a current state is on the way, returns whether there is
+        a state to answer from
+        """
+        if self.state is None:
+            if not self.wait_for_first_build:
+                self._build_in_background()
+                return False
+            with self.building:
+                if self.state is None:
+                    self._build()
+            return True
+
+        now = time.monotonic()
+        if now - self.checked_at < getattr(settings, self.refresh_setting, 30):
+            return True
+        self.checked_at = now
+        if get_dataset_version() != self.version:
+            self._build_in_background()
+        return True
@@ -0,0 +1,212 @@
+import csv
+import io
+import zipfile
+from xml.sax.saxutils import escape
+
+from django.db.models import F, FilteredRelation, Q, Value
+from django.db.models.functions import NullIf
+from django.http import StreamingHttpResponse
+
+from api.models import Country, Region, City, LanguageChoices
+
+__author__ = 'Bezur'
+
+__all__ = [
+    'export_languages', 'countries_rows', 'regions_rows', 'cities_rows',
+    'csv_stream', 'xlsx_stream', 'streaming_export_response'
+]
+
+# Rows fetched from the database, and written to the response, at a time
+EXPORT_CHUNK_SIZE = 2000
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+XLSX_PARTS = [
+    (
+        '[Content_Types].xml',
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    (
+        '_rels/.rels',
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    (
+        'xl/workbook.xml',
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    (
+        'xl/_rels/workbook.xml.rels',
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+]
+
+
+def export_languages():
+    return sorted(LanguageChoices.values)
+
+
+def _translated(queryset, relation, languages):
+    """
+    Pivots the translations in SQL: every language is joined as its own
+    filtered relation, so each row comes with a name column per language.
+    English names are on the places themselves, see AbstractPlace.name
+    """
+    names = []
+    for language in languages:
+        alias = 'translation_%s' % language
+        if language == LanguageChoices.ENGLISH:
+            queryset = queryset.annotate(**{alias: NullIf(F('name'), Value(''))})
+            names.append(alias)
+            continue
+        queryset = queryset.annotate(**{
+            alias: FilteredRelation(
+                relation,
+                condition=Q(**{'%s__language_code' % relation: language})
+            )
+        })
+        names.append('%s__name' % alias)
+    return queryset, names
+
+
+def countries_rows(languages):
+    countries, names = _translated(
+        Country.objects.order_by('code'), 'country_translations', languages
+    )
+    return countries.values_list('code', 'currency_code', *names).iterator(
+        chunk_size=EXPORT_CHUNK_SIZE
+    )
+
+
+def regions_rows(country_code, languages):
+    regions, names = _translated(
+        Region.objects.filter(country__code=country_code).order_by('code'),
+        'region_translations',
+        languages
+    )
+    return regions.values_list('code', 'local_code', 'country__code', *names).iterator(
+        chunk_size=EXPORT_CHUNK_SIZE
+    )
+
+
+def cities_rows(country_code, languages):
+    cities, names = _translated(
+        City.objects.filter(country__code=country_code).order_by('code'),
+        'city_translations',
+        languages
+    )
+    return cities.values_list('code', 'region__code', 'country__code', *names).iterator(
+        chunk_size=EXPORT_CHUNK_SIZE
+    )
+
+
+def _chunks(rows, size=EXPORT_CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _cell(value):
+    return '' if value is None else '%s' % value
+
+
+def csv_stream(headers, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(headers)
+    for chunk in _chunks(rows):
+        writer.writerows([_cell(value) for value in row] for row in chunk)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+class _Pipe(object):
+    """
+    Write only, non seekable, file object zipfile can write to, whatever is
+    written is handed to the response every time it's drained
+    """
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def _xlsx_row(row):
+    return '<row>%s</row>' % ''.join(
+        '<c t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' % escape(_cell(value))
+        for value in row
+    )
+
+
+def xlsx_stream(headers, rows):
+    """
+    Writes a minimal xlsx package (a single sheet of inline strings) on the
+    fly, the sheet is compressed and sent as the rows come from the database
+    """
+    pipe = _Pipe()
+    with zipfile.ZipFile(pipe, 'w', zipfile.ZIP_DEFLATED) as package:
+        for name, content in XLSX_PARTS:
+            package.writestr(name, content)
+        yield pipe.drain()
+
+        with package.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                 '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                 '<sheetData>%s' % _xlsx_row(headers)).encode('utf-8')
+            )
+            for chunk in _chunks(rows):
+                sheet.write(''.join(_xlsx_row(row) for row in chunk).encode('utf-8'))
+                yield pipe.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield pipe.drain()
+
+
+def streaming_export_response(headers, rows, file_format, file_name):
+    if file_format == 'xlsx':
+        response = StreamingHttpResponse(
+            xlsx_stream(headers, rows),
+            content_type=XLSX_CONTENT_TYPE
+        )
+    else:
+        response = StreamingHttpResponse(
+            csv_stream(headers, rows),
+            content_type='text/csv; charset=utf-8'
+        )
+    response['Content-Disposition'] = 'attachment; filename="%s.%s"' % (
+        file_name, file_format
+    )
+    return response
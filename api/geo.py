@@ -0,0 +1,113 @@
+import math
+
+__author__ = 'Bezur'
+
+__all__ = [
+    'GEOHASH_PRECISION', 'encode_geohash', 'geohash_cell_size',
+    'geohash_block', 'block_reach', 'haversine', 'bounding_box'
+]
+
+# Precision of the geohashes stored for the cities, cells of ~1.2km x 0.6km
+GEOHASH_PRECISION = 6
+
+EARTH_RADIUS = 6371.0088  # Kilometers
+KM_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """
+    Encodes a point as a geohash: nearby points share the longest prefixes,
+    so the points of a cell are a range of an ordinary index
+    """
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash = []
+    bits, bit_count, even = 0, 0, True
+    while len(geohash) < precision:
+        interval, value = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(geohash)
+
+
+def geohash_cell_size(precision):
+    """Height and width, in degrees, of the cells of a given precision"""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def geohash_block(latitude, longitude, precision):
+    """
+    Geohashes of the cell containing the point and its (up to 8) neighbours,
+    every point within block_reach() of the given one lies in them
+    """
+    height, width = geohash_cell_size(precision)
+    cells = set()
+    for lat_step in (-1, 0, 1):
+        lat = latitude + lat_step * height
+        if not -90 <= lat <= 90:
+            continue
+        for lon_step in (-1, 0, 1):
+            lon = (longitude + lon_step * width + 180) % 360 - 180
+            cells.add(encode_geohash(lat, lon, precision))
+    return sorted(cells)
+
+
+def block_reach(latitude, precision):
+    """
+    Distance (km) from a point such that every point closer than it falls in
+    the geohash_block of that point, i.e. the size of a cell at the block's
+    farthest latitude from the equator
+    """
+    height, width = geohash_cell_size(precision)
+    farthest = min(abs(latitude) + height, 90.0)
+    return min(
+        height * KM_PER_DEGREE,
+        width * KM_PER_DEGREE * math.cos(math.radians(farthest))
+    )
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great circle distance between two points, in kilometers"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius):
+    """
+    Box around the point containing every point within 'radius' km of it,
+    as ((min_lat, max_lat), longitude ranges). There are no longitude
+    ranges when the circle contains a pole, as every longitude is in it
+    then, and two when it crosses the antimeridian
+    """
+    distance = radius / EARTH_RADIUS  # Radians
+    lat_delta = math.degrees(distance)
+    min_lat, max_lat = latitude - lat_delta, latitude + lat_delta
+    if min_lat <= -90 or max_lat >= 90:
+        return (max(min_lat, -90.0), min(max_lat, 90.0)), []
+
+    # The meridians tangent to the circle
+    lon_delta = math.degrees(
+        math.asin(math.sin(distance) / math.cos(math.radians(latitude)))
+    )
+    min_lon, max_lon = longitude - lon_delta, longitude + lon_delta
+    if min_lon < -180:
+        return (min_lat, max_lat), [(min_lon + 360, 180.0), (-180.0, max_lon)]
+    if max_lon > 180:
+        return (min_lat, max_lat), [(min_lon, 180.0), (-180.0, max_lon - 360)]
+    return (min_lat, max_lat), [(min_lon, max_lon)]
@@ -0,0 +1,372 @@
+import logging
+import math
+import sys
+from array import array
+
+from django.conf import settings
+from django.db import DatabaseError
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+
+from api.engines import VersionedEngine
+from api.geo import EARTH_RADIUS
+from api.models import (
+    City, Region, Country, CityTranslation, RegionTranslation,
+    CountryTranslation
+)
+
+__author__ = 'Bezur'
+
+__all__ = [
+    'KDTree', 'BoundaryIndex', 'GeocodingState', 'GeocodingEngine', 'engine',
+    'preload'
+]
+
+logger = logging.getLogger(__name__)
+
+
+def _unit_vector(latitude, longitude):
+    latitude, longitude = math.radians(latitude), math.radians(longitude)
+    return (
+        math.cos(latitude) * math.cos(longitude),
+        math.cos(latitude) * math.sin(longitude),
+        math.sin(latitude)
+    )
+
+
+def _chord_to_km(chord):
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, chord / 2))
+
+
+class KDTree(object):
+    """
+    Static 3-d tree over points of the sphere, stored as unit vectors, so
+    the nearest point by straight line (chord) distance is the nearest one
+    by great circle distance as well.
+
+    The tree is implicit: for every range of the arrays, the median is the
+    node splitting it, and the halves at each side are its subtrees.
+    """
+
+    def __init__(self, ids, points):
+        entries = [(point, point_id) for point_id, point in zip(ids, points)]
+        self.axes = bytearray(len(entries))
+        self._build(entries, 0, len(entries))
+
+        self.ids = array('l', (point_id for _point, point_id in entries))
+        self.coordinates = [
+            array('d', (point[axis] for point, _point_id in entries))
+            for axis in range(3)
+        ]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _build(self, entries, lo, hi):
+        if hi - lo <= 1:
+            return
+        # Splits by the axis with the widest spread
+        spreads = []
+        for axis in range(3):
+            values = [entries[i][0][axis] for i in range(lo, hi)]
+            spreads.append(max(values) - min(values))
+        axis = spreads.index(max(spreads))
+
+        entries[lo:hi] = sorted(entries[lo:hi], key=lambda entry: entry[0][axis])
+        middle = (lo + hi) // 2
+        self.axes[middle] = axis
+        self._build(entries, lo, middle)
+        self._build(entries, middle + 1, hi)
+
+    def nearest(self, latitude, longitude):
+        """
+        Returns the (id, distance in km) of the nearest point, or None when
+        the tree is empty
+        """
+        if not self.ids:
+            return None
+        target = _unit_vector(latitude, longitude)
+        coordinates = self.coordinates
+        best = [float('inf'), -1]
+
+        def visit(lo, hi):
+            middle = (lo + hi) // 2
+            distance = sum(
+                (coordinates[axis][middle] - target[axis]) ** 2
+                for axis in range(3)
+            )
+            if distance < best[0]:
+                best[0], best[1] = distance, middle
+
+            axis = self.axes[middle]
+            difference = target[axis] - coordinates[axis][middle]
+            near, far = (
+                ((middle + 1, hi), (lo, middle)) if difference > 0
+                else ((lo, middle), (middle + 1, hi))
+            )
+            if near[0] < near[1]:
+                visit(*near)
+            if far[0] < far[1] and difference ** 2 < best[0]:
+                visit(*far)
+
+        visit(0, len(self.ids))
+        return self.ids[best[1]], _chord_to_km(math.sqrt(best[0]))
+
+    def memory_footprint(self):
+        return (
+            sys.getsizeof(self.ids) + sys.getsizeof(self.axes)
+            + sum(sys.getsizeof(values) for values in self.coordinates)
+        )
+
+
+def _ring_contains(ring, latitude, longitude):
+    """Ray casting point in polygon test, positions are [longitude, latitude]"""
+    inside = False
+    previous_lon, previous_lat = ring[-1][0], ring[-1][1]
+    for lon, lat in ((position[0], position[1]) for position in ring):
+        if (lat > latitude) != (previous_lat > latitude):
+            crossing = (
+                (previous_lon - lon) * (latitude - lat) / (previous_lat - lat) + lon
+            )
+            if longitude < crossing:
+                inside = not inside
+        previous_lon, previous_lat = lon, lat
+    return inside
+
+
+def _boundary_contains(polygons, latitude, longitude):
+    for rings in polygons:
+        if rings and _ring_contains(rings[0], latitude, longitude) and not any(
+                _ring_contains(hole, latitude, longitude) for hole in rings[1:]):
+            return True
+    return False
+
+
+class BoundaryIndex(object):
+    """
+    Grid of one degree cells over the bounding boxes of the places, to find
+    the places containing a point: the ones whose boundary contains it or,
+    for the places with only a bounding box, whose box does
+    """
+
+    def __init__(self):
+        self.cells = {}
+
+    def add(self, place_id, box, polygons=None):
+        min_lat, min_lon, max_lat, max_lon = box
+        area = (max_lat - min_lat) * (max_lon - min_lon)
+        entry = (place_id, box, polygons, area)
+        for lat in range(math.floor(min_lat), math.floor(max_lat) + 1):
+            for lon in range(math.floor(min_lon), math.floor(max_lon) + 1):
+                self.cells.setdefault((lat, lon), []).append(entry)
+
+    def containing(self, latitude, longitude):
+        """
+        Returns the id of the place containing the point, places with a
+        boundary first, then the smallest box, or None
+        """
+        found = None
+        for place_id, box, polygons, area in self.cells.get(
+                (math.floor(latitude), math.floor(longitude)), ()):
+            min_lat, min_lon, max_lat, max_lon = box
+            if not (min_lat <= latitude <= max_lat and min_lon <= longitude <= max_lon):
+                continue
+            if polygons:
+                if _boundary_contains(polygons, latitude, longitude):
+                    return place_id
+            elif found is None or area < found[1]:
+                found = (place_id, area)
+        return found[0] if found else None
+
+    def memory_footprint(self):
+        return sys.getsizeof(self.cells) + sum(
+            sys.getsizeof(entries) for entries in self.cells.values()
+        )
+
+
+def _box(place):
+    """
+    Bounding box of a place, (min_lat, min_lon, max_lat, max_lon), taken from
+    its boundary if it has one, otherwise from its box fields, or None
+    """
+    (boundary, min_lat, min_lon, max_lat, max_lon) = place
+    if boundary:
+        positions = [
+            position for rings in boundary for ring in rings for position in ring
+        ]
+        if positions:
+            return (
+                min(position[1] for position in positions),
+                min(position[0] for position in positions),
+                max(position[1] for position in positions),
+                max(position[0] for position in positions),
+            )
+    if None in (min_lat, min_lon, max_lat, max_lon):
+        return None
+    return min_lat, min_lon, max_lat, max_lon
+
+
+class GeocodingState(object):
+    """Everything the engine needs to answer a query, swapped as a whole"""
+
+    def __init__(self):
+        self.tree = None
+        self.city_codes = {}
+        self.city_regions = {}
+        self.city_countries = {}
+        self.region_codes = {}
+        self.country_codes = {}
+        self.names = {}
+        self.city_boundaries = BoundaryIndex()
+        self.region_boundaries = BoundaryIndex()
+        self.country_boundaries = BoundaryIndex()
+
+    @classmethod
+    def load(cls):
+        state = cls()
+        box_fields = [
+            'boundary', 'min_latitude', 'min_longitude', 'max_latitude',
+            'max_longitude'
+        ]
+
+        ids, points = [], []
+        cities = City.objects.values_list(
+            'pk', 'code', 'region_id', 'country_id', 'latitude', 'longitude',
+            *box_fields
+        )
+        for (city_id, code, region_id, country_id, latitude, longitude,
+             *place) in cities.iterator(chunk_size=5000):
+            state.city_codes[city_id] = code
+            state.city_regions[city_id] = region_id
+            state.city_countries[city_id] = country_id
+            if latitude is not None and longitude is not None:
+                ids.append(city_id)
+                points.append(_unit_vector(latitude, longitude))
+            box = _box(place)
+            if box:
+                state.city_boundaries.add(city_id, box, place[0])
+        state.tree = KDTree(ids, points)
+
+        for model, codes, boundaries in [
+                (Region, state.region_codes, state.region_boundaries),
+                (Country, state.country_codes, state.country_boundaries)]:
+            for place_id, code, *place in model.objects.values_list(
+                    'pk', 'code', *box_fields).iterator(chunk_size=5000):
+                codes[place_id] = code
+                box = _box(place)
+                if box:
+                    boundaries.add(place_id, box, place[0])
+
+        for kind, translations, owner in [
+                ('city', CityTranslation, 'city_id'),
+                ('region', RegionTranslation, 'region_id'),
+                ('country', CountryTranslation, 'country_id')]:
+            rows = translations.objects.values_list('language_code', owner, 'name')
+            for language, place_id, name in rows.iterator(chunk_size=5000):
+                state.names.setdefault((kind, language), {})[place_id] = name
+        return state
+
+    def _place(self, kind, language, place_id, codes, contains):
+        if place_id is None:
+            return None
+        return {
+            'id': place_id,
+            'code': codes.get(place_id),
+            'name': self.names.get((kind, language), {}).get(place_id),
+            'contains': contains,
+        }
+
+    def reverse(self, latitude, longitude, language):
+        """
+        Finds the city, region and country of a point: the ones containing
+        it, if there are any, otherwise the nearest city and its region and
+        country
+        """
+        city_id = self.city_boundaries.containing(latitude, longitude)
+        distance = None
+        if city_id is None:
+            nearest = self.tree.nearest(latitude, longitude)
+            if nearest:
+                city_id, distance = nearest
+
+        region_id = self.region_boundaries.containing(latitude, longitude)
+        country_id = self.country_boundaries.containing(latitude, longitude)
+
+        city = self._place(
+            'city', language, city_id, self.city_codes, distance is None
+        )
+        if city:
+            city['distance'] = round(distance, 3) if distance is not None else 0
+        return {
+            'city': city,
+            'region': self._place(
+                'region', language,
+                region_id or self.city_regions.get(city_id),
+                self.region_codes, region_id is not None
+            ),
+            'country': self._place(
+                'country', language,
+                country_id or self.city_countries.get(city_id),
+                self.country_codes, country_id is not None
+            ),
+        }
+
+    def memory_footprint(self):
+        footprint = {
+            'tree': self.tree.memory_footprint(),
+            'cities': sum(
+                sys.getsizeof(mapping) for mapping in
+                (self.city_codes, self.city_regions, self.city_countries)
+            ),
+            'names': sum(
+                sys.getsizeof(names) + sum(sys.getsizeof(name) for name in names.values())
+                for names in self.names.values()
+            ),
+            'boundaries': sum(
+                index.memory_footprint() for index in
+                (self.city_boundaries, self.region_boundaries, self.country_boundaries)
+            ),
+        }
+        footprint['total'] = sum(footprint.values())
+        return footprint
+
+
+class GeocodingEngine(VersionedEngine):
+    """
+    Reverse geocodes points from worker memory: a k-d tree over the cities'
+    locations and a grid over the places' bounding boxes. Workers check
+    every PLACES_GEOCODING_REFRESH seconds whether the data changed, and
+    rebuild it in a background thread then, answering from the old one
+    meanwhile. Only the first query waits for it, unless it's loaded at
+    startup (see preload)
+    """
+
+    state_class = GeocodingState
+    refresh_setting = 'PLACES_GEOCODING_REFRESH'
+
+    def reverse(self, latitude, longitude, language):
+        self._ensure_fresh()
+        return self.state.reverse(latitude, longitude, language)
+
+    def memory_footprint(self):
+        if self.state is None:
+            return {'total': 0}
+        return self.state.memory_footprint()
+
+
+engine = GeocodingEngine()
+
+
+def preload():
+    """
+    Builds the engine at worker startup (wsgi.py, asgi.py, passenger_wsgi.py),
+    when PLACES_GEOCODING_PRELOAD is set
+    """
+    if not getattr(settings, 'PLACES_GEOCODING_PRELOAD', False):
+        return
+    try:
+        engine.build()
+    except (DatabaseError, ConnectionInterrupted, RedisError):
+        # e.g. the database isn't migrated yet or the cache is down, it's
+        # built on the first query
+        logger.warning('Could not preload the geocoding engine', exc_info=True)
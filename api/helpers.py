@@ -1,13 +1,66 @@
+import csv
+import io
+
+import pyexcel
+
+from django.conf import settings
+from django.db import connection, transaction
 from django.utils.translation import gettext_lazy as _
+from api.caching import bump_dataset_version
+from api.changes import record_changes, record_imported_changes
+from api.documents import invalidate_city_documents
+from api.normalization import normalize_search_text
 from api.models import (
     Country, Region, City,
     CountryTranslation, RegionTranslation, CityTranslation,
-    LanguageChoices, CurrencyCodeChoices
+    LanguageChoices, CurrencyCodeChoices, PlaceKindChoices
 )
 
+# Rows written per query by the bulk imports
+BULK_BATCH_SIZE = 1000
+
+# Files from this size on are imported with the streaming import, rows are
+# validated and copied to the database in chunks of STREAMING_CHUNK_SIZE
+STREAMING_IMPORT_SIZE = getattr(settings, 'PLACES_STREAMING_IMPORT_SIZE', 5 * 1024 * 1024)
+STREAMING_CHUNK_SIZE = 5000
+STREAMING_MAX_ERRORS = 50
+# Lengths of the columns of the staging tables, the same as the models'
+REGION_CODE_LENGTH = Region._meta.get_field('code').max_length
+LOCAL_CODE_LENGTH = Region._meta.get_field('local_code').max_length
+CITY_CODE_LENGTH = City._meta.get_field('code').max_length
+NAME_LENGTH = CityTranslation._meta.get_field('name').max_length
+
+# Codes like '05001' must be read as they are, not as numbers
+TEXT_CELLS = {
+    'auto_detect_int': False,
+    'auto_detect_float': False,
+    'auto_detect_datetime': False
+}
+
+
+class ImportReport(object):
+    """What an import did with the rows of the uploaded file"""
+
+    def __init__(self, errors=None):
+        self.errors = errors or []
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
 
-def handle_uploaded_countries(file):
-    """ Handle the file with the countries' information"""
+    def __str__(self):
+        return _("%(inserted)d inserted, %(updated)d updated, %(unchanged)d unchanged") % {
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'unchanged': self.unchanged
+        }
+
+
+def handle_uploaded_countries(file, progress=None):
+    """
+    Handle the file with the countries' information, returns an ImportReport
+    with the errors found, or the rows inserted, updated and unchanged.
+    'progress' is called with the number of rows read after every row
+    """
     errors = []
     array = file.get_array()
     headers = array[0]
@@ -31,11 +84,13 @@ def handle_uploaded_countries(file):
         )
 
     if not errors:
-        for country_array in countries:
+        report = ImportReport()
+        for rows, country_array in enumerate(countries, start=1):
             if country_array[0].strip() != '':
                 country, country_created = Country.objects.get_or_create(
                     code=country_array[0]
                 )
+                changed = country.currency_code != country_array[1]
                 country.currency_code = country_array[1]
 
                 country.save()
@@ -46,15 +101,30 @@ def handle_uploaded_countries(file):
                         country=country
                     )
 
+                    changed = changed or translation.name != country_array[language]
                     translation.name = country_array[language]
 
                     translation.save()
-        return
-    return errors
+
+                if country_created:
+                    report.inserted += 1
+                elif changed:
+                    report.updated += 1
+                else:
+                    report.unchanged += 1
+            if progress is not None:
+                progress(rows)
+        bump_dataset_version()
+        return report
+    return ImportReport(errors)
 
 
-def handle_uploaded_regions(file, country_code):
-    """ Handle the file with the regions' information"""
+def handle_uploaded_regions(file, country_code, progress=None):
+    """
+    Handle the file with the regions' information, returns an ImportReport
+    with the errors found, or the rows inserted, updated and unchanged, see
+    handle_uploaded_countries for 'progress'
+    """
     errors = []
     array = file.get_array()
     headers = array[0]
@@ -92,12 +162,14 @@ def handle_uploaded_regions(file, country_code):
         # when creating countries instances, we can store here which of those
         # have been already instantiated, so we don't create an instance for
         # every specific region
-        for region_array in regions:
+        report = ImportReport()
+        for rows, region_array in enumerate(regions, start=1):
             if region_array[0].strip() != '':
                 region, region_created = Region.objects.get_or_create(
                     code=region_array[0],
                     country=countries_instances_created[region_array[2]]
                 )
+                changed = region.local_code != region_array[1]
                 region.local_code = region_array[1]
                 region.save()
 
@@ -107,14 +179,137 @@ def handle_uploaded_regions(file, country_code):
                         region=region
                     )
 
+                    changed = changed or translation.name != region_array[language]
                     translation.name = region_array[language]
                     translation.save()
-        return
-    return errors
 
+                if region_created:
+                    report.inserted += 1
+                elif changed:
+                    report.updated += 1
+                else:
+                    report.unchanged += 1
+            if progress is not None:
+                progress(rows)
+        bump_dataset_version()
+        return report
+    return ImportReport(errors)
+
+
+def upsert_cities(rows, languages, country, regions, report):
+    """
+    Set based import of the cities' rows (code, region code, country code
+    and a name per language), instead of a get_or_create per city and per
+    translation, the existing cities and translations of the country are
+    loaded once and only the new or changed ones are written, in batches
+    """
+    cities = dict(
+        (city.code, city)
+        for city in City.objects.filter(country=country).only(
+            'id', 'code', 'region_id', 'country_id'
+        )
+    )
+
+    new_cities = []
+    changed_cities = []
+    # The city and status of every row, rows repeating a code are counted
+    # as many times as they appear
+    statuses = []
+    for row in rows:
+        region = regions.get(row[1])
+        city = cities.get(row[0])
+        if city is None:
+            city = City(code=row[0], region=region, country=country)
+            cities[row[0]] = city
+            new_cities.append(city)
+            statuses.append([city, 'inserted'])
+        elif city.pk is not None and city.region_id != (region.pk if region else None):
+            city.region = region
+            changed_cities.append(city)
+            statuses.append([city, 'updated'])
+        else:
+            statuses.append([city, 'unchanged'])
+
+    City.objects.bulk_create(new_cities, batch_size=BULK_BATCH_SIZE)
+    City.objects.bulk_update(changed_cities, ['region'], batch_size=BULK_BATCH_SIZE)
+
+    translations = dict(
+        ((translation.city_id, translation.language_code), translation)
+        for translation in CityTranslation.objects.filter(
+            city__country=country,
+            language_code__in=languages
+        ).only('id', 'city_id', 'language_code', 'name')
+    )
+
+    new_translations = {}
+    changed_translations = {}
+    for row, status in zip(rows, statuses):
+        city = status[0]
+        for language, name in zip(languages, row[3:]):
+            translation = translations.get((city.pk, language))
+            if translation is None:
+                translation = CityTranslation(
+                    city=city,
+                    language_code=language,
+                    name=name,
+                    search_name=normalize_search_text(name)[:250]
+                )
+                translations[(city.pk, language)] = translation
+                new_translations[(city.pk, language)] = translation
+            elif translation.name != name:
+                translation.name = name
+                translation.search_name = normalize_search_text(name)[:250]
+                if translation.pk is not None:
+                    changed_translations[(city.pk, language)] = translation
+            else:
+                continue
+            if status[1] == 'unchanged':
+                status[1] = 'updated'
+
+    # Cities keep a copy of their English names, see AbstractPlace.name
+    cities = dict((city.pk, city) for city, _status in statuses)
+    named_cities = []
+    for (city_id, language), translation in {**new_translations, **changed_translations}.items():
+        if language == LanguageChoices.ENGLISH:
+            city = cities[city_id]
+            city.name = translation.name
+            city.search_name = translation.search_name
+            named_cities.append(city)
+
+    CityTranslation.objects.bulk_create(
+        new_translations.values(),
+        batch_size=BULK_BATCH_SIZE
+    )
+    CityTranslation.objects.bulk_update(
+        changed_translations.values(),
+        ['name', 'search_name'],
+        batch_size=BULK_BATCH_SIZE
+    )
+    City.objects.bulk_update(
+        named_cities,
+        ['name', 'search_name'],
+        batch_size=BULK_BATCH_SIZE
+    )
 
-def handle_uploaded_cities(file, country_code):
-    """ Handle the file with the cities' information"""
+    for city, status in statuses:
+        setattr(report, status, getattr(report, status) + 1)
+
+    # Bulk operations don't send the models' signals
+    changed = list(dict.fromkeys(
+        city.pk for city, status in statuses if status != 'unchanged'
+    ))
+    invalidate_city_documents(city_id__in=changed)
+    record_changes(PlaceKindChoices.CITY, changed)
+    return report
+
+
+def handle_uploaded_cities(file, country_code, progress=None):
+    """
+    Handle the file with the cities' information, returns an ImportReport
+    with the errors found, or the rows inserted, updated and unchanged.
+    Rows are imported all at once, 'progress' is called with the number of
+    rows read before that
+    """
     errors = []
     array = file.get_array()
     headers = array[0]
@@ -141,41 +336,405 @@ def handle_uploaded_cities(file, country_code):
     else:
         errors.append(_("You need to specify a country you want to upload the cities for"))
 
-    countries_instances_created = {}
-    for c in countries_codes:
+    country = None
+    if country_code:
         try:
-            countries_instances_created[c] = Country.objects.get(code=c)
+            country = Country.objects.get(code=country_code)
         except Country.DoesNotExist:
-            errors.append(_("The country with code %s does not exist") % c)
-            break
+            errors.append(_("The country with code %s does not exist") % country_code)
 
     regions_instances_created = {}
-    for r in regions_codes:
-        try:
-            regions_instances_created[r] = Region.objects.get(code=r)
-        except Region.DoesNotExist:
-            errors.append(_("The region with code %s does not exist") % r)
-            break
+    if country is not None:
+        regions_instances_created = dict(
+            (region.code, region)
+            for region in Region.objects.filter(country=country, code__in=regions_codes)
+        )
+        for r in regions_codes:
+            if r not in regions_instances_created:
+                errors.append(_("The region with code %s does not exist") % r)
+                break
 
-    if not errors:
-        # when creating countries instances, we can store here which of those
-        # have been already instantiated, so we don't create an instance for
-        # every specific region
-        for city_array in cities:
+    if errors:
+        return ImportReport(errors)
 
-            if city_array[0].strip() != '':
-                city, city_created = City.objects.get_or_create(
-                    code=city_array[0],
-                    region=regions_instances_created[city_array[1]],
-                    country=countries_instances_created[city_array[2]]
-                )
+    rows = [city_array for city_array in cities if city_array[0].strip() != '']
+    if progress is not None:
+        progress(len(cities))
+    with transaction.atomic():
+        report = upsert_cities(
+            rows, language_codes, country, regions_instances_created, ImportReport()
+        )
+    bump_dataset_version()
+    return report
 
-                for language in range(3, len(headers)):
-                    translation, translation_created = CityTranslation.objects.get_or_create(
-                        language_code=headers[language],
-                        city=city
+
+def iter_uploaded_rows(file):
+    """
+    Reads the rows of the uploaded file lazily, instead of loading the whole
+    workbook in memory like file.get_array() does
+    """
+    if hasattr(file, 'temporary_file_path'):
+        params = {'file_name': file.temporary_file_path()}
+    else:
+        # Files kept in memory by the upload handlers are small anyway
+        file.seek(0)
+        params = {
+            'file_type': file.name.split('.')[-1],
+            'file_content': file.read()
+        }
+    try:
+        for row in pyexcel.iget_array(**dict(params, **TEXT_CELLS)):
+            yield ['%s' % cell for cell in row]
+    finally:
+        pyexcel.free_resources()
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _copy_rows(cursor, table, columns, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    # Empty values are loaded as NULL, except for the names
+    cursor.copy_expert(
+        "COPY %s (%s) FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL (name, search_name))" % (
+            table, ', '.join(columns)
+        ),
+        buffer
+    )
+
+
+def _streaming_report(cursor, staging_table, result_table):
+    report = ImportReport()
+    cursor.execute(
+        "SELECT status, count(*) FROM ("
+        "  SELECT min(status) AS status FROM %s GROUP BY id"
+        ") AS changes GROUP BY status" % result_table
+    )
+    for status, count in cursor.fetchall():
+        setattr(report, status, count)
+    cursor.execute("SELECT count(DISTINCT code) FROM %s" % staging_table)
+    report.unchanged = cursor.fetchone()[0] - report.inserted - report.updated
+    return report
+
+
+def _copy_english_names(cursor, model, translations, owner, result_table):
+    """Copies the English names of the imported places to the places themselves"""
+    cursor.execute(
+        "UPDATE {place} p SET name = t.name, search_name = t.search_name"
+        "  FROM {translation} t"
+        "  WHERE t.{owner}_id = p.id AND t.language_code = %s"
+        "  AND p.id IN (SELECT id FROM {result})"
+        "  AND p.name IS DISTINCT FROM t.name".format(
+            place=model._meta.db_table,
+            translation=translations._meta.db_table,
+            owner=owner,
+            result=result_table
+        ),
+        [LanguageChoices.ENGLISH.value]
+    )
+
+
+def _length_errors(line, values):
+    """
+    Errors of the values of a line longer than their columns allow, as
+    (what the value is, value, maximum length), COPY would fail otherwise
+    """
+    return [
+        _("Line %(line)d: %(field)s is longer than %(length)d characters") % {
+            'line': line, 'field': field, 'length': length
+        }
+        for field, value, length in values if len(value) > length
+    ]
+
+
+def _name_lengths(languages, names):
+    return [
+        (_("the name in %s") % language, name, NAME_LENGTH)
+        for language, name in zip(languages, names)
+    ]
+
+
+def _validate_streaming_headers(headers):
+    if headers is None:
+        return [_("The file is empty")]
+    if not set(headers[3:]).issubset(set(LanguageChoices.values)):
+        return [
+            _("You're trying to upload translations with a "
+              "language codes that are not specified in the standard "
+              "ISO 639-1, please check the language headers in your file")
+        ]
+    return []
+
+
+def _streaming_country(country_code):
+    try:
+        return Country.objects.get(code=country_code)
+    except Country.DoesNotExist:
+        return None
+
+
+def stream_uploaded_regions(file, country_code, progress=None):
+    """
+    Streaming version of handle_uploaded_regions, for very large files.
+
+    Rows are read lazily, validated in chunks of STREAMING_CHUNK_SIZE and
+    loaded through COPY into a temporary staging table, which is then merged
+    into the regions and their translations with INSERT ... ON CONFLICT, so
+    the memory used doesn't depend on the size of the file.
+
+    'progress' is called with the number of rows read after every chunk
+    """
+    rows = iter_uploaded_rows(file)
+    headers = next(rows, None)
+    errors = _validate_streaming_headers(headers)
+    country = None
+    if not country_code:
+        errors.append(_("You need to specify a country you want to upload the regions for"))
+    else:
+        country = _streaming_country(country_code)
+        if country is None:
+            errors.append(_("The country with code %s does not exist") % country_code)
+    if errors:
+        return ImportReport(errors)
+
+    languages = headers[3:]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMPORARY TABLE region_import ("
+            "  line integer, code varchar({code}), local_code varchar({local_code}),"
+            "  language_code varchar(2), name varchar({name}), search_name varchar({name})"
+            ") ON COMMIT DROP".format(
+                code=REGION_CODE_LENGTH, local_code=LOCAL_CODE_LENGTH, name=NAME_LENGTH
+            )
+        )
+        cursor.execute(
+            "CREATE TEMPORARY TABLE region_import_result (id integer, status text) ON COMMIT DROP"
+        )
+
+        for chunk in _chunks(enumerate(rows, start=2), STREAMING_CHUNK_SIZE):
+            staging_rows = []
+            for line, row in chunk:
+                if not row or row[0].strip() == '':
+                    continue
+                if len(row) < 3 or row[2].strip() not in ('', country_code):
+                    errors.append(
+                        _("Line %(line)d: the region doesn't belong to the country %(country)s") % {
+                            'line': line, 'country': country_code
+                        }
                     )
-                    translation.name = city_array[language]
-                    translation.save()
-        return
-    return errors
+                    continue
+                code, local_code = row[0].strip(), row[1].strip()
+                too_long = _length_errors(line, [
+                    (_("the code"), code, REGION_CODE_LENGTH),
+                    (_("the local code"), local_code, LOCAL_CODE_LENGTH),
+                ] + _name_lengths(languages, row[3:]))
+                if too_long:
+                    errors.extend(too_long)
+                    continue
+                for language, name in zip(languages, row[3:]):
+                    staging_rows.append([
+                        line, code, local_code, language,
+                        name, normalize_search_text(name)[:NAME_LENGTH]
+                    ])
+            if len(errors) >= STREAMING_MAX_ERRORS:
+                break
+            _copy_rows(
+                cursor,
+                'region_import',
+                ['line', 'code', 'local_code', 'language_code', 'name', 'search_name'],
+                staging_rows
+            )
+            if progress is not None:
+                progress(chunk[-1][0] - 1)
+
+        if errors:
+            transaction.set_rollback(True)
+            return ImportReport(errors[:STREAMING_MAX_ERRORS])
+
+        cursor.execute(
+            "WITH merged AS ("
+            "  INSERT INTO {region} (code, local_code, country_id, name, search_name)"
+            "  SELECT DISTINCT ON (code) code, coalesce(local_code, ''), %s, '', ''"
+            "  FROM region_import ORDER BY code, line DESC"
+            "  ON CONFLICT ON CONSTRAINT unique_country_region"
+            "  DO UPDATE SET local_code = EXCLUDED.local_code"
+            "  WHERE {region}.local_code IS DISTINCT FROM EXCLUDED.local_code"
+            "  RETURNING id, xmax = 0 AS inserted"
+            ") INSERT INTO region_import_result"
+            "  SELECT id, CASE WHEN inserted THEN 'inserted' ELSE 'updated' END FROM merged".format(
+                region=Region._meta.db_table
+            ),
+            [country.pk]
+        )
+        cursor.execute(
+            "WITH merged AS ("
+            "  INSERT INTO {translation} (region_id, language_code, name, search_name)"
+            "  SELECT DISTINCT ON (r.id, s.language_code) r.id, s.language_code, s.name, s.search_name"
+            "  FROM region_import s JOIN {region} r ON r.code = s.code AND r.country_id = %s"
+            "  ORDER BY r.id, s.language_code, s.line DESC"
+            "  ON CONFLICT ON CONSTRAINT unique_language_region"
+            "  DO UPDATE SET name = EXCLUDED.name, search_name = EXCLUDED.search_name"
+            "  WHERE {translation}.name IS DISTINCT FROM EXCLUDED.name"
+            "  RETURNING region_id"
+            ") INSERT INTO region_import_result SELECT DISTINCT region_id, 'updated' FROM merged".format(
+                region=Region._meta.db_table,
+                translation=RegionTranslation._meta.db_table
+            ),
+            [country.pk]
+        )
+
+        _copy_english_names(cursor, Region, RegionTranslation, 'region', 'region_import_result')
+        report = _streaming_report(cursor, 'region_import', 'region_import_result')
+        record_imported_changes(cursor, PlaceKindChoices.REGION, 'region_import_result')
+        cursor.execute("SELECT DISTINCT id FROM region_import_result")
+        invalidate_city_documents(city__region_id__in=[row[0] for row in cursor.fetchall()])
+
+    bump_dataset_version()
+    return report
+
+
+def stream_uploaded_cities(file, country_code, progress=None):
+    """
+    Streaming version of handle_uploaded_cities, for very large files, see
+    stream_uploaded_regions
+    """
+    rows = iter_uploaded_rows(file)
+    headers = next(rows, None)
+    errors = _validate_streaming_headers(headers)
+    country = None
+    if not country_code:
+        errors.append(_("You need to specify a country you want to upload the cities for"))
+    else:
+        country = _streaming_country(country_code)
+        if country is None:
+            errors.append(_("The country with code %s does not exist") % country_code)
+    if errors:
+        return ImportReport(errors)
+
+    # Regions are just a few per country, we can keep them at hand
+    regions = dict(Region.objects.filter(country=country).values_list('code', 'pk'))
+
+    languages = headers[3:]
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMPORARY TABLE city_import ("
+            "  line integer, code varchar({code}), region_id integer,"
+            "  language_code varchar(2), name varchar({name}), search_name varchar({name})"
+            ") ON COMMIT DROP".format(code=CITY_CODE_LENGTH, name=NAME_LENGTH)
+        )
+        cursor.execute(
+            "CREATE TEMPORARY TABLE city_import_result (id integer, status text) ON COMMIT DROP"
+        )
+
+        for chunk in _chunks(enumerate(rows, start=2), STREAMING_CHUNK_SIZE):
+            staging_rows = []
+            for line, row in chunk:
+                if not row or row[0].strip() == '':
+                    continue
+                if len(row) < 3 or row[2].strip() not in ('', country_code):
+                    errors.append(
+                        _("Line %(line)d: the city doesn't belong to the country %(country)s") % {
+                            'line': line, 'country': country_code
+                        }
+                    )
+                    continue
+                region_code = row[1].strip()
+                if region_code and region_code not in regions:
+                    errors.append(
+                        _("Line %(line)d: the region with code %(region)s does not exist") % {
+                            'line': line, 'region': region_code
+                        }
+                    )
+                    continue
+                code = row[0].strip()
+                too_long = _length_errors(
+                    line,
+                    [(_("the code"), code, CITY_CODE_LENGTH)] + _name_lengths(languages, row[3:])
+                )
+                if too_long:
+                    errors.extend(too_long)
+                    continue
+                for language, name in zip(languages, row[3:]):
+                    staging_rows.append([
+                        line, code, regions.get(region_code, ''), language,
+                        name, normalize_search_text(name)[:NAME_LENGTH]
+                    ])
+            if len(errors) >= STREAMING_MAX_ERRORS:
+                break
+            _copy_rows(
+                cursor,
+                'city_import',
+                ['line', 'code', 'region_id', 'language_code', 'name', 'search_name'],
+                staging_rows
+            )
+            if progress is not None:
+                progress(chunk[-1][0] - 1)
+
+        if errors:
+            transaction.set_rollback(True)
+            return ImportReport(errors[:STREAMING_MAX_ERRORS])
+
+        cursor.execute(
+            "WITH merged AS ("
+            "  INSERT INTO {city} (code, region_id, country_id, geohash, name, search_name)"
+            "  SELECT DISTINCT ON (code) code, region_id, %s, '', '', ''"
+            "  FROM city_import ORDER BY code, line DESC"
+            "  ON CONFLICT ON CONSTRAINT unique_country_city"
+            "  DO UPDATE SET region_id = EXCLUDED.region_id"
+            "  WHERE {city}.region_id IS DISTINCT FROM EXCLUDED.region_id"
+            "  RETURNING id, xmax = 0 AS inserted"
+            ") INSERT INTO city_import_result"
+            "  SELECT id, CASE WHEN inserted THEN 'inserted' ELSE 'updated' END FROM merged".format(
+                city=City._meta.db_table
+            ),
+            [country.pk]
+        )
+        cursor.execute(
+            "WITH merged AS ("
+            "  INSERT INTO {translation} (city_id, language_code, name, search_name)"
+            "  SELECT DISTINCT ON (c.id, s.language_code) c.id, s.language_code, s.name, s.search_name"
+            "  FROM city_import s JOIN {city} c ON c.code = s.code AND c.country_id = %s"
+            "  ORDER BY c.id, s.language_code, s.line DESC"
+            "  ON CONFLICT ON CONSTRAINT unique_language_city"
+            "  DO UPDATE SET name = EXCLUDED.name, search_name = EXCLUDED.search_name"
+            "  WHERE {translation}.name IS DISTINCT FROM EXCLUDED.name"
+            "  RETURNING city_id"
+            ") INSERT INTO city_import_result SELECT DISTINCT city_id, 'updated' FROM merged".format(
+                city=City._meta.db_table,
+                translation=CityTranslation._meta.db_table
+            ),
+            [country.pk]
+        )
+
+        _copy_english_names(cursor, City, CityTranslation, 'city', 'city_import_result')
+        report = _streaming_report(cursor, 'city_import', 'city_import_result')
+        record_imported_changes(cursor, PlaceKindChoices.CITY, 'city_import_result')
+        cursor.execute("SELECT DISTINCT id FROM city_import_result")
+        invalidate_city_documents(city_id__in=[row[0] for row in cursor.fetchall()])
+
+    bump_dataset_version()
+    return report
+
+
+def import_uploaded_regions(file, country_code, progress=None):
+    """Picks the streaming import for files over PLACES_STREAMING_IMPORT_SIZE bytes"""
+    if file.size >= STREAMING_IMPORT_SIZE:
+        return stream_uploaded_regions(file, country_code, progress)
+    return handle_uploaded_regions(file, country_code, progress)
+
+
+def import_uploaded_cities(file, country_code, progress=None):
+    """Picks the streaming import for files over PLACES_STREAMING_IMPORT_SIZE bytes"""
+    if file.size >= STREAMING_IMPORT_SIZE:
+        return stream_uploaded_cities(file, country_code, progress)
+    return handle_uploaded_cities(file, country_code, progress)
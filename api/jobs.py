@@ -0,0 +1,138 @@
+import logging
+import os
+import threading
+from datetime import timedelta
+
+import pyexcel
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from api.caching import clear_job_progress, set_job_progress
+from api.helpers import (
+    TEXT_CELLS, handle_uploaded_countries, import_uploaded_regions,
+    import_uploaded_cities
+)
+from api.models import UploadJob, UploadKindChoices, UploadStatusChoices
+from api.warming import warm_after_upload
+
+__author__ = 'Bezur'
+
+__all__ = ['enqueue_upload', 'requeue_stale_jobs', 'claim_next_job', 'run_job']
+
+logger = logging.getLogger(__name__)
+
+# Running jobs whose worker hasn't given signs of life for this many seconds
+# are put back in the queue, see requeue_stale_jobs
+JOB_TIMEOUT = getattr(settings, 'PLACES_UPLOAD_JOB_TIMEOUT', 5 * 60)
+JOB_HEARTBEAT = JOB_TIMEOUT / 10
+
+IMPORTERS = {
+    UploadKindChoices.COUNTRIES: lambda file, country_code, progress: handle_uploaded_countries(file, progress),
+    UploadKindChoices.REGIONS: import_uploaded_regions,
+    UploadKindChoices.CITIES: import_uploaded_cities,
+}
+
+
+class StoredUpload(object):
+    """
+    Gives a file stored by an upload job the interface of the uploaded files
+    the import functions expect
+    """
+
+    def __init__(self, field_file):
+        self.path = field_file.path
+        self.name = os.path.basename(field_file.name)
+        self.size = field_file.size
+
+    def temporary_file_path(self):
+        return self.path
+
+    def get_array(self):
+        return [
+            ['%s' % cell for cell in row]
+            for row in pyexcel.get_array(file_name=self.path, **TEXT_CELLS)
+        ]
+
+
+def enqueue_upload(kind, file, country_code=''):
+    job = UploadJob(kind=kind, country_code=country_code)
+    job.file.save(file.name, file, save=False)
+    job.save()
+    return job
+
+
+def requeue_stale_jobs():
+    """
+    Puts back in the queue the running jobs whose worker died, the ones
+    without a heartbeat for JOB_TIMEOUT seconds, returns how many
+    """
+    stale = timezone.now() - timedelta(seconds=JOB_TIMEOUT)
+    requeued = UploadJob.objects.filter(
+        Q(heartbeat_at__lt=stale) | Q(heartbeat_at__isnull=True, started_at__lt=stale),
+        status=UploadStatusChoices.RUNNING
+    ).update(status=UploadStatusChoices.PENDING, started_at=None, heartbeat_at=None)
+    if requeued:
+        logger.warning('Requeued %d stale upload jobs', requeued)
+    return requeued
+
+
+def claim_next_job():
+    """
+    Takes the oldest pending job, rows are locked with SKIP LOCKED, so
+    several workers can run at the same time
+    """
+    requeue_stale_jobs()
+    with transaction.atomic():
+        job = UploadJob.objects.select_for_update(skip_locked=True).filter(
+            status=UploadStatusChoices.PENDING
+        ).order_by('pk').first()
+        if job is not None:
+            job.status = UploadStatusChoices.RUNNING
+            job.started_at = job.heartbeat_at = timezone.now()
+            job.save(update_fields=['status', 'started_at', 'heartbeat_at'])
+    return job
+
+
+def _heartbeat(job_id, stopped):
+    try:
+        while not stopped.wait(JOB_HEARTBEAT):
+            UploadJob.objects.filter(pk=job_id).update(heartbeat_at=timezone.now())
+    finally:
+        # The thread has its own connection, outside of the import's transaction
+        connection.close()
+
+
+def run_job(job):
+    def progress(rows):
+        set_job_progress(job.pk, rows)
+
+    stopped = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job.pk, stopped), daemon=True)
+    heartbeat.start()
+    try:
+        report = IMPORTERS[job.kind](StoredUpload(job.file), job.country_code, progress)
+    except Exception as e:
+        logger.exception('Upload job %s failed', job.pk)
+        job.status = UploadStatusChoices.FAILED
+        job.errors = [str(e)]
+    else:
+        job.status = UploadStatusChoices.FAILED if report.errors else UploadStatusChoices.DONE
+        job.errors = [str(error) for error in report.errors]
+        job.inserted = report.inserted
+        job.updated = report.updated
+        job.unchanged = report.unchanged
+        job.rows_read = report.inserted + report.updated + report.unchanged
+    finally:
+        stopped.set()
+        heartbeat.join()
+    job.finished_at = timezone.now()
+    # The uploaded file is only needed by the import
+    job.file.delete(save=False)
+    job.save()
+    clear_job_progress(job.pk)
+    if job.status == UploadStatusChoices.DONE:
+        warm_after_upload()
+    return job
@@ -0,0 +1,49 @@
+import threading
+import time
+from collections import OrderedDict
+
+__author__ = 'Bezur'
+
+__all__ = ['LRUCache']
+
+
+class LRUCache(object):
+    """
+    Bounded in-process cache: at most 'max_entries' entries, each one kept
+    for 'ttl' seconds at most, the least recently used ones are evicted
+    first. It's shared by the threads of the process
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.autocomplete import engine
+
+
+class Command(BaseCommand):
+    help = 'Builds the in-process autocomplete index and reports its size and memory footprint'
+
+    def handle(self, *args, **options):
+        elapsed = engine.build()
+        self.stdout.write('Index built in %.2f seconds' % elapsed)
+
+        for language, names in sorted(engine.state.names.items()):
+            self.stdout.write('  %s: %d names' % (language, len(names)))
+        self.stdout.write('  cities: %d' % len(engine.state.cities))
+        self.stdout.write('  zip codes: %d' % len(engine.state.zip_codes))
+
+        self.stdout.write('Memory footprint:')
+        for name, size in engine.memory_footprint().items():
+            self.stdout.write('  %s: %.1f KiB' % (name, size / 1024))
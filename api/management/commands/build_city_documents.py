@@ -0,0 +1,31 @@
+from itertools import product
+
+from django.core.management.base import BaseCommand
+
+from api.documents import get_city_documents
+from api.models import City, LanguageChoices
+
+
+class Command(BaseCommand):
+    help = 'Renders the documents of the cities that have not been rendered yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--country', help='Only the cities of this country code')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        cities = City.objects.order_by('pk')
+        if options['country']:
+            cities = cities.filter(country__code=options['country'])
+        city_ids = list(cities.values_list('pk', flat=True))
+
+        batch_size = options['batch_size']
+        languages = LanguageChoices.values
+        for language, extra_lang in product(languages, [''] + languages):
+            if extra_lang == language:
+                continue
+            for i in range(0, len(city_ids), batch_size):
+                get_city_documents(city_ids[i:i + batch_size], language, extra_lang)
+            self.stdout.write('Documents in %s%s: %d cities' % (
+                language, '+%s' % extra_lang if extra_lang else '', len(city_ids)
+            ))
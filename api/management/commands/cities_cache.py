@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from api.caching import bump_dataset_version, cities_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Reports the hits and misses of the cities endpoint cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--invalidate',
+            action='store_true',
+            help='Bumps the dataset version, so every cached response is discarded'
+        )
+
+    def handle(self, *args, **options):
+        if options['invalidate']:
+            self.stdout.write('Dataset version bumped to %s' % bump_dataset_version())
+
+        stats = cities_cache_stats()
+        self.stdout.write('Dataset version: %s' % stats['version'])
+        self.stdout.write('Hits: %d' % stats['hits'])
+        self.stdout.write('Misses: %d' % stats['misses'])
+        self.stdout.write('Hit ratio: %.2f%%' % (stats['hit_ratio'] * 100))
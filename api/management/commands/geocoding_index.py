@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.geocoding import engine
+
+
+class Command(BaseCommand):
+    help = 'Builds the in-process reverse geocoding structures and reports their memory footprint'
+
+    def handle(self, *args, **options):
+        elapsed = engine.build()
+        self.stdout.write('Index built in %.2f seconds' % elapsed)
+        self.stdout.write('  located cities: %d' % len(engine.state.tree))
+
+        self.stdout.write('Memory footprint:')
+        for name, size in engine.memory_footprint().items():
+            self.stdout.write('  %s: %.1f KiB' % (name, size / 1024))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.snapshots import build_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Exports the whole places dataset as compressed, content-addressed snapshot files'
+
+    def handle(self, *args, **options):
+        manifest = build_snapshot()
+        self.stdout.write('Snapshot of the dataset version %s' % manifest['version'])
+        for file_format, snapshot in manifest['files'].items():
+            self.stdout.write('  %s: %s (%.1f KiB)' % (
+                file_format, snapshot['name'], snapshot['size'] / 1024
+            ))
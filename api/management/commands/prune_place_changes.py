@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.changes import CHANGES_RETENTION_DAYS, prune_changes
+
+
+class Command(BaseCommand):
+    help = 'Deletes the old changes of the changes feed, e.g. daily'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=CHANGES_RETENTION_DAYS,
+            help='Keep the changes of the last days'
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_changes(options['days'])
+        self.stdout.write('Deleted %d changes' % deleted)
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.jobs import claim_next_job, run_job
+
+
+class Command(BaseCommand):
+    help = 'Imports the uploaded files queued by the upload views'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Processes the pending jobs and exits'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2,
+            help='Seconds to wait for new jobs when the queue is empty'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+                continue
+
+            job = run_job(job)
+            self.stdout.write('%s: %s inserted, %s updated, %s unchanged, %d errors' % (
+                job, job.inserted, job.updated, job.unchanged, len(job.errors)
+            ))
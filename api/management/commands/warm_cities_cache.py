@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from api.models import LanguageChoices
+from api.warming import WARM_TOP, WARM_WORKERS, warm_cities_cache
+
+
+class Command(BaseCommand):
+    help = 'Caches the most requested queries of the cities endpoint, e.g. after a deploy'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--language',
+            action='append',
+            choices=LanguageChoices.values,
+            help='Only the queries in this language, can be repeated'
+        )
+        parser.add_argument('--top', type=int, default=WARM_TOP)
+        parser.add_argument('--workers', type=int, default=WARM_WORKERS)
+
+    def handle(self, *args, **options):
+        report = warm_cities_cache(
+            options['language'], options['top'], options['workers']
+        )
+        self.stdout.write('Queries: %d' % report.queries)
+        self.stdout.write('Warmed: %d' % report.warmed)
+        self.stdout.write('Already cached: %d' % report.cached)
+        self.stdout.write('Failed: %d' % report.failed)
+        self.stdout.write('Took: %.2f seconds' % report.seconds)
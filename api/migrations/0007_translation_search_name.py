@@ -0,0 +1,72 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:15
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+from api.normalization import normalize_search_text
+
+
+def populate_search_names(apps, schema_editor):
+    for model_name in ['CountryTranslation', 'RegionTranslation', 'CityTranslation']:
+        model = apps.get_model('api', model_name)
+        batch = []
+        for translation in model.objects.only('id', 'name').iterator(chunk_size=2000):
+            translation.search_name = normalize_search_text(translation.name)[:250]
+            batch.append(translation)
+            if len(batch) >= 2000:
+                model.objects.bulk_update(batch, ['search_name'])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, ['search_name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_auto_20200325_1744'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='citytranslation',
+            name='search_name',
+            field=models.CharField(blank=True, default='', editable=False, max_length=250),
+        ),
+        migrations.AddField(
+            model_name='countrytranslation',
+            name='search_name',
+            field=models.CharField(blank=True, default='', editable=False, max_length=250),
+        ),
+        migrations.AddField(
+            model_name='regiontranslation',
+            name='search_name',
+            field=models.CharField(blank=True, default='', editable=False, max_length=250),
+        ),
+        migrations.RunPython(populate_search_names, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='citytranslation',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_name'], name='city_search_name_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='citytranslation',
+            index=models.Index(fields=['language_code', 'search_name'], name='city_search_name_prefix', opclasses=['varchar_pattern_ops', 'varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='countrytranslation',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_name'], name='country_search_name_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='countrytranslation',
+            index=models.Index(fields=['language_code', 'search_name'], name='country_search_name_prefix', opclasses=['varchar_pattern_ops', 'varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='regiontranslation',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_name'], name='region_search_name_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='regiontranslation',
+            index=models.Index(fields=['language_code', 'search_name'], name='region_search_name_prefix', opclasses=['varchar_pattern_ops', 'varchar_pattern_ops']),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_translation_search_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CityDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language_code', models.CharField(choices=[('en', 'English'), ('es', 'Spanish')], max_length=2)),
+                ('extra_language_code', models.CharField(blank=True, choices=[('en', 'English'), ('es', 'Spanish')], default='', max_length=2)),
+                ('body', models.TextField()),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='documents', to='api.City')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='citydocument',
+            constraint=models.UniqueConstraint(fields=('city', 'language_code', 'extra_language_code'), name='unique_city_document'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_upload_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='zipcode',
+            name='number',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+        migrations.RunSQL(
+            "UPDATE api_zipcode SET number = zip_code::integer WHERE zip_code ~ '^[0-9]+$'",
+            migrations.RunSQL.noop
+        ),
+        migrations.AddIndex(
+            model_name='zipcode',
+            index=models.Index(fields=['number', 'zip_code'], name='zip_code_number'),
+        ),
+        migrations.AddIndex(
+            model_name='zipcode',
+            index=models.Index(fields=['zip_code'], name='zip_code_prefix', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
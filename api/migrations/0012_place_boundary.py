@@ -0,0 +1,29 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:33
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_place_location'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='boundary',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='country',
+            name='boundary',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='region',
+            name='boundary',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, null=True),
+        ),
+    ]
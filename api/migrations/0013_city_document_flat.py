@@ -0,0 +1,26 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_place_boundary'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='citydocument',
+            name='unique_city_document',
+        ),
+        migrations.AddField(
+            model_name='citydocument',
+            name='flat',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddConstraint(
+            model_name='citydocument',
+            constraint=models.UniqueConstraint(fields=('city', 'language_code', 'extra_language_code', 'flat'), name='unique_city_document'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_city_document_flat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaceChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('country', 'Country'), ('region', 'Region'), ('city', 'City')], max_length=10)),
+                ('place_id', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
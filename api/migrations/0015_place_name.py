@@ -0,0 +1,64 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_place_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='name',
+            field=models.CharField(blank=True, default='', editable=False, max_length=250),
+        ),
+        migrations.AddField(
+            model_name='city',
+            name='search_name',
+            field=models.CharField(blank=True, default='', editable=False, max_length=250),
+        ),
+        migrations.AddField(
+            model_name='country',
+            name='name',
+            field=models.CharField(blank=True, default='', editable=False, max_length=250),
+        ),
+        migrations.AddField(
+            model_name='country',
+            name='search_name',
+            field=models.CharField(blank=True, default='', editable=False, max_length=250),
+        ),
+        migrations.AddField(
+            model_name='region',
+            name='name',
+            field=models.CharField(blank=True, default='', editable=False, max_length=250),
+        ),
+        migrations.AddField(
+            model_name='region',
+            name='search_name',
+            field=models.CharField(blank=True, default='', editable=False, max_length=250),
+        ),
+        migrations.RunSQL(
+            [
+                "UPDATE api_%(place)s p SET name = t.name, search_name = t.search_name"
+                " FROM api_%(place)stranslation t"
+                " WHERE t.%(place)s_id = p.id AND t.language_code = 'en'" % {'place': place}
+                for place in ['country', 'region', 'city']
+            ],
+            migrations.RunSQL.noop
+        ),
+        migrations.AddIndex(
+            model_name='city',
+            index=models.Index(fields=['search_name'], name='city_name_prefix', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='country',
+            index=models.Index(fields=['search_name'], name='country_name_prefix', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='region',
+            index=models.Index(fields=['search_name'], name='region_name_prefix', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
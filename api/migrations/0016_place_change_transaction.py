@@ -0,0 +1,24 @@
+# Generated by Django 3.0.3 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_place_name'),
+    ]
+
+    operations = [
+        # Changes recorded so far are older than any transaction in flight
+        migrations.AddField(
+            model_name='placechange',
+            name='transaction_id',
+            field=models.BigIntegerField(default=0, editable=False),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='placechange',
+            index=models.Index(fields=['transaction_id', 'id'], name='place_change_position'),
+        ),
+    ]
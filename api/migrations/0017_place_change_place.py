@@ -0,0 +1,17 @@
+# Generated by Django 3.0.3 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_place_change_transaction'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='placechange',
+            index=models.Index(fields=['kind', 'place_id'], name='place_change_place'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.3 on 2026-10-18 16:45
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_upload_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PlaceSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('manifest', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -1,13 +1,22 @@
 from django.db import models
-from django.core.validators import RegexValidator
+from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.core.validators import (
+    MaxValueValidator, MinValueValidator, RegexValidator
+)
 from django.utils.translation import gettext_lazy as _
 
+from api.geo import encode_geohash
+from api.normalization import normalize_search_text
+
 __author__ = 'Bezur'
 
 __all__ = [
     'Country', 'Region', 'City', 'CountryTranslation',
-    'RegionTranslation', 'CityTranslation', 'ZipCode',
-    'LanguageChoices', 'CurrencyCodeChoices'
+    'RegionTranslation', 'CityTranslation', 'ZipCode', 'CityDocument',
+    'UploadJob', 'PlaceChange', 'PlaceSnapshot', 'LanguageChoices',
+    'CurrencyCodeChoices', 'UploadKindChoices', 'UploadStatusChoices',
+    'PlaceKindChoices'
 ]
 
 
@@ -95,6 +104,31 @@ class LanguageChoices(models.TextChoices):
     SPANISH = 'es', _('Spanish')
 
 
+class UploadKindChoices(models.TextChoices):
+    """What an uploaded file contains"""
+
+    COUNTRIES = 'countries', _('Countries')
+    REGIONS = 'regions', _('Regions')
+    CITIES = 'cities', _('Cities')
+
+
+class PlaceKindChoices(models.TextChoices):
+    """Kinds of places recorded by the change log"""
+
+    COUNTRY = 'country', _('Country')
+    REGION = 'region', _('Region')
+    CITY = 'city', _('City')
+
+
+class UploadStatusChoices(models.TextChoices):
+    """Where an upload job is at"""
+
+    PENDING = 'pending', _('Pending')
+    RUNNING = 'running', _('Running')
+    DONE = 'done', _('Done')
+    FAILED = 'failed', _('Failed')
+
+
 class AbstractTranslation(models.Model):
     """
     This abstract model will define the translations of any model
@@ -106,6 +140,31 @@ class AbstractTranslation(models.Model):
         choices=LanguageChoices.choices
     )
     name = models.CharField(max_length=250)
+    # Unaccented and case folded copy of the name, this is the column the
+    # search endpoint looks up through the trigram and prefix indexes
+    search_name = models.CharField(
+        max_length=250,
+        blank=True,
+        default='',
+        editable=False
+    )
+
+    # Name of the foreign key to the translated place
+    place_field = None
+
+    def save(self, *args, **kwargs):
+        self.search_name = normalize_search_text(self.name)[:250]
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'search_name'}
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return "%s in %s is %s" % (
+            getattr(self, self.place_field),
+            LanguageChoices(self.language_code).label,
+            self.name
+        )
 
     class Meta:
         abstract = True
@@ -119,7 +178,10 @@ def flag_path(instance, filename):
 
 
 class AbstractPlace(models.Model):
-    """ By now, models just share the 'flags' attribute"""
+    """
+    Places share the 'flags' attribute and their location, a point and,
+    optionally, the bounding box and the boundary of the place
+    """
 
     # for Django forms to display this field as non
     # required, we add blank true
@@ -128,6 +190,67 @@ class AbstractPlace(models.Model):
         null=True,
         blank=True
     )
+    latitude = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-90), MaxValueValidator(90)]
+    )
+    longitude = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-180), MaxValueValidator(180)]
+    )
+    min_latitude = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-90), MaxValueValidator(90)]
+    )
+    min_longitude = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-180), MaxValueValidator(180)]
+    )
+    max_latitude = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-90), MaxValueValidator(90)]
+    )
+    max_longitude = models.FloatField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(-180), MaxValueValidator(180)]
+    )
+
+    # GeoJSON MultiPolygon coordinates of the place's boundary: a list of
+    # polygons, each one a list of rings (the outer one first, then the
+    # holes) of [longitude, latitude] positions
+    boundary = JSONField(
+        null=True,
+        blank=True
+    )
+
+    # Copy of the English translation's name and search name (empty if
+    # there's none), kept in sync by api.signals and the uploads, so the
+    # common language needs no join with the translations
+    name = models.CharField(
+        max_length=250,
+        blank=True,
+        default='',
+        editable=False
+    )
+    search_name = models.CharField(
+        max_length=250,
+        blank=True,
+        default='',
+        editable=False
+    )
+
+    @property
+    def located(self):
+        return self.latitude is not None and self.longitude is not None
+
+    def __str__(self):
+        return self.name or self.code
 
     class Meta:
         abstract = True
@@ -148,11 +271,14 @@ class Country(AbstractPlace):
         blank=True
     )
 
-    def __str__(self):
-        country_translation = self.country_translations.filter(
-            language_code=LanguageChoices.ENGLISH
-        )
-        return country_translation[0].name if country_translation else self.code
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['search_name'],
+                name='country_name_prefix',
+                opclasses=['varchar_pattern_ops']
+            ),
+        ]
 
 
 class Region(AbstractPlace):
@@ -174,13 +300,6 @@ class Region(AbstractPlace):
         related_name='regions'
     )
 
-    def __str__(self):
-        region_translation = self.region_translations.filter(
-            language_code=LanguageChoices.ENGLISH
-        )
-
-        return region_translation[0].name if region_translation else self.code
-
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -188,6 +307,13 @@ class Region(AbstractPlace):
                 name='unique_country_region'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['search_name'],
+                name='region_name_prefix',
+                opclasses=['varchar_pattern_ops']
+            ),
+        ]
 
 
 class City(AbstractPlace):
@@ -211,12 +337,22 @@ class City(AbstractPlace):
         on_delete=models.CASCADE,
         related_name='cities'
     )
+    # Geohash of the city's location, for the nearby cities lookups
+    geohash = models.CharField(
+        max_length=12,
+        blank=True,
+        default='',
+        editable=False
+    )
 
-    def __str__(self):
-        city_translation = self.city_translations.filter(
-            language_code=LanguageChoices.ENGLISH
+    def save(self, *args, **kwargs):
+        self.geohash = (
+            encode_geohash(self.latitude, self.longitude) if self.located else ''
         )
-        return city_translation[0].name if city_translation else self.code
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        super().save(*args, **kwargs)
 
     class Meta:
         constraints = [
@@ -225,6 +361,18 @@ class City(AbstractPlace):
                 name='unique_country_city'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['geohash'],
+                name='city_geohash',
+                opclasses=['varchar_pattern_ops']
+            ),
+            models.Index(
+                fields=['search_name'],
+                name='city_name_prefix',
+                opclasses=['varchar_pattern_ops']
+            ),
+        ]
 
 
 class ZipCode(models.Model):
@@ -239,10 +387,35 @@ class ZipCode(models.Model):
         validators=[RegexValidator(r'^\d{1,10}$')],
         unique=True
     )
+    # Numeric value of the zip code, for the range queries
+    number = models.PositiveIntegerField(
+        null=True,
+        editable=False
+    )
+
+    def save(self, *args, **kwargs):
+        self.number = int(self.zip_code) if self.zip_code.isdigit() else None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'zip_code' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'number'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.zip_code
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['number', 'zip_code'],
+                name='zip_code_number'
+            ),
+            models.Index(
+                fields=['zip_code'],
+                name='zip_code_prefix',
+                opclasses=['varchar_pattern_ops']
+            ),
+        ]
+
 
 class CountryTranslation(AbstractTranslation):
     country = models.ForeignKey(
@@ -251,12 +424,7 @@ class CountryTranslation(AbstractTranslation):
         related_name='country_translations'
     )
 
-    def __str__(self):
-        return "%s in %s is %s" % (
-            self.country,
-            LanguageChoices(self.language_code).name,
-            self.name
-        )
+    place_field = 'country'
 
     class Meta:
         constraints = [
@@ -265,6 +433,18 @@ class CountryTranslation(AbstractTranslation):
                 name='unique_language_country'
             )
         ]
+        indexes = [
+            GinIndex(
+                fields=['search_name'],
+                name='country_search_name_trgm',
+                opclasses=['gin_trgm_ops']
+            ),
+            models.Index(
+                fields=['language_code', 'search_name'],
+                name='country_search_name_prefix',
+                opclasses=['varchar_pattern_ops', 'varchar_pattern_ops']
+            ),
+        ]
 
 
 class RegionTranslation(AbstractTranslation):
@@ -274,12 +454,7 @@ class RegionTranslation(AbstractTranslation):
         related_name='region_translations'
     )
 
-    def __str__(self):
-        return "%s in %s is %s" % (
-            self.region,
-            LanguageChoices(self.language_code).label,
-            self.name
-        )
+    place_field = 'region'
 
     class Meta:
         constraints = [
@@ -288,6 +463,18 @@ class RegionTranslation(AbstractTranslation):
                 name='unique_language_region'
             )
         ]
+        indexes = [
+            GinIndex(
+                fields=['search_name'],
+                name='region_search_name_trgm',
+                opclasses=['gin_trgm_ops']
+            ),
+            models.Index(
+                fields=['language_code', 'search_name'],
+                name='region_search_name_prefix',
+                opclasses=['varchar_pattern_ops', 'varchar_pattern_ops']
+            ),
+        ]
 
 
 class CityTranslation(AbstractTranslation):
@@ -297,12 +484,7 @@ class CityTranslation(AbstractTranslation):
         related_name='city_translations'
     )
 
-    def __str__(self):
-        return "%s in %s is %s" % (
-            self.city,
-            LanguageChoices(self.language_code).label,
-            self.name
-        )
+    place_field = 'city'
 
     class Meta:
         constraints = [
@@ -310,4 +492,130 @@ class CityTranslation(AbstractTranslation):
                 fields=['language_code', 'city'],
                 name='unique_language_city'
             )
-        ]
\ No newline at end of file
+        ]
+        indexes = [
+            GinIndex(
+                fields=['search_name'],
+                name='city_search_name_trgm',
+                opclasses=['gin_trgm_ops']
+            ),
+            models.Index(
+                fields=['language_code', 'search_name'],
+                name='city_search_name_prefix',
+                opclasses=['varchar_pattern_ops', 'varchar_pattern_ops']
+            ),
+        ]
+
+
+class CityDocument(models.Model):
+    """
+    The city, as the cities endpoint returns it, already rendered to JSON
+    for a specific pair of languages ('extra_language_code' is empty when
+    no extra language was asked), either the full document or the 'flat'
+    one, with only the names in those languages.
+
+    Documents are rendered on demand and removed whenever the city, its
+    region or its country change, see api.documents
+    """
+    city = models.ForeignKey(
+        'City',
+        on_delete=models.CASCADE,
+        related_name='documents'
+    )
+    language_code = models.CharField(
+        max_length=2,
+        choices=LanguageChoices.choices
+    )
+    extra_language_code = models.CharField(
+        max_length=2,
+        choices=LanguageChoices.choices,
+        blank=True,
+        default=''
+    )
+    flat = models.BooleanField(default=False)
+    body = models.TextField()
+
+    def __str__(self):
+        return "%s document in %s" % (self.city, self.language_code)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['city', 'language_code', 'extra_language_code', 'flat'],
+                name='unique_city_document'
+            )
+        ]
+
+
+class PlaceChange(models.Model):
+    """
+    Change log of the places data: a place of 'kind' changed, or was
+    deleted. Changes of the translations and zip codes are recorded as
+    changes of the place they belong to.
+
+    Changes are ordered by the transaction that made them, then by id, as
+    ids are handed out on insert, not on commit, see api.changes
+    """
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=10, choices=PlaceKindChoices.choices)
+    place_id = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Postgres' txid_current() of the transaction recording the change
+    transaction_id = models.BigIntegerField(editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['transaction_id', 'id'],
+                name='place_change_position'
+            ),
+            models.Index(fields=['kind', 'place_id'], name='place_change_place'),
+        ]
+
+    def __str__(self):
+        return "%s #%s changed" % (PlaceKindChoices(self.kind).label, self.place_id)
+
+
+class PlaceSnapshot(models.Model):
+    """
+    Manifest of a snapshot of the whole dataset, the last one is the
+    current snapshot, see api.snapshots. Kept here instead of next to the
+    files, so it's replaced in a single step
+    """
+    manifest = JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return "Snapshot of the version %s" % self.manifest.get('version')
+
+
+class UploadJob(models.Model):
+    """
+    An uploaded file waiting to be imported, or already imported, by the
+    upload worker (see api.jobs), so the import doesn't block the request
+    """
+    kind = models.CharField(max_length=10, choices=UploadKindChoices.choices)
+    country_code = models.CharField(max_length=2, blank=True, default='')
+    file = models.FileField(upload_to='uploads')
+    status = models.CharField(
+        max_length=10,
+        choices=UploadStatusChoices.choices,
+        default=UploadStatusChoices.PENDING
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Refreshed by the worker while the job runs, see api.jobs.requeue_stale_jobs
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    rows_read = models.PositiveIntegerField(default=0)
+    inserted = models.PositiveIntegerField(default=0)
+    updated = models.PositiveIntegerField(default=0)
+    unchanged = models.PositiveIntegerField(default=0)
+    errors = JSONField(default=list, blank=True)
+
+    def __str__(self):
+        return "%s upload #%s (%s)" % (
+            UploadKindChoices(self.kind).label,
+            self.pk,
+            UploadStatusChoices(self.status).label
+        )
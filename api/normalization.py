@@ -0,0 +1,37 @@
+import re
+import unicodedata
+
+__author__ = 'Bezur'
+
+__all__ = ['normalize_search_text', 'split_search_query']
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_search_text(value):
+    """
+    Normalizes a text for searching purposes: strips the accents, folds the
+    case and collapses the whitespaces, so 'Bogotá ', 'bogota' and 'BOGOTA'
+    end up being the same search key
+    """
+    if not value:
+        return ''
+    value = unicodedata.normalize('NFKD', str(value))
+    value = ''.join(char for char in value if not unicodedata.combining(char))
+    return _WHITESPACE.sub(' ', value).strip().casefold()
+
+
+def split_search_query(q):
+    """
+    We can get a sequence of queries separated by commas with this
+    order: City, Region (or Country), Country. If only one section is
+    passed, that will always be the city, the second section could be
+    either the region or the country, and, if a third section is passed,
+    that will always be the country.
+
+    Returns a tuple (city, region, country) with the normalized sections,
+    missing sections are returned as empty strings
+    """
+    queries = [normalize_search_text(x) for x in q.split(',', 2)]
+    queries += [''] * (3 - len(queries))
+    return tuple(queries)
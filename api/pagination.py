@@ -0,0 +1,62 @@
+import base64
+import binascii
+import json
+
+__author__ = 'Bezur'
+
+__all__ = ['encode_cursor', 'decode_cursor', 'next_page_link']
+
+
+def encode_cursor(position):
+    """
+    Builds the opaque token clients send back to get the next page, out of
+    the position of the last city they got
+    """
+    data = json.dumps(position, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def _valid_position(position):
+    if not isinstance(position, dict):
+        return False
+    if 'o' in position:
+        return (
+            set(position) == {'o'}
+            and type(position['o']) is int
+            and position['o'] >= 0
+        )
+    if 'z' in position:
+        return (
+            set(position) == {'n', 'z'}
+            and type(position['n']) is int
+            and isinstance(position['z'], str)
+        )
+    if set(position) == {'id'}:
+        return type(position['id']) is int
+    return (
+        set(position) == {'id', 'p', 's'}
+        and type(position['id']) is int
+        and type(position['p']) is bool
+        and (position['s'] is None or type(position['s']) in (int, float))
+    )
+
+
+def decode_cursor(token):
+    """Returns the position encoded in a cursor token, raises ValueError if it's not valid"""
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        position = json.loads(data.decode('utf-8'))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if not _valid_position(position):
+        raise ValueError('Invalid cursor')
+    return position
+
+
+def next_page_link(request, cursor):
+    """Value of the 'Link' header pointing to the next page"""
+    params = request.GET.copy()
+    params['cursor'] = cursor
+    return '<%s?%s>; rel="next"' % (
+        request.build_absolute_uri(request.path), params.urlencode()
+    )
@@ -0,0 +1,227 @@
+import json
+import logging
+import time
+
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+
+from api import autocomplete
+from api.caching import cities_cache_key, set_cached_cities
+from api.documents import get_city_documents, join_documents
+from api.models import City, LanguageChoices
+from api.normalization import split_search_query
+from api.pagination import decode_cursor, encode_cursor
+from api.search import cities_page, find_cities, search_city_codes
+
+__author__ = 'Bezur'
+
+__all__ = [
+    'PlanError', 'CitiesPlan', 'parse_limit', 'is_flat', 'SHAPE_ZIP',
+    'SHAPE_CODE', 'SHAPE_AREA', 'SHAPE_NAME', 'SHAPE_NAME_REGION',
+    'SHAPE_NAME_COUNTRY', 'SHAPE_NAME_REGION_COUNTRY'
+]
+
+logger = logging.getLogger(__name__)
+
+# Query shapes of the cities endpoint
+SHAPE_ZIP = 'zip'  # Only digits, a zip code or a numeric city code
+SHAPE_CODE = 'code'  # A city code, no spaces and some digit
+SHAPE_AREA = 'area'  # No city section, all the cities of a region/country
+SHAPE_NAME = 'name'
+SHAPE_NAME_REGION = 'name_region'  # The region section could be the country
+SHAPE_NAME_COUNTRY = 'name_country'
+SHAPE_NAME_REGION_COUNTRY = 'name_region_country'
+
+RANKED_SHAPES = {
+    SHAPE_NAME, SHAPE_NAME_REGION, SHAPE_NAME_COUNTRY, SHAPE_NAME_REGION_COUNTRY
+}
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+# Zip codes are up to 6 digits long (see ZipCode.zip_code)
+ZIP_CODE_LENGTH = 6
+
+
+class PlanError(ValueError):
+    """The request can't be planned, the message is meant for the client"""
+
+
+def parse_limit(value, default=DEFAULT_LIMIT):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return default
+    # Limiting the list so we don't overload the database
+    return max(min(limit, MAX_LIMIT), 1)
+
+
+def is_flat(params):
+    """
+    Whether the flat documents, with only the names in the requested
+    languages, were asked ('mode=flat'), see api.documents
+    """
+    return params.get('mode') == 'flat'
+
+
+class CitiesPlan(object):
+    """
+    Parsed query of the cities endpoint: the normalized sections of 'q', the
+    languages, the page size and position, and the shape of the query,
+    which picks how the cities are looked up
+    """
+
+    def __init__(self, language, extra_lang, queries, limit, cursor='', flat=False):
+        self.language = language
+        self.extra_lang = extra_lang
+        self.flat = flat
+        self.city_query, self.region_query, self.country_query = queries
+        self.limit = limit
+        self.cursor = cursor
+        self.shape = self._shape()
+
+        try:
+            self.position = decode_cursor(cursor) if cursor else None
+        except ValueError:
+            raise PlanError(_('The cursor is not valid'))
+        if self.position is not None and not self._valid_position(self.position):
+            raise PlanError(_('The cursor is not valid'))
+
+    @classmethod
+    def from_params(cls, language, params, default_limit=DEFAULT_LIMIT):
+        """
+        Plans a query out of the request parameters ('q', 'extra_lang',
+        'limit', 'cursor' and 'mode'), returns None when there's nothing to
+        look up and raises PlanError for invalid requests
+        """
+        if language not in LanguageChoices.values:
+            raise PlanError(
+                _('We currently do not support the \'%s\' language, or that'
+                  ' is not a valid code') % language
+            )
+
+        q = params.get('q', '')
+        # We ensure 3 characters at least for a searching query
+        if not q or len(q) <= 2:
+            return None
+
+        extra_lang = params.get('extra_lang')
+        if extra_lang == language or extra_lang not in LanguageChoices.values:
+            extra_lang = None
+
+        return cls(
+            language,
+            extra_lang,
+            split_search_query(q),
+            parse_limit(params.get('limit'), default_limit),
+            params.get('cursor', ''),
+            is_flat(params)
+        )
+
+    @classmethod
+    def from_log_entry(cls, language, entry):
+        """Plans the first page of a query of the request log, see log_entry"""
+        extra_lang, city_query, region_query, country_query, limit, flat = json.loads(entry)
+        return cls(
+            language,
+            extra_lang or None,
+            (city_query, region_query, country_query),
+            limit,
+            flat=flat
+        )
+
+    @property
+    def log_entry(self):
+        """The query, as it's kept by the request log (see api.caching)"""
+        return json.dumps(
+            [self.extra_lang or '', *self.queries, self.limit, self.flat],
+            separators=(',', ':')
+        )
+
+    def _shape(self):
+        city_query = self.city_query
+        if not city_query:
+            return SHAPE_AREA
+        if city_query.isdigit() and len(city_query) <= ZIP_CODE_LENGTH:
+            return SHAPE_ZIP
+        if ' ' not in city_query and any(char.isdigit() for char in city_query):
+            return SHAPE_CODE
+        if self.region_query and self.country_query:
+            return SHAPE_NAME_REGION_COUNTRY
+        if self.country_query:
+            return SHAPE_NAME_COUNTRY
+        if self.region_query:
+            return SHAPE_NAME_REGION
+        return SHAPE_NAME
+
+    def _valid_position(self, position):
+        if self.shape in RANKED_SHAPES:
+            # Autocomplete index offsets, or database keyset positions
+            return 'o' in position or 'p' in position
+        return set(position) == {'id'}
+
+    @property
+    def queries(self):
+        return self.city_query, self.region_query, self.country_query
+
+    @cached_property
+    def cache_key(self):
+        return cities_cache_key(
+            self.shape,
+            self.language,
+            self.extra_lang,
+            self.queries,
+            self.limit,
+            self.cursor,
+            self.flat,
+            autocomplete.engine.enabled and self.shape in RANKED_SHAPES
+        )
+
+    def execute(self):
+        """Returns the ids of the page's cities and the position of the next page"""
+        if self.shape in (SHAPE_ZIP, SHAPE_CODE):
+            # Straight unique index lookups, there's nothing to rank
+            return cities_page(
+                search_city_codes(
+                    City.objects.all(),
+                    self.language,
+                    self.city_query,
+                    self.region_query,
+                    self.country_query,
+                    zip_codes=self.shape == SHAPE_ZIP
+                ),
+                self.limit,
+                self.position
+            )
+        return find_cities(
+            self.language,
+            self.city_query,
+            self.region_query,
+            self.country_query,
+            self.limit,
+            self.position
+        )
+
+    def render(self):
+        """
+        Looks the cities up, puts their documents together and caches the
+        page. Returns the (body, next cursor, compressed bodies) page and
+        the number of cities in it
+        """
+        city_ids, next_position = self.execute()
+        body = join_documents(get_city_documents(
+            city_ids, self.language, self.extra_lang, self.flat
+        ))
+        next_cursor = encode_cursor(next_position) if next_position else None
+        encoded = set_cached_cities(self.cache_key, body, next_cursor)
+        return (body, next_cursor, encoded), len(city_ids)
+
+    def log(self, started, cached, cities=None):
+        logger.debug(
+            'cities plan shape=%s language=%s extra_lang=%s flat=%s limit=%s'
+            ' page=%s cached=%s cities=%s took=%.2fms',
+            self.shape, self.language, self.extra_lang or '-', self.flat,
+            self.limit,
+            'next' if self.cursor else 'first', cached,
+            '-' if cities is None else cities,
+            (time.monotonic() - started) * 1000
+        )
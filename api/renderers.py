@@ -0,0 +1,42 @@
+import json
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    # It's in the requirements, the standard json module is used without it
+    orjson = None
+
+__author__ = 'Bezur'
+
+__all__ = ['dumps', 'FastJSONRenderer']
+
+_encoder = JSONEncoder()
+
+
+def dumps(data):
+    """
+    Compact JSON of 'data', as a string, through orjson when it's installed.
+    Values JSON doesn't know about (lazy translations, decimals, dates...)
+    are encoded the same way the REST framework does
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_encoder.default).decode('utf-8')
+    return json.dumps(
+        data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')
+    )
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer rendering through orjson, when it's installed and no
+    indentation was asked (e.g. by the browsable API)
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(
+                accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(data, default=_encoder.default)
@@ -0,0 +1,313 @@
+import math
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db.models import (
+    Exists, ExpressionWrapper, F, FloatField, OuterRef, Q, Subquery, Value
+)
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+from api import autocomplete
+from api.geo import (
+    EARTH_RADIUS, GEOHASH_PRECISION, block_reach, bounding_box, geohash_block,
+    haversine
+)
+from api.models import (
+    City, CityTranslation, RegionTranslation, CountryTranslation, ZipCode
+)
+
+__author__ = 'Bezur'
+
+__all__ = [
+    'search_cities', 'search_city_codes', 'cities_page', 'find_cities',
+    'nearest_cities', 'cities_within'
+]
+
+# Nearest cities are looked for within PLACES_NEAREST_MAX_DISTANCE km, a
+# point farther from every city gets none
+NEAREST_MAX_DISTANCE = getattr(settings, 'PLACES_NEAREST_MAX_DISTANCE', 2000)
+
+
+def _code_variants(term):
+    """
+    Terms reach this module normalized (lower case), while the codes are
+    stored as uploaded, usually upper case
+    """
+    return list({term, term.upper()})
+
+
+def _region_filter(language, term):
+    names = RegionTranslation.objects.filter(
+        language_code=language,
+        search_name__contains=term
+    )
+    return (
+        Q(region_id__in=names.values('region_id'))
+        | Q(region__code__iexact=term)
+    )
+
+
+def _country_filter(language, term):
+    names = CountryTranslation.objects.filter(
+        language_code=language,
+        search_name__contains=term
+    )
+    return (
+        Q(country_id__in=names.values('country_id'))
+        | Q(country__code__iexact=term)
+    )
+
+
+def search_cities(queryset, language, city_query='', region_query='', country_query=''):
+    """
+    Filters the cities queryset with the (already normalized) query
+    sections.
+
+    Every name lookup is done over the 'search_name' column of the
+    translations, which is covered by a trigram GIN index (for the
+    'contains' lookups) and a pattern ops index (for the prefix ones), and
+    is expressed as an 'IN' subquery, so there are no multi-valued joins
+    and we don't need to apply a distinct over the whole result.
+
+    When there's a city section, results are ranked by prefix matches
+    first and then by their trigram similarity with the query
+    """
+    if city_query:
+        city_names = CityTranslation.objects.filter(
+            language_code=language,
+            search_name__contains=city_query
+        )
+        queryset = queryset.filter(
+            Q(pk__in=city_names.values('city_id'))
+            | Q(pk__in=ZipCode.objects.filter(zip_code=city_query).values('city_id'))
+            | Q(code__in=_code_variants(city_query))
+        ).annotate(
+            prefix_match=Exists(
+                city_names.filter(
+                    city=OuterRef('pk'),
+                    search_name__startswith=city_query
+                )
+            ),
+            similarity=Subquery(
+                city_names.filter(city=OuterRef('pk')).annotate(
+                    similarity=TrigramSimilarity('search_name', city_query)
+                ).order_by('-similarity').values('similarity')[:1]
+            )
+        ).order_by('-prefix_match', F('similarity').desc(nulls_last=True), 'pk')
+    else:
+        queryset = queryset.order_by('pk')
+
+    return _filter_area(queryset, language, region_query, country_query)
+
+
+def _filter_area(queryset, language, region_query='', country_query=''):
+    if region_query and not country_query:
+        queryset = queryset.filter(
+            _region_filter(language, region_query)
+            | _country_filter(language, region_query)
+        )
+    else:
+        if region_query and country_query:
+            queryset = queryset.filter(
+                _region_filter(language, region_query),
+                _country_filter(language, country_query)
+            )
+        if country_query and not region_query:
+            queryset = queryset.filter(
+                _country_filter(language, country_query)
+            )
+
+    return queryset
+
+
+def search_city_codes(queryset, language, code, region_query='', country_query='',
+                      zip_codes=True):
+    """
+    Filters the cities queryset by their code or, if 'zip_codes', by the
+    zip codes they own, both lookups of unique indexes, ordered by id
+    """
+    matches = Q(code__in=_code_variants(code))
+    if zip_codes:
+        matches |= Q(pk__in=ZipCode.objects.filter(zip_code=code).values('city_id'))
+    return _filter_area(
+        queryset.filter(matches).order_by('pk'),
+        language,
+        region_query,
+        country_query
+    )
+
+
+def _after(position, ranked):
+    """
+    Keyset condition for the cities coming after 'position' in the order
+    set by search_cities
+    """
+    if not ranked:
+        return Q(pk__gt=position['id'])
+
+    prefix, similarity = position['p'], position['s']
+    if similarity is None:
+        # Nulls go last, so only the ties on the id are left
+        same_prefix = Q(similarity__isnull=True, pk__gt=position['id'])
+    else:
+        same_prefix = (
+            Q(similarity__lt=similarity)
+            | Q(similarity__isnull=True)
+            | Q(similarity=similarity, pk__gt=position['id'])
+        )
+    after = Q(prefix_match=prefix) & same_prefix
+    if prefix:
+        after |= Q(prefix_match=False)
+    return after
+
+
+def cities_page(queryset, limit, position=None):
+    """
+    Slices a queryset coming from search_cities into a page of 'limit'
+    city ids after 'position' (the one of the last city of the previous
+    page), returns the ids along with the position of the page's last city,
+    or None if it's the last page.
+
+    Pages are fetched with a keyset condition instead of an offset, so
+    unranked listings (ordered by id) cost the same at any depth. Offset
+    positions, the ones of the autocomplete index pages, are honored too.
+    """
+    ranked = 'prefix_match' in queryset.query.annotations
+    fields = ['pk', 'prefix_match', 'similarity'] if ranked else ['pk']
+
+    if position and 'o' in position:
+        offset = position['o']
+        rows = list(queryset.values_list(*fields)[offset:offset + limit + 1])
+        city_ids = [row[0] for row in rows[:limit]]
+        return city_ids, {'o': offset + limit} if len(rows) > limit else None
+
+    if position:
+        queryset = queryset.filter(_after(position, ranked))
+    rows = list(queryset.values_list(*fields)[:limit + 1])
+    city_ids = [row[0] for row in rows[:limit]]
+    if len(rows) <= limit:
+        return city_ids, None
+
+    last = rows[limit - 1]
+    if ranked:
+        return city_ids, {'id': last[0], 'p': last[1], 's': last[2]}
+    return city_ids, {'id': last[0]}
+
+
+def find_cities(language, city_query, region_query, country_query, limit, position=None):
+    """
+    Looks up a page of cities for the (already normalized) query sections,
+    returns the city ids along with the position of the next page, if any.
+
+    The in-process autocomplete index answers the query whenever it's
+    enabled, otherwise we look the cities up in the database. Its pages are
+    offsets, as it has its own ranking
+    """
+    if position is None or 'o' in position:
+        offset = position['o'] if position else 0
+        city_ids = autocomplete.engine.search(
+            language, city_query, region_query, country_query,
+            limit + 1, offset
+        )
+        if city_ids is not None:
+            next_position = {'o': offset + limit} if len(city_ids) > limit else None
+            return city_ids[:limit], next_position
+
+    return cities_page(
+        search_cities(
+            City.objects.all(),
+            language,
+            city_query,
+            region_query,
+            country_query
+        ),
+        limit,
+        position
+    )
+
+
+def _distance_to(latitude, longitude):
+    """
+    Distance (km) from the point to the cities, as a database expression,
+    the same haversine formula of api.geo
+    """
+    lat, lon = math.radians(latitude), math.radians(longitude)
+    city_lat, city_lon = Radians('latitude'), Radians('longitude')
+    a = (
+        Power(Sin((city_lat - Value(lat)) / Value(2)), 2)
+        + Value(math.cos(lat)) * Cos(city_lat)
+        * Power(Sin((city_lon - Value(lon)) / Value(2)), 2)
+    )
+    return ExpressionWrapper(
+        Value(2 * EARTH_RADIUS) * ASin(Least(Sqrt(a), Value(1.0))),
+        output_field=FloatField()
+    )
+
+
+def _by_distance(queryset, latitude, longitude, radius, limit, cells=None):
+    """
+    The 'limit' cities of the queryset nearest to the point within 'radius'
+    km of it, and in the geohash cells if given, as a sorted list of
+    (distance, city id). The database filters them by their bounding box
+    and sorts them, only the page is read
+    """
+    (min_lat, max_lat), lon_ranges = bounding_box(latitude, longitude, radius)
+    queryset = queryset.filter(latitude__range=(min_lat, max_lat))
+    if lon_ranges:
+        in_box = Q()
+        for min_lon, max_lon in lon_ranges:
+            in_box |= Q(longitude__range=(min_lon, max_lon))
+        queryset = queryset.filter(in_box)
+    if cells is not None:
+        in_cells = Q()
+        for cell in cells:
+            in_cells |= Q(geohash__startswith=cell)
+        queryset = queryset.filter(in_cells)
+
+    cities = queryset.annotate(
+        distance=_distance_to(latitude, longitude)
+    ).filter(distance__lte=radius).order_by('distance', 'pk').values_list(
+        'pk', 'latitude', 'longitude'
+    )[:limit]
+    return sorted(
+        (haversine(latitude, longitude, city_latitude, city_longitude), city_id)
+        for city_id, city_latitude, city_longitude in cities
+    )
+
+
+def nearest_cities(queryset, latitude, longitude, limit, max_distance=NEAREST_MAX_DISTANCE):
+    """
+    Returns the 'limit' cities nearest to the point, up to 'max_distance'
+    km away, as a list of (distance in km, city id).
+
+    Candidates are the cities in the block of geohash cells around the
+    point, each cell being a range scan over the geohash index, within the
+    block's reach. Blocks grow (by dropping geohash precision) until there
+    are enough cities within their reach, as there can't be nearer ones
+    outside of it
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        reach = block_reach(latitude, precision)
+        distances = _by_distance(
+            queryset, latitude, longitude, min(reach, max_distance), limit,
+            geohash_block(latitude, longitude, precision)
+        )
+        if len(distances) >= limit or reach >= max_distance:
+            return distances
+    # Blocks around the poles have hardly any reach
+    return _by_distance(queryset, latitude, longitude, max_distance, limit)
+
+
+def cities_within(queryset, latitude, longitude, radius, limit):
+    """
+    Returns the cities within 'radius' km of the point, nearest first, as a
+    list of (distance in km, city id), looking them up in the smallest block
+    of geohash cells around the point covering the whole circle
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        if block_reach(latitude, precision) >= radius:
+            return _by_distance(
+                queryset, latitude, longitude, radius, limit,
+                geohash_block(latitude, longitude, precision)
+            )
+    return _by_distance(queryset, latitude, longitude, radius, limit)
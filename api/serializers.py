@@ -1,5 +1,7 @@
+from django.utils import timezone
 from rest_framework import serializers
 from .models import *
+from .caching import get_job_progress
 
 
 class CountryTranslationSerializer(serializers.ModelSerializer):
@@ -13,7 +15,7 @@ class CountrySerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Country
-        fields = ['code', 'country_translations', 'flag']
+        fields = ['code', 'country_translations', 'flag', 'latitude', 'longitude']
 
 
 class RegionTranslationSerializer(serializers.ModelSerializer):
@@ -27,7 +29,10 @@ class RegionSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Region
-        fields = ['code', 'local_code', 'region_translations', 'flag']
+        fields = [
+            'code', 'local_code', 'region_translations', 'flag', 'latitude',
+            'longitude'
+        ]
 
 
 class CityTranslationSerializer(serializers.ModelSerializer):
@@ -52,4 +57,31 @@ class CitySerializer(serializers.ModelSerializer):
 
     class Meta:
         model = City
-        fields = ['id', 'zip_codes', 'code', 'country', 'region', 'city_translations', 'flag']
+        fields = [
+            'id', 'zip_codes', 'code', 'country', 'region', 'city_translations',
+            'flag', 'latitude', 'longitude'
+        ]
+
+
+class UploadJobSerializer(serializers.ModelSerializer):
+    rows_read = serializers.SerializerMethodField()
+    rows_per_second = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadJob
+        fields = [
+            'id', 'kind', 'country_code', 'status', 'created_at', 'started_at',
+            'finished_at', 'rows_read', 'inserted', 'updated', 'unchanged',
+            'errors', 'rows_per_second'
+        ]
+
+    def get_rows_read(self, job):
+        if job.status == UploadStatusChoices.RUNNING:
+            return get_job_progress(job.pk, job.rows_read)
+        return job.rows_read
+
+    def get_rows_per_second(self, job):
+        if job.started_at is None:
+            return None
+        elapsed = ((job.finished_at or timezone.now()) - job.started_at).total_seconds()
+        return round(self.get_rows_read(job) / elapsed, 1) if elapsed else None
@@ -0,0 +1,227 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from api.autocomplete import IndexState, engine
+from api.caching import bump_dataset_version
+from api.changes import record_changes
+from api.documents import invalidate_city_documents
+from api.models import (
+    City, Region, Country, CityTranslation, RegionTranslation,
+    CountryTranslation, ZipCode, LanguageChoices, PlaceKindChoices
+)
+
+__author__ = 'Bezur'
+
+
+# Dataset version and autocomplete index
+
+def places_changed(change=None, *args):
+    """
+    Bumps the dataset version and applies the change to the autocomplete
+    index of this process, once the transaction commits, so rolled back
+    changes never reach the index
+    """
+    def committed():
+        version = bump_dataset_version()
+        if change is not None:
+            engine.apply(version, change, *args)
+
+    transaction.on_commit(committed)
+
+
+@receiver(post_save, sender=City)
+def autocomplete_city_saved(sender, instance, **kwargs):
+    places_changed(
+        IndexState.set_city,
+        instance.pk, instance.code, instance.region_id, instance.country_id
+    )
+
+
+@receiver(post_delete, sender=City)
+def autocomplete_city_deleted(sender, instance, **kwargs):
+    places_changed(IndexState.remove_city, instance.pk)
+
+
+@receiver(post_save, sender=CityTranslation)
+def autocomplete_city_translation_saved(sender, instance, **kwargs):
+    places_changed(
+        IndexState.set_city_name,
+        instance.language_code, instance.city_id, instance.search_name
+    )
+
+
+@receiver(post_delete, sender=CityTranslation)
+def autocomplete_city_translation_deleted(sender, instance, **kwargs):
+    places_changed(IndexState.remove_city_name, instance.language_code, instance.city_id)
+
+
+@receiver(post_save, sender=ZipCode)
+def autocomplete_zip_code_saved(sender, instance, **kwargs):
+    places_changed(IndexState.set_zip_code, instance.zip_code, instance.city_id)
+
+
+@receiver(post_delete, sender=ZipCode)
+def autocomplete_zip_code_deleted(sender, instance, **kwargs):
+    places_changed(IndexState.remove_zip_code, instance.zip_code)
+
+
+@receiver(post_save, sender=Region)
+def autocomplete_region_saved(sender, instance, **kwargs):
+    places_changed(IndexState.set_region, instance.pk, instance.code)
+
+
+@receiver(post_save, sender=RegionTranslation)
+def autocomplete_region_translation_saved(sender, instance, **kwargs):
+    places_changed(
+        IndexState.set_region_name,
+        instance.language_code, instance.region_id, instance.search_name
+    )
+
+
+@receiver(post_delete, sender=RegionTranslation)
+def autocomplete_region_translation_deleted(sender, instance, **kwargs):
+    places_changed(IndexState.remove_region_name, instance.language_code, instance.region_id)
+
+
+@receiver(post_delete, sender=Region)
+@receiver(post_delete, sender=Country)
+def autocomplete_place_deleted(sender, instance, **kwargs):
+    places_changed()
+
+
+@receiver(post_save, sender=Country)
+def autocomplete_country_saved(sender, instance, **kwargs):
+    places_changed(IndexState.set_country, instance.pk, instance.code)
+
+
+@receiver(post_save, sender=CountryTranslation)
+def autocomplete_country_translation_saved(sender, instance, **kwargs):
+    places_changed(
+        IndexState.set_country_name,
+        instance.language_code, instance.country_id, instance.search_name
+    )
+
+
+@receiver(post_delete, sender=CountryTranslation)
+def autocomplete_country_translation_deleted(sender, instance, **kwargs):
+    places_changed(IndexState.remove_country_name, instance.language_code, instance.country_id)
+
+
+# City documents
+
+@receiver(post_save, sender=City)
+def documents_city_changed(sender, instance, **kwargs):
+    invalidate_city_documents(city_id=instance.pk)
+
+
+@receiver(post_save, sender=CityTranslation)
+@receiver(post_delete, sender=CityTranslation)
+@receiver(post_save, sender=ZipCode)
+@receiver(post_delete, sender=ZipCode)
+def documents_city_related_changed(sender, instance, **kwargs):
+    invalidate_city_documents(city_id=instance.city_id)
+
+
+@receiver(post_save, sender=Region)
+def documents_region_changed(sender, instance, **kwargs):
+    invalidate_city_documents(city__region_id=instance.pk)
+
+
+@receiver(post_save, sender=RegionTranslation)
+@receiver(post_delete, sender=RegionTranslation)
+def documents_region_translation_changed(sender, instance, **kwargs):
+    invalidate_city_documents(city__region_id=instance.region_id)
+
+
+@receiver(post_save, sender=Country)
+def documents_country_changed(sender, instance, **kwargs):
+    invalidate_city_documents(city__country_id=instance.pk)
+
+
+@receiver(post_save, sender=CountryTranslation)
+@receiver(post_delete, sender=CountryTranslation)
+def documents_country_translation_changed(sender, instance, **kwargs):
+    invalidate_city_documents(city__country_id=instance.country_id)
+
+
+# Change log
+
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+def changes_city_changed(sender, instance, **kwargs):
+    record_changes(PlaceKindChoices.CITY, [instance.pk])
+
+
+@receiver(post_save, sender=CityTranslation)
+@receiver(post_delete, sender=CityTranslation)
+@receiver(post_save, sender=ZipCode)
+@receiver(post_delete, sender=ZipCode)
+def changes_city_related_changed(sender, instance, **kwargs):
+    record_changes(PlaceKindChoices.CITY, [instance.city_id])
+
+
+@receiver(post_save, sender=Region)
+@receiver(post_delete, sender=Region)
+def changes_region_changed(sender, instance, **kwargs):
+    record_changes(PlaceKindChoices.REGION, [instance.pk])
+
+
+@receiver(pre_delete, sender=Region)
+def changes_region_deleting(sender, instance, **kwargs):
+    # Their region is set to null with an UPDATE, which doesn't send signals
+    record_changes(
+        PlaceKindChoices.CITY,
+        instance.cities.values_list('pk', flat=True)
+    )
+
+
+@receiver(post_save, sender=RegionTranslation)
+@receiver(post_delete, sender=RegionTranslation)
+def changes_region_translation_changed(sender, instance, **kwargs):
+    record_changes(PlaceKindChoices.REGION, [instance.region_id])
+
+
+@receiver(post_save, sender=Country)
+@receiver(post_delete, sender=Country)
+def changes_country_changed(sender, instance, **kwargs):
+    record_changes(PlaceKindChoices.COUNTRY, [instance.pk])
+
+
+@receiver(pre_delete, sender=Country)
+def changes_country_deleting(sender, instance, **kwargs):
+    # Same as the cities of a region, see changes_region_deleting
+    record_changes(
+        PlaceKindChoices.REGION,
+        instance.regions.values_list('pk', flat=True)
+    )
+
+
+@receiver(post_save, sender=CountryTranslation)
+@receiver(post_delete, sender=CountryTranslation)
+def changes_country_translation_changed(sender, instance, **kwargs):
+    record_changes(PlaceKindChoices.COUNTRY, [instance.country_id])
+
+
+# Display names
+
+@receiver(post_save, sender=CityTranslation)
+@receiver(post_save, sender=RegionTranslation)
+@receiver(post_save, sender=CountryTranslation)
+def names_translation_saved(sender, instance, **kwargs):
+    if instance.language_code == LanguageChoices.ENGLISH:
+        place = sender._meta.get_field(instance.place_field).related_model
+        place.objects.filter(pk=getattr(instance, '%s_id' % instance.place_field)).update(
+            name=instance.name, search_name=instance.search_name
+        )
+
+
+@receiver(post_delete, sender=CityTranslation)
+@receiver(post_delete, sender=RegionTranslation)
+@receiver(post_delete, sender=CountryTranslation)
+def names_translation_deleted(sender, instance, **kwargs):
+    if instance.language_code == LanguageChoices.ENGLISH:
+        place = sender._meta.get_field(instance.place_field).related_model
+        place.objects.filter(pk=getattr(instance, '%s_id' % instance.place_field)).update(
+            name='', search_name=''
+        )
@@ -0,0 +1,352 @@
+import gzip
+import hashlib
+import json
+import math
+import shutil
+import sys
+import tempfile
+import zipfile
+from array import array
+from itertools import groupby, islice
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.caching import get_dataset_version
+from api.models import (
+    Country, Region, City, ZipCode, CountryTranslation, RegionTranslation,
+    CityTranslation, PlaceSnapshot
+)
+
+__author__ = 'Bezur'
+
+__all__ = [
+    'SNAPSHOT_FORMATS', 'PLACE_KINDS', 'place_records', 'build_snapshot',
+    'current_snapshot', 'open_snapshot'
+]
+
+SNAPSHOT_DIRECTORY = 'snapshots'
+
+# Format of the snapshot files: (file suffix, content type)
+SNAPSHOT_FORMATS = {
+    'jsonl': ('jsonl.gz', 'application/gzip'),
+    'columns': ('columns.zip', 'application/zip'),
+}
+
+CHUNK_SIZE = 5000
+# Snapshots whose files are kept: the current one, and the previous one for
+# the downloads that started before it was replaced
+KEPT_SNAPSHOTS = 2
+# Fixed timestamp of the compressed members, so the same data always give
+# the same bytes, and the same file name
+_EPOCH = (1980, 1, 1, 0, 0, 0)
+
+# (kind, model, translation model, owner field, value fields), in dump order
+_PLACES = [
+    ('country', Country, CountryTranslation, 'country_id', [
+        'code', 'currency_code'
+    ]),
+    ('region', Region, RegionTranslation, 'region_id', [
+        'code', 'local_code', 'country_id'
+    ]),
+    ('city', City, CityTranslation, 'city_id', [
+        'code', 'region_id', 'country_id'
+    ]),
+]
+_PLACES_BY_KIND = {kind: place for kind, *place in _PLACES}
+# Kinds of places, parents first
+PLACE_KINDS = [kind for kind, *_place in _PLACES]
+_LOCATION_FIELDS = [
+    'latitude', 'longitude', 'min_latitude', 'min_longitude', 'max_latitude',
+    'max_longitude'
+]
+
+
+def _grouped(rows):
+    """Groups (owner id, ...) rows ordered by owner id, as (owner id, [rows])"""
+    for owner_id, group in groupby(rows, key=lambda row: row[0]):
+        yield owner_id, [row[1:] for row in group]
+
+
+def _merge(places, *children):
+    """
+    Joins places with streams of child rows, all of them ordered by place
+    id, yielding every place along with its rows of each stream, so nothing
+    but the current place's rows is held in memory
+    """
+    streams = [iter(stream) for stream in children]
+    heads = [next(stream, None) for stream in streams]
+    for place in places:
+        groups = []
+        for i, stream in enumerate(streams):
+            while heads[i] is not None and heads[i][0] < place[0]:
+                heads[i] = next(stream, None)
+            if heads[i] is not None and heads[i][0] == place[0]:
+                groups.append(heads[i][1])
+                heads[i] = next(stream, None)
+            else:
+                groups.append([])
+        yield place, groups
+
+
+def place_records(kind, ids=None):
+    """
+    Yields the records of the places of a kind ('country', 'region' or
+    'city'), ordered by id: their fields, their names by language and, for
+    the cities, their zip codes. Only the places in 'ids', if given
+    """
+    model, translations, owner, fields = _PLACES_BY_KIND[kind]
+    places = model.objects.order_by('pk')
+    names = translations.objects.order_by(owner, 'language_code')
+    zip_codes = ZipCode.objects.order_by('city_id', 'zip_code')
+    if ids is not None:
+        places = places.filter(pk__in=ids)
+        names = names.filter(**{'%s__in' % owner: ids})
+        zip_codes = zip_codes.filter(city_id__in=ids)
+
+    children = [_grouped(names.values_list(
+        owner, 'language_code', 'name'
+    ).iterator(chunk_size=CHUNK_SIZE))]
+    if kind == 'city':
+        children.append(_grouped(zip_codes.values_list(
+            'city_id', 'zip_code'
+        ).iterator(chunk_size=CHUNK_SIZE)))
+
+    places = places.values_list(
+        'pk', *fields, *_LOCATION_FIELDS
+    ).iterator(chunk_size=CHUNK_SIZE)
+    for place, groups in _merge(places, *children):
+        record = {'type': kind, 'id': place[0]}
+        record.update(zip(fields + _LOCATION_FIELDS, place[1:]))
+        record['names'] = dict(groups[0])
+        if kind == 'city':
+            record['zip_codes'] = [zip_code for zip_code, in groups[1]]
+        yield record
+
+
+def _write_jsonl(output):
+    with gzip.GzipFile(fileobj=output, mode='wb', mtime=0) as compressed:
+        for kind in PLACE_KINDS:
+            for record in place_records(kind):
+                compressed.write(json.dumps(
+                    record, ensure_ascii=False, separators=(',', ':')
+                ).encode('utf-8'))
+                compressed.write(b'\n')
+
+
+def _int_column(values):
+    # Ids are never 0, so 0 stands for null foreign keys
+    column = array('q', (value or 0 for value in values))
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+
+def _float_column(values):
+    column = array('d', (math.nan if value is None else value for value in values))
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+
+def _string_column(values, start=0):
+    """
+    UTF-8 data and the offsets where every value ends in it, counted from
+    'start', the end of the previous chunk of the column
+    """
+    data, offsets, end = [], array('q'), start
+    for value in values:
+        encoded = value.encode('utf-8')
+        data.append(encoded)
+        end += len(encoded)
+        offsets.append(end)
+    if sys.byteorder == 'big':
+        offsets.byteswap()
+    return offsets.tobytes(), b''.join(data)
+
+
+class _Column(object):
+    """
+    A column of a table being dumped, written a chunk of rows at a time to
+    temporary files, one per member of the archive
+    """
+
+    def __init__(self, field):
+        if field == 'id' or field.endswith('_id'):
+            self.kind, suffixes = 'int64', ['.i8']
+        elif field in _LOCATION_FIELDS:
+            self.kind, suffixes = 'float64', ['.f8']
+        else:
+            self.kind, suffixes = 'string', ['.offsets.i8', '.utf8']
+        self.files = [(suffix, tempfile.TemporaryFile()) for suffix in suffixes]
+        self.end = 0
+
+    def write(self, values):
+        if self.kind == 'int64':
+            parts = [_int_column(values)]
+        elif self.kind == 'float64':
+            parts = [_float_column(values)]
+        else:
+            parts = _string_column(values, self.end)
+            self.end += len(parts[1])
+        for (_suffix, output), part in zip(self.files, parts):
+            output.write(part)
+
+    def close(self):
+        for _suffix, output in self.files:
+            output.close()
+
+
+def _write_columns(output):
+    """
+    Writes a zip archive with one member per column of each table: integers
+    as little-endian int64 (0 for null), coordinates as little-endian
+    float64 (NaN for null), and strings as their UTF-8 data plus the int64
+    offsets where every value ends. 'schema.json' lists the tables, their
+    columns and their types. Tables are read once, CHUNK_SIZE rows at a
+    time, every column going to its own temporary file
+    """
+    tables = [
+        (kind, model, ['id'] + fields + _LOCATION_FIELDS)
+        for kind, model, _translations, _owner, fields in _PLACES
+    ]
+    tables += [
+        ('%s_name' % kind, translations, [owner, 'language_code', 'name'])
+        for kind, _model, translations, owner, _fields in _PLACES
+    ]
+    tables.append(('zip_code', ZipCode, ['zip_code', 'city_id']))
+
+    schema = {}
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as archive:
+
+        def member(name, size):
+            info = zipfile.ZipInfo(name, date_time=_EPOCH)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.file_size = size
+            return info
+
+        for table, model, fields in tables:
+            rows = model.objects.order_by('pk').values_list(
+                *['pk' if field == 'id' else field for field in fields]
+            ).iterator(chunk_size=CHUNK_SIZE)
+            columns = [_Column(field) for field in fields]
+            try:
+                count = 0
+                for chunk in iter(lambda: list(islice(rows, CHUNK_SIZE)), []):
+                    count += len(chunk)
+                    for column, values in zip(columns, zip(*chunk)):
+                        column.write(values)
+
+                schema[table] = {'rows': count, 'columns': {}}
+                for field, column in zip(fields, columns):
+                    for suffix, data in column.files:
+                        size = data.tell()
+                        data.seek(0)
+                        with archive.open(member(table + '/' + field + suffix, size), 'w') as out:
+                            shutil.copyfileobj(data, out)
+                    schema[table]['columns'][field] = column.kind
+            finally:
+                for column in columns:
+                    column.close()
+        archive.writestr(
+            member('schema.json', 0), json.dumps(schema, indent=2, sort_keys=True)
+        )
+
+
+def _store(writer, suffix):
+    """
+    Writes a snapshot file to a temporary file, then stores it named after
+    the SHA-256 of its content, unless it's already there. Returns its
+    description for the manifest
+    """
+    with tempfile.TemporaryFile() as output:
+        writer(output)
+        output.seek(0)
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: output.read(1024 * 1024), b''):
+            digest.update(chunk)
+        size = output.tell()
+
+        name = '%s/places-%s.%s' % (
+            SNAPSHOT_DIRECTORY, digest.hexdigest()[:32], suffix
+        )
+        if not default_storage.exists(name):
+            output.seek(0)
+            default_storage.save(name, File(output))
+    return {'name': name, 'sha256': digest.hexdigest(), 'size': size}
+
+
+def build_snapshot():
+    """
+    Dumps the whole dataset, countries, regions, cities, zip codes and their
+    names, as a gzipped JSON lines file and a columnar zip archive, both
+    content-addressed, and records their manifest as the current snapshot
+    (see PlaceSnapshot). Returns the manifest.
+
+    Everything is read in a single REPEATABLE READ transaction, so the files
+    are consistent even when an import runs in the meantime. 'change' is
+    the position of the last change settled before the dump, clients can
+    follow the changes feed from it to keep their copy up to date, changes
+    after it may be in the files already, applying them again is harmless
+    """
+    # api.changes reads the records of the places from here
+    from api.changes import latest_change
+
+    version = get_dataset_version()
+    within_transaction = connection.in_atomic_block
+    with transaction.atomic():
+        if not within_transaction:
+            # Otherwise it's the transaction's own isolation level
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        manifest = {
+            'version': version,
+            'change': latest_change(),
+            'created_at': timezone.now().isoformat(),
+            'files': {
+                file_format: _store(writer, SNAPSHOT_FORMATS[file_format][0])
+                for file_format, writer in [
+                    ('jsonl', _write_jsonl), ('columns', _write_columns)
+                ]
+            },
+        }
+
+    PlaceSnapshot.objects.create(manifest=manifest)
+    _prune_snapshots()
+    return manifest
+
+
+def _prune_snapshots():
+    """
+    Deletes the snapshots but the KEPT_SNAPSHOTS last ones, and their files,
+    unless a kept snapshot has the same ones (e.g. the data didn't change)
+    """
+    snapshots = list(PlaceSnapshot.objects.order_by('-pk').values_list('pk', 'manifest'))
+    kept = {
+        snapshot['name']
+        for _pk, manifest in snapshots[:KEPT_SNAPSHOTS]
+        for snapshot in manifest['files'].values()
+    }
+    old = snapshots[KEPT_SNAPSHOTS:]
+    if not old:
+        return
+    # Readers always find the current manifest, before its files are gone
+    PlaceSnapshot.objects.filter(pk__in=[pk for pk, _manifest in old]).delete()
+    for name in {
+            snapshot['name'] for _pk, manifest in old
+            for snapshot in manifest['files'].values()} - kept:
+        default_storage.delete(name)
+
+
+def current_snapshot():
+    """Manifest of the current snapshot, or None if none has been built"""
+    return PlaceSnapshot.objects.order_by('-pk').values_list(
+        'manifest', flat=True
+    ).first()
+
+
+def open_snapshot(manifest, file_format):
+    """Opens a file of the snapshot, for reading"""
+    return default_storage.open(manifest['files'][file_format]['name'])
@@ -0,0 +1,75 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from api.models import (
+    Country, Region, City, CountryTranslation, RegionTranslation, CityTranslation, ZipCode
+)
+
+
+class AdminTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        CountryTranslation.objects.create(country=colombia, language_code='en', name='Colombia')
+        cls.region = Region.objects.create(code='CUN', country=colombia)
+        RegionTranslation.objects.create(
+            region=cls.region, language_code='en', name='Cundinamarca'
+        )
+        cls.city = City.objects.create(code='11001', region=cls.region, country=colombia)
+        CityTranslation.objects.create(city=cls.city, language_code='en', name='Bogotá')
+        CityTranslation.objects.create(city=cls.city, language_code='es', name='Bogotá D.C.')
+        ZipCode.objects.create(city=cls.city, zip_code='110111')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def changelist_queries(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def add_places(self, count):
+        for number in range(count):
+            region = Region.objects.create(code='R%d' % number, country=self.region.country)
+            city = City.objects.create(
+                code='C%d' % number, region=region, country=region.country
+            )
+            CityTranslation.objects.create(city=city, language_code='en', name='C%d' % number)
+            CityTranslation.objects.create(city=city, language_code='es', name='C%d' % number)
+            ZipCode.objects.create(city=city, zip_code='9%05d' % number)
+
+    def test_changelists_queries_do_not_grow_with_the_rows(self):
+        urls = [
+            '/admin/api/region/', '/admin/api/city/', '/admin/api/citytranslation/',
+            '/admin/api/zipcode/'
+        ]
+        queries = [self.changelist_queries(url) for url in urls]
+        self.add_places(5)
+        self.assertEqual([self.changelist_queries(url) for url in urls], queries)
+
+    def test_searches(self):
+        response = self.client.get('/admin/api/city/', {'q': 'bogo'})
+        self.assertEqual([city.code for city in response.context['cl'].result_list], ['11001'])
+        response = self.client.get('/admin/api/city/', {'q': '11001'})
+        self.assertEqual(len(response.context['cl'].result_list), 1)
+        response = self.client.get('/admin/api/zipcode/', {'q': '1101'})
+        self.assertEqual(len(response.context['cl'].result_list), 1)
+        response = self.client.get('/admin/api/citytranslation/', {'q': 'BOGOTA d'})
+        self.assertEqual(
+            [translation.name for translation in response.context['cl'].result_list],
+            ['Bogotá D.C.']
+        )
+
+    def test_names(self):
+        city = City.objects.get()
+        with self.assertNumQueries(0):
+            self.assertEqual(str(city), 'Bogotá')
+        translation = CityTranslation.objects.select_related('city').get(language_code='es')
+        with self.assertNumQueries(0):
+            self.assertEqual(str(translation), 'Bogotá in Spanish is Bogotá D.C.')
+        self.assertEqual(str(City(code='05001')), '05001')
@@ -0,0 +1,240 @@
+import random
+
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from api import caching
+
+from api.autocomplete import AutocompleteEngine, IndexState, NameIndex
+from api.models import (
+    Country, Region, City, CountryTranslation, RegionTranslation,
+    CityTranslation, ZipCode
+)
+
+
+class NameIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        self.index = NameIndex([
+            (1, 'bogota'), (2, 'san bogota'), (3, 'bello'), (4, 'abogota'),
+        ])
+
+    def test_names_then_words_then_the_rest(self):
+        self.assertEqual(list(self.index.search('bog')), [1, 2, 4])
+        self.assertEqual(list(self.index.search('ogo')), [1, 2, 4])
+        self.assertEqual(list(self.index.search('bel')), [3])
+        self.assertEqual(list(self.index.search('cali')), [])
+        self.assertEqual(list(self.index.search('')), [])
+
+    def test_changes(self):
+        self.index.set(5, 'bogota nueva')
+        self.index.set(3, 'nuevo bello')
+        self.index.remove(1)
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self.index.get(1), None)
+        self.assertEqual(self.index.get(3), 'nuevo bello')
+        self.assertEqual(list(self.index.search('bog')), [5, 2, 4])
+        self.assertEqual(list(self.index.search('bel')), [3])
+        self.assertEqual(list(self.index.search('uev')), [5, 3])
+
+    def test_compaction(self):
+        self.index.COMPACT_THRESHOLD = 3
+        self.index.set(5, 'bogota nueva')
+        self.index.remove(1)
+        self.assertEqual(len(self.index.pending) + len(self.index.removed), 2)
+        self.index.set(3, 'nuevo bello')
+        self.assertEqual(self.index.pending, {})
+        self.assertEqual(self.index.removed, set())
+        self.assertEqual(list(self.index.city_ids), [2, 3, 4, 5])
+        self.assertEqual(list(self.index.search('bog')), [5, 2, 4])
+        self.assertEqual(list(self.index.search('bel')), [3])
+
+    def test_copies_are_changed_on_their_own(self):
+        index = self.index.copy()
+        index.set(5, 'bogota nueva')
+        index.remove(1)
+        self.assertEqual(list(self.index.search('bog')), [1, 2, 4])
+        self.assertEqual(list(index.search('bog')), [5, 2, 4])
+
+    def test_matches_the_same_names_as_a_substring_search(self):
+        generator = random.Random(7)
+        names = {}
+
+        def random_name():
+            return ' '.join(
+                ''.join(generator.choice('abo') for _i in range(generator.randint(1, 4)))
+                for _word in range(generator.randint(1, 3))
+            )
+
+        index = NameIndex()
+        index.COMPACT_THRESHOLD = 16
+        for _step in range(300):
+            city_id = generator.randint(1, 60)
+            if generator.random() < 0.2:
+                index.remove(city_id)
+                names.pop(city_id, None)
+            else:
+                name = random_name()
+                index.set(city_id, name)
+                names[city_id] = name
+            for term in ('a', 'bo', 'ob a', 'aba'):
+                self.assertEqual(
+                    set(index.search(term)),
+                    {city_id for city_id, name in names.items() if term in name}
+                )
+
+
+class IndexStateTests(SimpleTestCase):
+
+    def test_copies_are_changed_on_their_own(self):
+        state = IndexState()
+        state.set_city(1, '05001', 10, 100)
+        state.set_city_name('en', 1, 'medellin')
+        state.set_region_name('en', 10, 'antioquia')
+
+        copy = state.copy()
+        copy.set_city(2, '05001', 10, 100)
+        copy.remove_city(1)
+        copy.set_region_name('en', 10, 'antioquia department')
+
+        self.assertEqual(state.codes, {'05001': [1]})
+        self.assertEqual(list(state.cities), [1])
+        self.assertEqual(list(state.names['en'].search('med')), [1])
+        self.assertTrue(state.in_region('en', 1, 'antioquia'))
+        self.assertEqual(copy.codes, {'05001': [2]})
+        self.assertEqual(list(copy.cities), [2])
+        self.assertEqual(list(copy.names['en'].search('med')), [])
+        self.assertTrue(copy.in_region('en', 2, 'department'))
+
+    def test_copies_share_what_they_do_not_change(self):
+        state = IndexState()
+        state.set_city(1, '05001', 10, 100)
+        state.set_city_name('en', 1, 'medellin')
+        state.set_city_name('es', 1, 'medellin')
+        state.set_zip_code('050001', 1)
+
+        copy = state.copy()
+        copy.set_city_name('es', 1, 'medellín')
+        copy.set_zip_code('050002', 1)
+        self.assertIs(copy.cities, state.cities)
+        self.assertIs(copy.names['en'], state.names['en'])
+        self.assertIsNot(copy.names['es'], state.names['es'])
+        self.assertEqual(state.zip_codes, {'050001': 1})
+
+        # Copies of copies too
+        other = copy.copy()
+        other.remove_zip_code('050001')
+        self.assertIs(other.names['es'], copy.names['es'])
+        self.assertEqual(copy.zip_codes, {'050001': 1, '050002': 1})
+        self.assertEqual(other.zip_codes, {'050002': 1})
+
+
+@override_settings(PLACES_AUTOCOMPLETE=True)
+class AutocompleteEngineTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        CountryTranslation.objects.create(country=colombia, language_code='en', name='Colombia')
+        antioquia = Region.objects.create(code='ANT', country=colombia)
+        RegionTranslation.objects.create(region=antioquia, language_code='en', name='Antioquia')
+        cundinamarca = Region.objects.create(code='CUN', country=colombia)
+        RegionTranslation.objects.create(
+            region=cundinamarca, language_code='en', name='Cundinamarca'
+        )
+
+        cls.cities = {}
+        for code, region, name in [
+                ('05088', antioquia, 'Bello'),
+                ('11001', cundinamarca, 'Bogotá'),
+                ('25001', cundinamarca, 'Isabel')]:
+            city = City.objects.create(code=code, region=region, country=colombia)
+            CityTranslation.objects.create(city=city, language_code='en', name=name)
+            cls.cities[code] = city.pk
+        ZipCode.objects.create(city_id=cls.cities['11001'], zip_code='110111')
+
+    def setUp(self):
+        self.engine = AutocompleteEngine()
+        self.engine.build()
+
+    def search(self, *queries, **kwargs):
+        ids = self.engine.search('en', *queries, **kwargs)
+        codes = dict((city_id, code) for code, city_id in self.cities.items())
+        return [codes[city_id] for city_id in ids]
+
+    def test_search(self):
+        self.assertEqual(self.search('bel'), ['05088', '25001'])
+        self.assertEqual(self.search('ogot'), ['11001'])
+        self.assertEqual(self.search('110111'), ['11001'])
+        self.assertEqual(self.search('05088'), ['05088'])
+
+    def test_pages(self):
+        self.assertEqual(self.search('bel', limit=1), ['05088'])
+        self.assertEqual(self.search('bel', limit=1, offset=1), ['25001'])
+
+    def test_region_and_country_sections(self):
+        self.assertEqual(self.search('bel', 'cundinamarca'), ['25001'])
+        self.assertEqual(self.search('bel', 'colombia'), ['05088', '25001'])
+        self.assertEqual(self.search('bel', 'ant', 'co'), ['05088'])
+        self.assertEqual(self.search('bel', 'ant', 'peru'), [])
+
+    def test_applies_the_changes_to_a_copy(self):
+        state = self.engine.state
+        self.engine.apply(
+            self.engine.version + 1, IndexState.set_city_name, 'en', self.cities['11001'],
+            'bellavista'
+        )
+        self.assertEqual(self.search('bel'), ['05088', '11001', '25001'])
+        self.assertIsNot(self.engine.state, state)
+        self.assertEqual(list(state.names['en'].search('bel')), [
+            self.cities['05088'], self.cities['25001']
+        ])
+
+    @override_settings(PLACES_AUTOCOMPLETE=False)
+    def test_disabled(self):
+        self.assertIsNone(self.engine.search('en', 'bel'))
+
+
+@override_settings(PLACES_AUTOCOMPLETE=True, PLACES_AUTOCOMPLETE_REFRESH=0)
+class BackgroundBuildTests(TransactionTestCase):
+    """The index is built by another thread, with its own connection"""
+
+    def setUp(self):
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        self.bello = City.objects.create(code='05088', country=colombia)
+        CityTranslation.objects.create(city=self.bello, language_code='en', name='Bello')
+        self.engine = AutocompleteEngine()
+
+    def wait_for_the_build(self):
+        with self.engine.building:
+            pass
+
+    def test_the_first_queries_fall_back_to_the_database(self):
+        self.assertIsNone(self.engine.search('en', 'bel'))
+        self.wait_for_the_build()
+        self.assertEqual(self.engine.search('en', 'bel'), [self.bello.pk])
+
+    def test_stale_indexes_are_served_until_replaced(self):
+        self.engine.build()
+        state = self.engine.state
+        isabel = City.objects.create(code='25001', country=self.bello.country)
+        CityTranslation.objects.create(city=isabel, language_code='en', name='Isabel')
+
+        # While another build runs
+        with self.engine.building:
+            self.assertEqual(self.engine.search('en', 'bel'), [self.bello.pk])
+        self.engine.search('en', 'bel')
+        self.wait_for_the_build()
+        self.assertIsNot(self.engine.state, state)
+        self.assertEqual(self.engine.search('en', 'bel'), [self.bello.pk, isabel.pk])
+
+    def test_failures_keep_the_current_index(self):
+        self.engine.build()
+        state = self.engine.state
+        caching.bump_dataset_version()
+        with mock.patch.object(self.engine.state_class, 'load', side_effect=RuntimeError):
+            with self.assertLogs('api.engines', 'ERROR'):
+                self.engine.search('en', 'bel')
+                self.wait_for_the_build()
+        self.assertIs(self.engine.state, state)
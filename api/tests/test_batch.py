@@ -0,0 +1,86 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from api import caching, views
+from api.models import (
+    Country, Region, City, RegionTranslation, CityTranslation, ZipCode
+)
+
+
+class CitiesBatchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        antioquia = Region.objects.create(code='ANT', country=colombia)
+        cundinamarca = Region.objects.create(code='CUN', country=colombia)
+        for region, name in [(antioquia, 'Antioquia'), (cundinamarca, 'Cundinamarca')]:
+            RegionTranslation.objects.create(region=region, language_code='en', name=name)
+        cls.cities = {}
+        for code, region, name in [
+                ('11001', cundinamarca, 'Bogotá'),
+                ('05001', antioquia, 'Medellín'),
+                ('05088', antioquia, 'Bello'),
+                ('25001', cundinamarca, 'Isabel')]:
+            city = City.objects.create(code=code, region=region, country=colombia)
+            CityTranslation.objects.create(city=city, language_code='en', name=name)
+            cls.cities[code] = city.pk
+        ZipCode.objects.create(city_id=cls.cities['11001'], zip_code='110111')
+
+    def setUp(self):
+        cache.clear()
+        caching.local_cities.clear()
+
+    def batch(self, language='en', **data):
+        return self.client.post(
+            '/cities/%s/batch/' % language, data, content_type='application/json'
+        )
+
+    def codes(self, cities):
+        return [city['code'] for city in cities]
+
+    def test_queries_and_zip_codes(self):
+        response = self.batch(
+            queries=['Bogota', 'bel', 'Medellin, Antioquia', 'bo', 'xyz'],
+            zip_codes=['110111', '999999']
+        )
+        self.assertEqual(response.status_code, 200)
+        queries = response.json()['queries']
+        self.assertEqual(list(queries), ['Bogota', 'bel', 'Medellin, Antioquia', 'bo', 'xyz'])
+        self.assertEqual(self.codes(queries['Bogota']), ['11001'])
+        # Only the best match unless a limit is given
+        self.assertEqual(self.codes(queries['bel']), ['05088'])
+        self.assertEqual(self.codes(queries['Medellin, Antioquia']), ['05001'])
+        self.assertEqual((queries['bo'], queries['xyz']), ([], []))
+
+        zip_codes = response.json()['zip_codes']
+        self.assertEqual(zip_codes['110111']['code'], '11001')
+        self.assertIsNone(zip_codes['999999'])
+
+        response = self.batch(queries=['bel'], limit=5, mode='flat')
+        self.assertEqual(
+            [city['name'] for city in response.json()['queries']['bel']], ['Bello', 'Isabel']
+        )
+
+    def test_queries_are_resolved_once(self):
+        with mock.patch('api.planner.CitiesPlan.execute', autospec=True,
+                        side_effect=lambda plan: ([self.cities['11001']], None)) as execute:
+            response = self.batch(queries=['Bogota', 'bogota ', 'BOGOTÁ'])
+        self.assertEqual(execute.call_count, 1)
+        self.assertEqual(len(response.json()['queries']), 3)
+
+        # And taken from the cache afterwards, the single queries' one too
+        with self.assertNumQueries(0):
+            response = self.batch(queries=['Bogota'])
+        self.assertEqual(self.codes(response.json()['queries']['Bogota']), ['11001'])
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.batch('xx', queries=['bogota']).status_code, 400)
+        self.assertEqual(self.batch(queries='bogota').status_code, 400)
+        self.assertEqual(self.batch(queries=[1]).status_code, 400)
+        with mock.patch.object(views, 'BATCH_MAX_ITEMS', 2):
+            response = self.batch(queries=['bogota', 'bello'], zip_codes=['110111'])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get('/cities/en/batch/').status_code, 405)
@@ -0,0 +1,94 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from api import caching
+from api.models import (
+    Country, Region, City, CountryTranslation, RegionTranslation, CityTranslation, ZipCode
+)
+
+
+class BrowseTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        CountryTranslation.objects.create(country=colombia, language_code='en', name='Colombia')
+        CountryTranslation.objects.create(country=colombia, language_code='es', name='Colombia')
+        ecuador = Country.objects.create(code='EC', currency_code='USD')
+        CountryTranslation.objects.create(country=ecuador, language_code='es', name='Ecuador')
+        Country.objects.create(code='AR', currency_code='USD')
+
+        antioquia = Region.objects.create(code='ANT', local_code='05', country=colombia)
+        RegionTranslation.objects.create(region=antioquia, language_code='en', name='Antioquia')
+        cls.cundinamarca = Region.objects.create(code='CUN', local_code='25', country=colombia)
+        RegionTranslation.objects.create(
+            region=cls.cundinamarca, language_code='en', name='Cundinamarca'
+        )
+
+        cls.cities = {}
+        for code, region, name in [
+                ('25754', cls.cundinamarca, 'Soacha'),
+                ('11001', cls.cundinamarca, 'Bogota'),
+                ('25099', cls.cundinamarca, None),
+                ('05001', antioquia, 'Medellin')]:
+            city = City.objects.create(code=code, region=region, country=colombia)
+            if name:
+                CityTranslation.objects.create(city=city, language_code='en', name=name)
+            cls.cities[code] = city.pk
+        City.objects.create(code='99999', country=colombia)
+        for zip_code in ('110111', '110121'):
+            ZipCode.objects.create(city_id=cls.cities['11001'], zip_code=zip_code)
+
+    def setUp(self):
+        cache.clear()
+        caching.local_cities.clear()
+        caching._dataset_state['state'] = None
+
+    def test_countries(self):
+        response = self.client.get('/browse/es/')
+        self.assertEqual(response.status_code, 200)
+        # Sorted by name, the ones without it last
+        self.assertEqual(response.json(), [
+            {'code': 'CO', 'name': 'Colombia', 'currency_code': 'COP', 'regions': 2,
+             'cities': 5},
+            {'code': 'EC', 'name': 'Ecuador', 'currency_code': 'USD', 'regions': 0,
+             'cities': 0},
+            {'code': 'AR', 'name': None, 'currency_code': 'USD', 'regions': 0, 'cities': 0},
+        ])
+        self.assertEqual(
+            [country['name'] for country in self.client.get('/browse/en/').json()],
+            ['Colombia', None, None]
+        )
+
+    def test_regions(self):
+        self.assertEqual(self.client.get('/browse/en/CO/').json(), [
+            {'code': 'ANT', 'local_code': '05', 'name': 'Antioquia', 'cities': 1},
+            {'code': 'CUN', 'local_code': '25', 'name': 'Cundinamarca', 'cities': 3},
+        ])
+        self.assertEqual(self.client.get('/browse/en/EC/').json(), [])
+
+    def test_cities(self):
+        self.assertEqual(self.client.get('/browse/en/CO/CUN/').json(), [
+            {'id': self.cities['11001'], 'code': '11001', 'name': 'Bogota', 'zip_codes': 2},
+            {'id': self.cities['25754'], 'code': '25754', 'name': 'Soacha', 'zip_codes': 0},
+            {'id': self.cities['25099'], 'code': '25099', 'name': None, 'zip_codes': 0},
+        ])
+
+    def test_unknown_places(self):
+        self.assertEqual(self.client.get('/browse/xx/').status_code, 400)
+        self.assertEqual(self.client.get('/browse/en/PE/').status_code, 404)
+        self.assertEqual(self.client.get('/browse/en/CO/XYZ/').status_code, 404)
+        # Misses are cached too
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/browse/en/CO/XYZ/').status_code, 404)
+
+    def test_listings_are_cached_per_version(self):
+        self.client.get('/browse/en/CO/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/browse/en/CO/')
+        self.assertEqual(len(response.json()), 2)
+        self.assertIn('ETag', response)
+
+        Region.objects.create(code='DC', country=self.cundinamarca.country)
+        caching._bump_dataset_version()
+        self.assertEqual(len(self.client.get('/browse/en/CO/').json()), 3)
@@ -0,0 +1,93 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import transaction
+from django.test import SimpleTestCase, TransactionTestCase
+
+from api import caching
+from api.caching import (
+    bump_dataset_version, cities_cache_stats, get_cached_cities, get_dataset_version,
+    get_many_cached_cities, set_cached_cities
+)
+from api.models import Country, Region, City, CityTranslation
+
+
+class CitiesCacheTests(TransactionTestCase):
+    """The version is bumped once the changes commit"""
+
+    def setUp(self):
+        cache.clear()
+        caching.local_cities.clear()
+        # The version starts over in the cleared cache, read it again
+        caching._dataset_state['state'] = None
+
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        cundinamarca = Region.objects.create(code='CUN', country=colombia)
+        self.bogota = City.objects.create(code='11001', region=cundinamarca, country=colombia)
+        CityTranslation.objects.create(city=self.bogota, language_code='en', name='Bogotá')
+
+    def names(self, q):
+        response = self.client.get('/cities/en/', {'q': q})
+        return [
+            name['name'] for city in response.json() for name in city['city_translations']
+        ]
+
+    def test_bumps(self):
+        version = get_dataset_version()
+        self.assertEqual(bump_dataset_version(), version + 1)
+
+        with transaction.atomic():
+            self.assertIsNone(bump_dataset_version())
+            self.assertEqual(get_dataset_version(), version + 1)
+        self.assertEqual(get_dataset_version(), version + 2)
+
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                bump_dataset_version()
+                raise ValueError
+        self.assertEqual(get_dataset_version(), version + 2)
+
+    def test_queries_are_cached_normalized(self):
+        self.assertEqual(self.names('Bogo'), ['Bogotá'])
+        hits = cities_cache_stats()['hits']
+        for q in ('bogo ', 'BOGO', 'bogó'):
+            self.assertEqual(self.names(q), ['Bogotá'])
+        self.assertEqual(cities_cache_stats()['hits'], hits + 3)
+
+    def test_changes_reach_the_cached_pages(self):
+        self.assertEqual(self.names('bogo'), ['Bogotá'])
+        version = get_dataset_version()
+        translation = CityTranslation.objects.get()
+        translation.name = 'Bogotá D.C.'
+        translation.save()
+        self.assertEqual(get_dataset_version(), version + 1)
+        self.assertEqual(self.names('bogo'), ['Bogotá D.C.'])
+
+
+class LocalCitiesCacheTests(SimpleTestCase):
+    """Pages are kept in the memory of the worker, in front of the cache"""
+
+    def setUp(self):
+        cache.clear()
+        caching.local_cities.clear()
+        caching._dataset_state['state'] = None
+
+    def test_pages_are_read_from_memory_first(self):
+        set_cached_cities('page', '[]')
+        with mock.patch.object(caching.cache, 'get') as get:
+            self.assertEqual(get_cached_cities('page')[0], '[]')
+        get.assert_not_called()
+
+        # Pages only in the cache, e.g. cached by other workers, are kept too
+        caching.local_cities.clear()
+        self.assertEqual(get_cached_cities('page')[0], '[]')
+        self.assertEqual(caching.local_cities.get('page')[0], '[]')
+        caching.local_cities.clear()
+        self.assertEqual(list(get_many_cached_cities(['page', 'other'])), ['page'])
+        self.assertIsNotNone(caching.local_cities.get('page'))
+
+    def test_pages_are_dropped_with_the_version(self):
+        get_dataset_version()
+        set_cached_cities('page', '[]')
+        caching._bump_dataset_version()
+        self.assertEqual(len(caching.local_cities), 0)
@@ -0,0 +1,166 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from api.changes import (
+    START, ChangesExpired, changes_since, latest_change, parse_position,
+    prune_changes, record_changes
+)
+from api.models import (
+    Country, Region, City, CityTranslation, ZipCode, PlaceChange, PlaceKindChoices
+)
+
+
+class ChangesFeedTests(TransactionTestCase):
+    """Every statement commits on its own, as the feed only sends committed changes"""
+
+    def setUp(self):
+        self.colombia = Country.objects.create(code='CO', currency_code='COP')
+        self.cundinamarca = Region.objects.create(code='CUN', country=self.colombia)
+        self.bogota = City.objects.create(
+            code='11001', region=self.cundinamarca, country=self.colombia
+        )
+        CityTranslation.objects.create(city=self.bogota, language_code='es', name='Bogotá')
+        ZipCode.objects.create(city=self.bogota, zip_code='110111')
+
+    def follow(self, since=START, limit=1000):
+        """Every page from 'since' on, and the last position"""
+        pages = []
+        while True:
+            page = changes_since(since, limit)
+            pages.append(page)
+            since = page['version']
+            if not page['more']:
+                return pages, since
+
+    def test_parse_position(self):
+        self.assertEqual(parse_position(START), (0, 0))
+        self.assertEqual(parse_position('812-1234'), (812, 1234))
+        for value in ('', 'abc', '812', '812-', '-1', '812--1', '812-12-3'):
+            with self.assertRaises(ValueError):
+                parse_position(value)
+
+    def test_records(self):
+        pages, version = self.follow()
+        self.assertEqual(version, latest_change())
+        changes = pages[0]['changes']
+        # Parents first, and places changed many times sent once
+        self.assertEqual(
+            [(change['type'], change['id']) for change in changes],
+            [
+                ('country', self.colombia.pk), ('region', self.cundinamarca.pk),
+                ('city', self.bogota.pk)
+            ]
+        )
+        self.assertEqual(changes[2]['code'], '11001')
+        self.assertEqual(changes[2]['names'], {'es': 'Bogotá'})
+        self.assertEqual(changes[2]['zip_codes'], ['110111'])
+
+        self.assertEqual(changes_since(version), {
+            'since': version, 'version': version, 'more': False, 'changes': []
+        })
+        city_id = self.bogota.pk
+        self.bogota.delete()
+        page = changes_since(version)
+        self.assertIn({'type': 'city', 'id': city_id, 'deleted': True}, page['changes'])
+
+    def test_pages(self):
+        for number in range(5):
+            City.objects.create(code='2500%d' % number, country=self.colombia)
+        def changed(pages):
+            return {
+                (change['type'], change['id'])
+                for page in pages for change in page['changes']
+            }
+
+        everything, _version = self.follow()
+        for limit in (1, 2, 3):
+            pages, version = self.follow(limit=limit)
+            self.assertEqual(version, latest_change())
+            self.assertTrue(all(len(page['changes']) <= limit for page in pages))
+            self.assertEqual(changed(pages), changed(everything))
+
+    def test_changes_wait_for_older_transactions(self):
+        _pages, version = self.follow()
+        soacha = City.objects.create(code='25754', country=self.colombia)
+        PlaceChange.objects.filter(place_id=soacha.pk).delete()
+
+        # A long import, started before a shorter change
+        other = connection.copy()
+        self.addCleanup(other.close)
+        with other.cursor() as cursor:
+            cursor.execute('BEGIN')
+            cursor.execute(
+                "INSERT INTO {change} (kind, place_id, created_at, transaction_id)"
+                "  VALUES (%s, %s, now(), txid_current())".format(
+                    change=PlaceChange._meta.db_table
+                ),
+                [PlaceKindChoices.CITY, soacha.pk]
+            )
+        record_changes(PlaceKindChoices.CITY, [self.bogota.pk])
+
+        # Neither is sent while the import runs, nor skipped once it commits
+        page = changes_since(version)
+        self.assertEqual((page['version'], page['changes']), (version, []))
+        self.assertEqual(latest_change(), version)
+
+        with other.cursor() as cursor:
+            cursor.execute('COMMIT')
+        page = changes_since(version)
+        self.assertEqual(
+            [change['id'] for change in page['changes']], [self.bogota.pk, soacha.pk]
+        )
+        self.assertEqual(page['version'], latest_change())
+
+    def test_pruning(self):
+        _pages, first_version = self.follow()
+        City.objects.create(code='25754', country=self.colombia)
+        _pages, version = self.follow(first_version)
+
+        PlaceChange.objects.update(created_at=timezone.now() - timedelta(days=40))
+        recorded = PlaceChange.objects.count()
+        self.assertEqual(prune_changes(50), 0)
+        self.assertEqual(prune_changes(30), recorded - 1)
+        self.assertEqual(PlaceChange.objects.count(), 1)
+
+        # Up to date clients go on, the rest start over from a snapshot
+        self.assertEqual(changes_since(version)['changes'], [])
+        with self.assertRaises(ChangesExpired):
+            changes_since(first_version)
+        self.assertEqual(len(changes_since(START)['changes']), 1)
+
+        out = StringIO()
+        call_command('prune_place_changes', '--days', '1', stdout=out)
+        self.assertEqual(out.getvalue(), 'Deleted 0 changes\n')
+
+    def test_endpoint(self):
+        response = self.client.get('/changes/', {'since': START})
+        self.assertEqual(response.status_code, 200)
+        version = response.json()['version']
+        self.assertEqual(self.client.get('/changes/', {'since': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get('/changes/').status_code, 400)
+
+        PlaceChange.objects.update(created_at=timezone.now() - timedelta(days=40))
+        City.objects.create(code='25754', country=self.colombia)
+        prune_changes()
+        self.assertEqual(self.client.get('/changes/', {'since': START}).status_code, 200)
+        self.assertEqual(self.client.get('/changes/', {'since': version}).status_code, 410)
+
+    def test_conditional_requests(self):
+        response = self.client.get('/changes/', {'since': START})
+        etag = response['ETag']
+        self.assertEqual(etag, '"changes-%s"' % latest_change())
+        self.assertEqual(self.client.get(
+            '/changes/', {'since': START}, HTTP_IF_NONE_MATCH=etag
+        ).status_code, 304)
+
+        # A change settling gets through, whether it bumped the dataset
+        # version or not
+        record_changes(PlaceKindChoices.CITY, [self.bogota.pk])
+        response = self.client.get('/changes/', {'since': START}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
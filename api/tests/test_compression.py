@@ -0,0 +1,138 @@
+import gzip
+import json
+from datetime import date
+from decimal import Decimal
+from unittest import mock, skipIf
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.utils.translation import gettext_lazy as _
+
+from api import caching, compression, renderers
+from api.compression import (
+    CompressionMiddleware, accepted_encoding, compress_body, encode_response
+)
+from api.models import Country, Region, City, CityTranslation
+from api.renderers import FastJSONRenderer, dumps
+
+BODY = json.dumps([{'name': 'Bogotá', 'code': '%05d' % number} for number in range(50)])
+
+
+class RenderersTests(SimpleTestCase):
+
+    data = {'name': _('Bogotá'), 'population': Decimal('7.4'), 'founded': date(1538, 8, 6)}
+
+    def test_dumps(self):
+        expected = {'name': 'Bogotá', 'population': 7.4, 'founded': '1538-08-06'}
+        self.assertEqual(json.loads(dumps(self.data)), expected)
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(
+                dumps(self.data),
+                '{"name":"Bogotá","population":7.4,"founded":"1538-08-06"}'
+            )
+
+    @skipIf(renderers.orjson is None, 'orjson is not installed')
+    def test_orjson_renders_the_same(self):
+        renderer = FastJSONRenderer()
+        fast = renderer.render(self.data, 'application/json')
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(json.loads(fast), json.loads(renderer.render(self.data)))
+        # The browsable API asks for indentation, only the standard path has it
+        self.assertIn(b'\n', renderer.render(self.data, 'application/json; indent=2'))
+
+
+class CompressionTests(SimpleTestCase):
+
+    def request(self, accept_encoding):
+        return RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+
+    def test_compress_body(self):
+        self.assertEqual(compress_body('[]'), {})
+        encoded = compress_body(BODY)
+        self.assertEqual(gzip.decompress(encoded['gzip']).decode('utf-8'), BODY)
+        with mock.patch.object(compression, 'brotli', None):
+            self.assertEqual(list(compress_body(BODY)), ['gzip'])
+
+    @skipIf(compression.brotli is None, 'brotli is not installed')
+    def test_brotli_comes_first(self):
+        encoded = compress_body(BODY)
+        self.assertEqual(list(encoded), ['br', 'gzip'])
+        self.assertEqual(compression.brotli.decompress(encoded['br']).decode('utf-8'), BODY)
+        self.assertLess(len(encoded['br']), len(encoded['gzip']))
+
+    def test_accepted_encoding(self):
+        encoded = ['br', 'gzip']
+        for accept_encoding, encoding in [
+                ('gzip, deflate, br', 'br'),
+                ('gzip', 'gzip'),
+                ('br;q=0, gzip;q=0.5', 'gzip'),
+                ('*', 'br'),
+                ('*, br;q=0', 'gzip'),
+                ('gzip;q=0, br;q=0', None),
+                ('identity', None),
+                ('', None)]:
+            self.assertEqual(
+                accepted_encoding(self.request(accept_encoding), encoded), encoding,
+                accept_encoding
+            )
+
+    def test_encode_response(self):
+        encoded = compress_body(BODY)
+        response = HttpResponse(BODY, content_type='application/json')
+        response['ETag'] = '"places-1-2"'
+        encode_response(self.request('gzip'), response, encoded)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response.content, encoded['gzip'])
+        self.assertEqual(response['Content-Length'], str(len(encoded['gzip'])))
+        self.assertEqual(response['ETag'], 'W/"places-1-2"')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+        response = HttpResponse(BODY, content_type='application/json')
+        encode_response(self.request(''), response, encoded)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_middleware(self):
+        middleware = CompressionMiddleware(lambda request: None)
+        for content_type, accept_encoding, compressed in [
+                ('application/json', 'gzip', True),
+                ('text/csv; charset=utf-8', 'gzip', True),
+                ('application/json', 'gzip;q=0', False),
+                ('text/html; charset=utf-8', 'gzip', False)]:
+            response = middleware.process_response(
+                self.request(accept_encoding), HttpResponse(BODY, content_type=content_type)
+            )
+            self.assertEqual(response.get('Content-Encoding') == 'gzip', compressed)
+
+
+class CitiesCompressionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        cundinamarca = Region.objects.create(code='CUN', country=colombia)
+        for number in range(10):
+            city = City.objects.create(
+                code='250%02d' % number, region=cundinamarca, country=colombia
+            )
+            CityTranslation.objects.create(
+                city=city, language_code='en', name='San Bernardo %d' % number
+            )
+
+    def setUp(self):
+        cache.clear()
+        caching.local_cities.clear()
+
+    def test_cached_pages_are_served_compressed(self):
+        plain = self.client.get('/cities/en/', {'q': 'bernardo'})
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        # Encoded when rendered, and when read from the cache
+        for _request in range(2):
+            response = self.client.get(
+                '/cities/en/', {'q': 'bernardo'}, HTTP_ACCEPT_ENCODING='gzip'
+            )
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(gzip.decompress(response.content), plain.content)
+            self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+            self.assertIn('Accept-Encoding', response['Vary'])
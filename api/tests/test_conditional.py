@@ -0,0 +1,80 @@
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+from django.utils.http import http_date
+
+from api import caching
+from api.models import Country, Region, City, CityTranslation, ZipCode
+
+
+class DatasetConditionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        cundinamarca = Region.objects.create(code='CUN', country=colombia)
+        bogota = City.objects.create(code='11001', region=cundinamarca, country=colombia)
+        CityTranslation.objects.create(city=bogota, language_code='en', name='Bogota')
+        ZipCode.objects.create(city=bogota, zip_code='110111')
+
+    def setUp(self):
+        cache.clear()
+        caching.local_cities.clear()
+        caching._dataset_state['state'] = None
+
+    def test_not_modified(self):
+        response = self.client.get('/cities/en/', {'q': 'bogota'})
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"places-'))
+        self.assertIn('Last-Modified', response)
+
+        # Answered before the view runs any query
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                '/cities/en/', {'q': 'bogota'}, HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        response = self.client.get(
+            '/zip/110111/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes_modify_the_responses(self):
+        etag = self.client.get('/cities/en/', {'q': 'bogota'})['ETag']
+        caching._bump_dataset_version()
+        response = self.client.get('/cities/en/', {'q': 'bogota'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # Nor are the ETags reused when the version starts over
+        etag = response['ETag']
+        cache.clear()
+        caching._dataset_state['state'] = None
+        with mock.patch('api.caching.time.time', return_value=time.time() + 1):
+            self.assertNotEqual(self.client.get('/zip/110111/')['ETag'], etag)
+
+    def test_post_requests_are_not_conditional(self):
+        etag = self.client.get('/zip/110111/')['ETag']
+        response = self.client.post(
+            '/zip/', {'zip_codes': ['110111']}, content_type='application/json',
+            HTTP_IF_NONE_MATCH=etag,
+            HTTP_IF_UNMODIFIED_SINCE=http_date(0)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertEqual(response.json()['110111']['city']['code'], '11001')
+
+    def test_downloads(self):
+        self.client.force_login(User.objects.create_user('admin', password='secret'))
+        response = self.client.get('/download-cities/0/', {'country': 'CO', 'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            '/download-cities/0/', {'country': 'CO', 'format': 'csv'},
+            HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
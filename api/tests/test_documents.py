@@ -0,0 +1,192 @@
+import json
+
+from django.core.cache import cache
+from django.test import TransactionTestCase
+
+from api import caching
+from api.changes import record_changes
+from api.documents import (
+    _snapshot, _store_documents, get_city_documents, join_documents,
+    render_city_documents, render_flat_city_documents
+)
+from api.models import (
+    Country, Region, City, CityDocument, CountryTranslation, RegionTranslation,
+    CityTranslation, ZipCode, PlaceKindChoices
+)
+
+
+class CityDocumentsTests(TransactionTestCase):
+    """
+    Documents aren't stored while the places they're rendered from have
+    uncommitted changes, every statement must commit on its own
+    """
+
+    def setUp(self):
+        cache.clear()
+        caching.local_cities.clear()
+        self.colombia = Country.objects.create(code='CO', currency_code='COP')
+        CountryTranslation.objects.create(
+            country=self.colombia, language_code='en', name='Colombia'
+        )
+        self.cundinamarca = Region.objects.create(code='CUN', country=self.colombia)
+        RegionTranslation.objects.create(
+            region=self.cundinamarca, language_code='es', name='Cundinamarca'
+        )
+        self.bogota = City.objects.create(
+            code='11001', region=self.cundinamarca, country=self.colombia
+        )
+        CityTranslation.objects.create(city=self.bogota, language_code='en', name='Bogota')
+        CityTranslation.objects.create(city=self.bogota, language_code='es', name='Bogotá')
+        CityTranslation.objects.create(city=self.bogota, language_code='fr', name='Bogota')
+        ZipCode.objects.create(city=self.bogota, zip_code='110111')
+        self.soacha = City.objects.create(code='25754', country=self.colombia)
+
+    def documents(self, **filters):
+        return CityDocument.objects.filter(**filters)
+
+    def test_render(self):
+        ZipCode.objects.create(city=self.bogota, zip_code='110011')
+        bodies = render_city_documents([self.bogota.pk], 'es', 'en')
+        document = json.loads(bodies[self.bogota.pk])
+        self.assertEqual(document['code'], '11001')
+        self.assertEqual(document['zip_codes'], ['110011', '110111'])
+        # Only the translations asked for
+        self.assertEqual(
+            sorted(name['language_code'] for name in document['city_translations']),
+            ['en', 'es']
+        )
+        self.assertEqual(document['region']['code'], 'CUN')
+        self.assertEqual(
+            self.documents(language_code='es', extra_language_code='en').get().body,
+            bodies[self.bogota.pk]
+        )
+
+    def test_documents_are_rendered_once(self):
+        city_ids = [self.soacha.pk, self.bogota.pk]
+        documents = get_city_documents(city_ids, 'en')
+        self.assertEqual([json.loads(body)['id'] for body in documents], city_ids)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_city_documents(city_ids, 'en'), documents)
+        # The extra language is ignored when it's the language itself
+        with self.assertNumQueries(1):
+            get_city_documents(city_ids, 'en', 'en')
+        self.assertEqual(self.documents().count(), 2)
+        self.assertEqual(get_city_documents([0], 'en'), [])
+
+        self.assertEqual(
+            json.loads(join_documents(documents)), [json.loads(body) for body in documents]
+        )
+
+    def test_changes_remove_the_documents(self):
+        for changed in [
+                lambda: ZipCode.objects.create(city=self.bogota, zip_code='110121'),
+                lambda: CityTranslation.objects.get(city=self.bogota, language_code='en').save(),
+                lambda: self.cundinamarca.save(),
+                lambda: RegionTranslation.objects.get().delete(),
+                lambda: CountryTranslation.objects.get().save(),
+                lambda: self.bogota.save()]:
+            get_city_documents([self.bogota.pk, self.soacha.pk], 'en')
+            self.assertTrue(self.documents(city=self.bogota).exists())
+            changed()
+            self.assertFalse(self.documents(city=self.bogota).exists())
+            CityDocument.objects.all().delete()
+
+    def test_region_changes_only_remove_the_documents_of_their_cities(self):
+        get_city_documents([self.bogota.pk, self.soacha.pk], 'en')
+        self.cundinamarca.save()
+        self.assertEqual(
+            list(self.documents().values_list('city_id', flat=True)), [self.soacha.pk]
+        )
+
+    def test_endpoint(self):
+        response = self.client.get('/cities/es/', {'q': 'bogota'})
+        self.assertEqual(
+            [city['code'] for city in response.json()], ['11001']
+        )
+        self.assertTrue(self.documents(city=self.bogota, language_code='es').exists())
+
+
+class FlatDocumentsTests(TransactionTestCase):
+    """See CityDocumentsTests"""
+
+    def setUp(self):
+        cache.clear()
+        caching.local_cities.clear()
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        CountryTranslation.objects.create(country=colombia, language_code='en', name='Colombia')
+        cundinamarca = Region.objects.create(code='CUN', local_code='25', country=colombia)
+        RegionTranslation.objects.create(
+            region=cundinamarca, language_code='es', name='Cundinamarca'
+        )
+        self.bogota = City.objects.create(
+            code='11001', region=cundinamarca, country=colombia, latitude=4.711,
+            longitude=-74.0721
+        )
+        CityTranslation.objects.create(city=self.bogota, language_code='en', name='Bogota')
+        CityTranslation.objects.create(city=self.bogota, language_code='es', name='Bogotá')
+        CityTranslation.objects.create(city=self.bogota, language_code='fr', name='Bogota')
+        for zip_code in ('110121', '110111'):
+            ZipCode.objects.create(city=self.bogota, zip_code=zip_code)
+        self.soacha = City.objects.create(code='25754', country=colombia)
+
+    def test_render(self):
+        # A single query to read everything, then the documents are stored
+        with self.assertNumQueries(3):
+            bodies = render_flat_city_documents([self.bogota.pk, self.soacha.pk], 'es', 'en')
+        self.assertEqual(json.loads(bodies[self.bogota.pk]), {
+            'id': self.bogota.pk,
+            'code': '11001',
+            'name': 'Bogotá',
+            'extra_name': 'Bogota',
+            'zip_codes': ['110111', '110121'],
+            'country': {
+                'code': 'CO', 'name': None, 'extra_name': 'Colombia', 'flag': None,
+                'latitude': None, 'longitude': None
+            },
+            'region': {
+                'code': 'CUN', 'local_code': '25', 'name': 'Cundinamarca',
+                'extra_name': None, 'flag': None, 'latitude': None, 'longitude': None
+            },
+            'flag': None,
+            'latitude': 4.711,
+            'longitude': -74.0721,
+        })
+        soacha = json.loads(bodies[self.soacha.pk])
+        self.assertEqual((soacha['name'], soacha['zip_codes'], soacha['region']), (None, [], None))
+        self.assertEqual(CityDocument.objects.filter(flat=True).count(), 2)
+
+        # Without an extra language, nor translations other than the asked one
+        english = json.loads(render_flat_city_documents([self.bogota.pk], 'en')[self.bogota.pk])
+        self.assertNotIn('extra_name', english)
+        self.assertEqual(english['country']['name'], 'Colombia')
+
+    def test_full_and_flat_documents_are_kept_apart(self):
+        full = get_city_documents([self.bogota.pk], 'en')
+        flat = get_city_documents([self.bogota.pk], 'en', flat=True)
+        self.assertIn('city_translations', json.loads(full[0]))
+        self.assertEqual(json.loads(flat[0])['name'], 'Bogota')
+        self.assertEqual(get_city_documents([self.bogota.pk], 'en'), full)
+
+    def test_endpoint(self):
+        response = self.client.get('/cities/es/', {'q': 'bogota', 'mode': 'flat'})
+        self.assertEqual([city['name'] for city in response.json()], ['Bogotá'])
+        response = self.client.get('/cities/es/', {'q': 'bogota'})
+        self.assertIn('city_translations', response.json()[0])
+
+
+class StaleDocumentsTests(TransactionTestCase):
+    """Changes must commit while the documents are being rendered"""
+
+    def setUp(self):
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        self.bogota = City.objects.create(code='11001', country=colombia)
+
+    def test_documents_of_places_changed_after_the_render_read_them_are_dropped(self):
+        snapshot = _snapshot()
+        body = json.dumps({'id': self.bogota.pk})
+        record_changes(PlaceKindChoices.COUNTRY, [self.bogota.country_id])
+        _store_documents({self.bogota.pk: body}, 'en', '', False, snapshot)
+        self.assertFalse(CityDocument.objects.exists())
+
+        _store_documents({self.bogota.pk: body}, 'en', '', False, _snapshot())
+        self.assertEqual(CityDocument.objects.get().body, body)
@@ -0,0 +1,99 @@
+import csv
+import io
+import zipfile
+from xml.etree import ElementTree
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+
+from api.exports import (
+    cities_rows, countries_rows, csv_stream, export_languages, regions_rows,
+    xlsx_stream
+)
+from api.models import (
+    Country, Region, City, CountryTranslation, RegionTranslation, CityTranslation
+)
+
+SHEET = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def sheet_rows(content):
+    with zipfile.ZipFile(io.BytesIO(content)) as package:
+        sheet = ElementTree.fromstring(package.read('xl/worksheets/sheet1.xml'))
+    return [
+        [cell.findtext('%sis/%st' % (SHEET, SHEET)) for cell in row]
+        for row in sheet.iter('%srow' % SHEET)
+    ]
+
+
+class StreamsTests(SimpleTestCase):
+
+    rows = [('11001', 'Bogotá', None), ('05001', 'Medellín & <Antioquia>', 'x')]
+    cells = [
+        ['code', 'en', 'es'], ['11001', 'Bogotá', ''], ['05001', 'Medellín & <Antioquia>', 'x']
+    ]
+
+    def test_csv(self):
+        content = b''.join(csv_stream(['code', 'en', 'es'], iter(self.rows)))
+        self.assertEqual(list(csv.reader(io.StringIO(content.decode('utf-8')))), self.cells)
+
+    def test_xlsx(self):
+        stream = xlsx_stream(['code', 'en', 'es'], iter(self.rows))
+        # The fixed parts are sent before any row is read
+        self.assertTrue(next(stream).startswith(b'PK'))
+        content = b''.join(xlsx_stream(['code', 'en', 'es'], iter(self.rows)))
+        self.assertEqual(sheet_rows(content), self.cells)
+        with zipfile.ZipFile(io.BytesIO(content)) as package:
+            self.assertIn('xl/workbook.xml', package.namelist())
+
+
+class ExportsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        CountryTranslation.objects.create(country=colombia, language_code='en', name='Colombia')
+        CountryTranslation.objects.create(country=colombia, language_code='es', name='Colombia')
+        Country.objects.create(code='EC', currency_code='USD')
+        cundinamarca = Region.objects.create(code='CUN', local_code='25', country=colombia)
+        RegionTranslation.objects.create(
+            region=cundinamarca, language_code='es', name='Cundinamarca'
+        )
+        bogota = City.objects.create(code='11001', region=cundinamarca, country=colombia)
+        CityTranslation.objects.create(city=bogota, language_code='en', name='Bogota')
+        CityTranslation.objects.create(city=bogota, language_code='es', name='Bogotá')
+        City.objects.create(code='05001', country=colombia)
+        cls.user = User.objects.create_user('admin', password='secret')
+
+    def test_rows(self):
+        self.assertEqual(list(countries_rows(['en', 'es'])), [
+            ('CO', 'COP', 'Colombia', 'Colombia'), ('EC', 'USD', None, None)
+        ])
+        self.assertEqual(list(regions_rows('CO', ['es', 'fr'])), [
+            ('CUN', '25', 'CO', 'Cundinamarca', None)
+        ])
+        self.assertEqual(list(regions_rows('EC', ['es'])), [])
+        self.assertEqual(list(cities_rows('CO', ['en', 'es'])), [
+            ('05001', None, 'CO', None, None), ('11001', 'CUN', 'CO', 'Bogota', 'Bogotá')
+        ])
+
+    def test_downloads(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/download-cities/0/', {'country': 'CO', 'format': 'csv'})
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="Cities - CO - ', response['Content-Disposition'])
+        rows = list(csv.reader(io.StringIO(
+            b''.join(response.streaming_content).decode('utf-8')
+        )))
+        self.assertEqual(rows[0], ['code', 'region_code', 'country_code'] + export_languages())
+        self.assertEqual(
+            [row[:3] for row in rows[1:]], [['05001', '', 'CO'], ['11001', 'CUN', 'CO']]
+        )
+
+        response = self.client.get('/download-regions/1/', {'country': 'CO'})
+        self.assertEqual(len(sheet_rows(b''.join(response.streaming_content))), 1)
+        response = self.client.get('/download-countries/0/')
+        self.assertEqual(
+            [row[:2] for row in sheet_rows(b''.join(response.streaming_content))[1:]],
+            [['CO', 'COP'], ['EC', 'USD']]
+        )
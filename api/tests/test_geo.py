@@ -0,0 +1,209 @@
+import math
+import random
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+from api.geo import (
+    GEOHASH_PRECISION, block_reach, bounding_box, encode_geohash,
+    geohash_block, haversine
+)
+from api.helpers import stream_uploaded_cities
+from api.models import Country, Region, City
+from api.search import cities_within, nearest_cities
+
+
+def random_point(generator):
+    return generator.uniform(-85, 85), generator.uniform(-180, 180)
+
+
+class GeohashTests(SimpleTestCase):
+
+    def test_encode(self):
+        self.assertEqual(encode_geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(encode_geohash(4.711, -74.0721), 'd2g6f3')
+        self.assertEqual(len(encode_geohash(0, 0)), GEOHASH_PRECISION)
+
+    def test_haversine(self):
+        self.assertEqual(haversine(4.711, -74.0721, 4.711, -74.0721), 0)
+        # Bogotá to Medellín
+        self.assertAlmostEqual(haversine(4.711, -74.0721, 6.2442, -75.5812), 237, delta=2)
+        self.assertAlmostEqual(haversine(0, 0, 0, 180), math.pi * 6371.0088, places=3)
+
+    def test_the_block_contains_the_cell_of_the_point(self):
+        generator = random.Random(13)
+        for _step in range(200):
+            latitude, longitude = random_point(generator)
+            for precision in range(1, GEOHASH_PRECISION + 1):
+                self.assertIn(
+                    encode_geohash(latitude, longitude, precision),
+                    geohash_block(latitude, longitude, precision)
+                )
+
+    def test_points_within_reach_are_in_the_block(self):
+        generator = random.Random(17)
+        for _step in range(200):
+            latitude, longitude = random_point(generator)
+            precision = generator.randint(2, GEOHASH_PRECISION)
+            reach = block_reach(latitude, precision)
+            block = geohash_block(latitude, longitude, precision)
+            for _point in range(20):
+                # A point at most 'reach' km away, in any direction
+                distance = generator.uniform(0, reach)
+                bearing = generator.uniform(0, 2 * math.pi)
+                lat = latitude + distance * math.cos(bearing) / 111.2
+                lon = longitude + distance * math.sin(bearing) / (
+                    111.2 * math.cos(math.radians(lat))
+                )
+                if haversine(latitude, longitude, lat, lon) > reach:
+                    continue
+                self.assertIn(
+                    encode_geohash(lat, (lon + 180) % 360 - 180, precision), block
+                )
+
+    def test_bounding_boxes(self):
+        (min_lat, max_lat), lon_ranges = bounding_box(4.7, -74.1, 111.2)
+        self.assertAlmostEqual(min_lat, 3.7, places=2)
+        self.assertAlmostEqual(max_lat, 5.7, places=2)
+        self.assertEqual(len(lon_ranges), 1)
+        self.assertAlmostEqual(lon_ranges[0][0], -75.1, places=1)
+
+        self.assertEqual(bounding_box(89.5, 10, 100)[1], [])
+        (_lats, lon_ranges) = bounding_box(0, 179.5, 111.2)
+        self.assertEqual(len(lon_ranges), 2)
+        self.assertEqual(lon_ranges[0][1], 180.0)
+        self.assertEqual(lon_ranges[1][0], -180.0)
+
+        generator = random.Random(29)
+        for _step in range(500):
+            latitude, longitude = random_point(generator)
+            radius = generator.choice([1, 50, 500, 5000])
+            (min_lat, max_lat), lon_ranges = bounding_box(latitude, longitude, radius)
+            for _point in range(10):
+                lat, lon = random_point(generator)
+                if haversine(latitude, longitude, lat, lon) > radius:
+                    continue
+                self.assertTrue(min_lat <= lat <= max_lat)
+                if lon_ranges:
+                    self.assertTrue(any(low <= lon <= high for low, high in lon_ranges))
+
+    def test_blocks_reaching_the_poles_have_no_reach(self):
+        self.assertAlmostEqual(block_reach(80, 1), 0)
+        self.assertGreater(block_reach(80, 3), 0)
+
+
+class NearbyCitiesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        generator = random.Random(19)
+        cls.points = {}
+        # Clustered around Bogotá, plus a few far away ones
+        for number in range(60):
+            if number < 50:
+                point = (4.7 + generator.gauss(0, 0.3), -74.1 + generator.gauss(0, 0.3))
+            else:
+                point = random_point(generator)
+            city = City.objects.create(
+                code='%05d' % number, country=colombia, latitude=point[0], longitude=point[1]
+            )
+            cls.points[city.pk] = point
+        City.objects.create(code='99999', country=colombia)
+
+    def distances(self, latitude, longitude, max_distance=float('inf')):
+        return sorted(
+            (distance, city_id) for distance, city_id in (
+                (haversine(latitude, longitude, *point), city_id)
+                for city_id, point in self.points.items()
+            ) if distance <= max_distance
+        )
+
+    def assertDistancesEqual(self, first, second):
+        self.assertEqual([city_id for _distance, city_id in first], [
+            city_id for _distance, city_id in second
+        ])
+        for (distance, _city_id), (expected, _expected_id) in zip(first, second):
+            self.assertAlmostEqual(distance, expected, places=6)
+
+    def test_geohash_is_saved(self):
+        city = City.objects.get(code='00000')
+        self.assertEqual(city.geohash, encode_geohash(*self.points[city.pk]))
+        self.assertEqual(City.objects.get(code='99999').geohash, '')
+
+        city.latitude, city.longitude = 57.64911, 10.40744
+        city.save(update_fields=['latitude', 'longitude'])
+        city.refresh_from_db()
+        self.assertEqual(city.geohash, 'u4pruy')
+
+    def test_nearest(self):
+        for latitude, longitude in [
+                (4.7, -74.1), (5.5, -73.5), (40.4, -3.7), (-33.9, 151.2), (89.9, 0)]:
+            for limit in (1, 5, 61):
+                self.assertDistancesEqual(
+                    nearest_cities(City.objects.all(), latitude, longitude, limit),
+                    self.distances(latitude, longitude, 2000)[:limit]
+                )
+                self.assertDistancesEqual(
+                    nearest_cities(City.objects.all(), latitude, longitude, limit, 20000),
+                    self.distances(latitude, longitude)[:limit]
+                )
+
+    def test_within(self):
+        for latitude, longitude in [(4.7, -74.1), (5.5, -73.5), (-33.9, 151.2)]:
+            for radius in (0.5, 5, 20, 200, 5000):
+                self.assertDistancesEqual(
+                    cities_within(City.objects.all(), latitude, longitude, radius, 100),
+                    self.distances(latitude, longitude, radius)
+                )
+        self.assertDistancesEqual(
+            cities_within(City.objects.all(), 4.7, -74.1, 5000, 3),
+            self.distances(4.7, -74.1)[:3]
+        )
+
+    def test_across_the_antimeridian(self):
+        fiji = City.objects.create(
+            code='FJ001', country=Country.objects.get(), latitude=-16.5, longitude=179.9
+        )
+        for radius in (50, 500):
+            self.assertEqual(
+                [city_id for _distance, city_id in cities_within(
+                    City.objects.filter(code='FJ001'), -16.5, -179.9, radius, 10
+                )],
+                [fiji.pk]
+            )
+        self.assertEqual(nearest_cities(City.objects.all(), -16.5, -179.9, 1)[0][1], fiji.pk)
+
+    def test_endpoint(self):
+        response = self.client.get('/cities/en/nearest/', {'lat': 4.7, 'lon': -74.1, 'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [entry['city']['id'] for entry in response.json()],
+            [city_id for _distance, city_id in self.distances(4.7, -74.1)[:2]]
+        )
+        self.assertEqual(self.client.get('/cities/en/nearest/', {'lat': 91}).status_code, 400)
+        self.assertEqual(self.client.get('/cities/en/within/', {
+            'lat': 4.7, 'lon': -74.1, 'radius': 0
+        }).status_code, 400)
+
+
+class StreamingImportGeohashTests(TransactionTestCase):
+
+    def test_located_cities_keep_their_geohash(self):
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        Region.objects.create(code='CUN', country=colombia)
+        bogota = City.objects.create(
+            code='11001', country=colombia, latitude=4.711, longitude=-74.0721
+        )
+        stream_uploaded_cities(SimpleUploadedFile('cities.csv', (
+            'code,region_code,country_code,en\n'
+            '11001,CUN,CO,Bogotá\n'
+            '25754,CUN,CO,Soacha\n'
+        ).encode('utf-8')), 'CO')
+
+        self.assertEqual(City.objects.get(pk=bogota.pk).geohash, 'd2g6f3')
+        self.assertEqual(City.objects.get(code='25754').geohash, '')
+        self.assertEqual(
+            [city_id for _distance, city_id in nearest_cities(City.objects.all(), 4.6, -74.2, 5)],
+            [bogota.pk]
+        )
@@ -0,0 +1,213 @@
+import random
+from unittest import mock
+
+from django.apps import apps
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django_redis.exceptions import ConnectionInterrupted
+from redis.exceptions import RedisError
+
+from api import geocoding
+from api.geo import haversine
+from api.geocoding import (
+    BoundaryIndex, GeocodingEngine, GeocodingState, KDTree, _unit_vector
+)
+from api.models import (
+    Country, Region, City, CountryTranslation, RegionTranslation,
+    CityTranslation
+)
+
+# A square around Bogotá with a hole, as GeoJSON MultiPolygon coordinates
+BOGOTA = [[
+    [[-74.3, 4.4], [-73.9, 4.4], [-73.9, 4.9], [-74.3, 4.9], [-74.3, 4.4]],
+    [[-74.2, 4.5], [-74.1, 4.5], [-74.1, 4.6], [-74.2, 4.6], [-74.2, 4.5]],
+]]
+
+
+class KDTreeTests(SimpleTestCase):
+
+    def test_nearest_matches_a_brute_force_search(self):
+        generator = random.Random(23)
+        points = [
+            (generator.uniform(-90, 90), generator.uniform(-180, 180))
+            for _i in range(500)
+        ]
+        ids = list(range(100, 600))
+        tree = KDTree(ids, [_unit_vector(*point) for point in points])
+        self.assertEqual(len(tree), 500)
+
+        for _step in range(300):
+            latitude, longitude = generator.uniform(-90, 90), generator.uniform(-180, 180)
+            distance, point_id = min(
+                (haversine(latitude, longitude, *point), point_id)
+                for point_id, point in zip(ids, points)
+            )
+            nearest_id, nearest_distance = tree.nearest(latitude, longitude)
+            self.assertEqual(nearest_id, point_id)
+            self.assertAlmostEqual(nearest_distance, distance, places=6)
+
+    def test_across_the_antimeridian(self):
+        tree = KDTree([1, 2], [_unit_vector(0, 179.9), _unit_vector(0, 170)])
+        self.assertEqual(tree.nearest(0, -179.9)[0], 1)
+
+    def test_empty(self):
+        self.assertIsNone(KDTree([], []).nearest(4.7, -74.1))
+
+
+class BoundaryIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        self.index = BoundaryIndex()
+        self.index.add(1, (4.4, -74.3, 4.9, -73.9), BOGOTA)
+        self.index.add(2, (3.0, -76.0, 6.0, -72.0))
+        self.index.add(3, (4.0, -75.0, 5.5, -73.0))
+
+    def test_boundaries_first_then_the_smallest_box(self):
+        self.assertEqual(self.index.containing(4.7, -74.0), 1)
+        self.assertEqual(self.index.containing(5.2, -74.0), 3)
+        self.assertEqual(self.index.containing(3.5, -74.0), 2)
+        self.assertIsNone(self.index.containing(10, -74.0))
+
+    def test_holes(self):
+        self.assertEqual(self.index.containing(4.55, -74.15), 3)
+
+
+class GeocodingStateTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        colombia = Country.objects.create(
+            code='CO', currency_code='COP', min_latitude=-4.2, min_longitude=-79.0,
+            max_latitude=12.5, max_longitude=-66.8
+        )
+        CountryTranslation.objects.create(country=colombia, language_code='en', name='Colombia')
+        cundinamarca = Region.objects.create(
+            code='CUN', country=colombia, min_latitude=3.7, min_longitude=-74.9,
+            max_latitude=5.8, max_longitude=-73.0
+        )
+        RegionTranslation.objects.create(
+            region=cundinamarca, language_code='es', name='Cundinamarca'
+        )
+        cls.bogota = City.objects.create(
+            code='11001', region=cundinamarca, country=colombia, latitude=4.711,
+            longitude=-74.0721, boundary=BOGOTA
+        )
+        CityTranslation.objects.create(city=cls.bogota, language_code='es', name='Bogotá')
+        cls.soacha = City.objects.create(
+            code='25754', region=cundinamarca, country=colombia, latitude=4.5794,
+            longitude=-74.2168
+        )
+        City.objects.create(code='99999', country=colombia)
+
+    def setUp(self):
+        self.state = GeocodingState.load()
+
+    def test_containing_places(self):
+        self.assertEqual(self.state.reverse(4.7, -74.0, 'es'), {
+            'city': {
+                'id': self.bogota.pk, 'code': '11001', 'name': 'Bogotá',
+                'contains': True, 'distance': 0
+            },
+            'region': {
+                'id': self.bogota.region_id, 'code': 'CUN', 'name': 'Cundinamarca',
+                'contains': True
+            },
+            'country': {
+                'id': self.bogota.country_id, 'code': 'CO', 'name': None,
+                'contains': True
+            },
+        })
+
+    def test_nearest_city(self):
+        # In the hole of Bogotá's boundary, Soacha is the nearest
+        place = self.state.reverse(4.55, -74.15, 'en')
+        self.assertEqual(place['city']['id'], self.soacha.pk)
+        self.assertFalse(place['city']['contains'])
+        self.assertAlmostEqual(
+            place['city']['distance'], haversine(4.55, -74.15, 4.5794, -74.2168), places=3
+        )
+        self.assertTrue(place['region']['contains'])
+
+        # Out of every place, the region and country are the city's
+        place = self.state.reverse(-33.9, 151.2, 'en')
+        self.assertEqual(
+            (place['region']['code'], place['region']['contains']), ('CUN', False)
+        )
+        self.assertEqual(
+            (place['country']['name'], place['country']['contains']), ('Colombia', False)
+        )
+
+    def test_engine(self):
+        engine = GeocodingEngine()
+        self.assertEqual(engine.memory_footprint(), {'total': 0})
+        self.assertEqual(engine.reverse(4.7, -74.0, 'es')['city']['name'], 'Bogotá')
+        self.assertGreater(engine.memory_footprint()['total'], 0)
+
+    def test_endpoint(self):
+        response = self.client.get('/reverse/', {'lat': 4.7, 'lon': -74.0, 'language': 'es'})
+        self.assertEqual(response.json()['city']['code'], '11001')
+        self.assertEqual(self.client.get('/reverse/', {'lat': 4.7}).status_code, 400)
+        self.assertEqual(self.client.get('/reverse/', {
+            'lat': 4.7, 'lon': -74.0, 'language': 'xx'
+        }).status_code, 400)
+
+
+class PreloadTests(TestCase):
+
+    def setUp(self):
+        self.addCleanup(setattr, geocoding.engine, 'state', geocoding.engine.state)
+        geocoding.engine.state = None
+
+    @override_settings(PLACES_GEOCODING_PRELOAD=True)
+    def test_preload(self):
+        geocoding.preload()
+        self.assertIsNotNone(geocoding.engine.state)
+
+    @override_settings(PLACES_GEOCODING_PRELOAD=False)
+    def test_disabled(self):
+        geocoding.preload()
+        self.assertIsNone(geocoding.engine.state)
+
+    @override_settings(PLACES_GEOCODING_PRELOAD=True)
+    def test_the_apps_do_not_load_it(self):
+        # Management commands (migrate, makemigrations...) load the apps too
+        apps.get_app_config('api').ready()
+        self.assertIsNone(geocoding.engine.state)
+
+    @override_settings(PLACES_GEOCODING_PRELOAD=True)
+    def test_failures_are_left_for_the_first_query(self):
+        for error in (DatabaseError(), ConnectionInterrupted(connection=None), RedisError()):
+            with mock.patch.object(geocoding.engine, 'build', side_effect=error):
+                with self.assertLogs('api.geocoding', 'WARNING'):
+                    geocoding.preload()
+            self.assertIsNone(geocoding.engine.state)
+
+
+@override_settings(PLACES_GEOCODING_REFRESH=0)
+class BackgroundRefreshTests(TransactionTestCase):
+    """The engine is rebuilt by another thread, with its own connection"""
+
+    def setUp(self):
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        self.bogota = City.objects.create(
+            code='11001', country=colombia, latitude=4.711, longitude=-74.0721
+        )
+        self.engine = GeocodingEngine()
+
+    def test_the_old_state_is_served_until_replaced(self):
+        self.assertEqual(self.engine.reverse(4.5, -74.2, 'en')['city']['id'], self.bogota.pk)
+        state = self.engine.state
+        soacha = City.objects.create(
+            code='25754', country=self.bogota.country, latitude=4.5794, longitude=-74.2168
+        )
+        with mock.patch.object(GeocodingState, 'load', side_effect=AssertionError):
+            # Never loaded by the request, whether a build is running or not
+            with self.engine.building:
+                self.engine.reverse(4.5, -74.2, 'en')
+            self.assertIs(self.engine.state, state)
+
+        self.engine.reverse(4.5, -74.2, 'en')
+        with self.engine.building:
+            pass
+        self.assertIsNot(self.engine.state, state)
+        self.assertEqual(self.engine.reverse(4.5, -74.2, 'en')['city']['id'], soacha.pk)
@@ -0,0 +1,94 @@
+from django.test import TestCase
+
+from api.helpers import handle_uploaded_cities
+from api.models import (
+    Country, Region, City, CityTranslation, PlaceChange, PlaceKindChoices
+)
+
+HEADERS = ['code', 'region_code', 'country_code', 'en', 'es']
+
+
+class UploadedFile(object):
+    """The part of the uploaded files handle_uploaded_cities uses"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def get_array(self):
+        return [HEADERS] + self.rows
+
+
+class UpsertCitiesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        Region.objects.create(code='ANT', country=colombia)
+        Region.objects.create(code='CUN', country=colombia)
+
+    def upload(self, *rows):
+        report = handle_uploaded_cities(UploadedFile(list(rows)), 'CO')
+        self.assertEqual(report.errors, [])
+        return report.inserted, report.updated, report.unchanged
+
+    def test_counts(self):
+        self.assertEqual(self.upload(
+            ['05001', 'ANT', 'CO', 'Medellín', 'Medellín'],
+            ['11001', 'CUN', 'CO', 'Bogota', 'Bogotá'],
+        ), (2, 0, 0))
+        self.assertEqual(self.upload(
+            ['05001', 'ANT', 'CO', 'Medellín', 'Medellín'],
+            ['11001', 'CUN', 'CO', 'Bogota', 'Bogotá'],
+        ), (0, 0, 2))
+        self.assertEqual(self.upload(
+            ['05001', 'CUN', 'CO', 'Medellín', 'Medellín'],
+            ['11001', 'CUN', 'CO', 'Bogotá', 'Bogotá'],
+            ['05088', 'ANT', 'CO', 'Bello', 'Bello'],
+            ['', '', '', '', ''],
+        ), (1, 2, 0))
+
+        self.assertEqual(City.objects.get(code='05001').region.code, 'CUN')
+        bogota = City.objects.get(code='11001')
+        self.assertEqual((bogota.name, bogota.search_name), ('Bogotá', 'bogota'))
+        self.assertEqual(
+            dict(bogota.city_translations.values_list('language_code', 'search_name')),
+            {'en': 'bogota', 'es': 'bogota'}
+        )
+
+    def test_repeated_rows_are_counted_every_time(self):
+        # Like a row by row import, the second row finds the city of the first
+        self.assertEqual(self.upload(
+            ['05001', 'ANT', 'CO', 'Medellín', 'Medellín'],
+            ['05001', 'ANT', 'CO', 'Medellín', 'Medellín'],
+        ), (1, 0, 1))
+        self.assertEqual(City.objects.filter(code='05001').count(), 1)
+
+    def test_only_the_changed_cities_are_recorded(self):
+        self.upload(
+            ['05001', 'ANT', 'CO', 'Medellín', 'Medellín'],
+            ['11001', 'CUN', 'CO', 'Bogota', 'Bogotá'],
+        )
+        PlaceChange.objects.all().delete()
+        self.upload(
+            ['05001', 'ANT', 'CO', 'Medellín', 'Medellín'],
+            ['11001', 'CUN', 'CO', 'Bogota', 'Santa Fe de Bogotá'],
+        )
+        self.assertEqual(
+            list(PlaceChange.objects.values_list('kind', 'place_id')),
+            [(PlaceKindChoices.CITY, City.objects.get(code='11001').pk)]
+        )
+        self.assertEqual(
+            CityTranslation.objects.get(city__code='11001', language_code='es').name,
+            'Santa Fe de Bogotá'
+        )
+
+    def test_errors(self):
+        report = handle_uploaded_cities(UploadedFile([
+            ['05001', 'XYZ', 'CO', 'Medellín', 'Medellín'],
+        ]), 'CO')
+        self.assertEqual(len(report.errors), 1)
+        report = handle_uploaded_cities(UploadedFile([
+            ['05001', 'ANT', 'PE', 'Medellín', 'Medellín'],
+        ]), 'CO')
+        self.assertEqual(len(report.errors), 1)
+        self.assertFalse(City.objects.exists())
@@ -0,0 +1,158 @@
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from api import jobs
+from api.caching import get_job_progress
+from api.helpers import ImportReport
+from api.jobs import claim_next_job, enqueue_upload, requeue_stale_jobs, run_job
+from api.models import (
+    Country, CountryTranslation, UploadJob, UploadKindChoices, UploadStatusChoices
+)
+
+COUNTRIES = 'code,currency_code,en\nCO,COP,Colombia\nEC,USD,Ecuador\n'
+
+
+def uploaded(content=COUNTRIES):
+    return SimpleUploadedFile('countries.csv', content.encode('utf-8'))
+
+
+class UploadJobsTests(TransactionTestCase):
+    """Jobs are claimed and imported in their own transactions, and threads"""
+
+    def setUp(self):
+        cache.clear()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings = override_settings(MEDIA_ROOT=media, PLACES_WARM_AFTER_UPLOAD=False)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def enqueue(self, content=COUNTRIES):
+        return enqueue_upload(UploadKindChoices.COUNTRIES, uploaded(content))
+
+    def test_jobs_are_claimed_in_order(self):
+        first, second = self.enqueue(), self.enqueue()
+        self.assertEqual(first.status, UploadStatusChoices.PENDING)
+
+        job = claim_next_job()
+        self.assertEqual(job.pk, first.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, UploadStatusChoices.RUNNING)
+        self.assertIsNotNone(job.started_at)
+        self.assertEqual(job.heartbeat_at, job.started_at)
+
+        self.assertEqual(claim_next_job().pk, second.pk)
+        self.assertIsNone(claim_next_job())
+
+    def test_jobs_locked_by_other_workers_are_skipped(self):
+        first, second = self.enqueue(), self.enqueue()
+        other = connection.copy()
+        self.addCleanup(other.close)
+        with other.cursor() as cursor:
+            cursor.execute('BEGIN')
+            cursor.execute(
+                'SELECT id FROM %s WHERE id = %%s FOR UPDATE' % UploadJob._meta.db_table,
+                [first.pk]
+            )
+            self.assertEqual(claim_next_job().pk, second.pk)
+            cursor.execute('ROLLBACK')
+        self.assertEqual(claim_next_job().pk, first.pk)
+
+    def test_stale_jobs_are_requeued(self):
+        job = self.enqueue()
+        claim_next_job()
+        self.assertEqual(requeue_stale_jobs(), 0)
+
+        stale = timezone.now() - timedelta(seconds=jobs.JOB_TIMEOUT + 1)
+        UploadJob.objects.update(heartbeat_at=stale)
+        with self.assertLogs('api.jobs', 'WARNING'):
+            self.assertEqual(claim_next_job().pk, job.pk)
+        UploadJob.objects.update(heartbeat_at=None, started_at=stale)
+        with self.assertLogs('api.jobs', 'WARNING'):
+            self.assertEqual(requeue_stale_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(
+            (job.status, job.started_at, job.heartbeat_at),
+            (UploadStatusChoices.PENDING, None, None)
+        )
+
+    def test_run(self):
+        self.enqueue()
+        job = run_job(claim_next_job())
+        self.assertEqual(job.status, UploadStatusChoices.DONE)
+        self.assertEqual((job.inserted, job.updated, job.unchanged, job.rows_read), (2, 0, 0, 2))
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(job.errors, [])
+        self.assertEqual(CountryTranslation.objects.get(country__code='EC').name, 'Ecuador')
+        # The file is only needed by the import
+        self.assertFalse(job.file)
+        self.assertIsNone(get_job_progress(job.pk, None))
+
+    def test_heartbeats(self):
+        self.enqueue()
+        job = claim_next_job()
+        started = UploadJob.objects.get(pk=job.pk).heartbeat_at
+
+        heartbeats = []
+
+        def slow_import(file, country_code, progress):
+            progress(1)
+            self.assertEqual(get_job_progress(job.pk), 1)
+            time.sleep(0.2)
+            heartbeats.append(UploadJob.objects.get(pk=job.pk).heartbeat_at)
+            return ImportReport()
+
+        with mock.patch.object(jobs, 'JOB_HEARTBEAT', 0.05), mock.patch.dict(
+                jobs.IMPORTERS, {UploadKindChoices.COUNTRIES: slow_import}):
+            run_job(job)
+        self.assertGreater(heartbeats[0], started)
+
+    def test_failures(self):
+        def failing_import(file, country_code, progress):
+            raise ValueError('Broken file')
+
+        self.enqueue()
+        with mock.patch.dict(jobs.IMPORTERS, {UploadKindChoices.COUNTRIES: failing_import}):
+            with self.assertLogs('api.jobs', 'ERROR'):
+                job = run_job(claim_next_job())
+        self.assertEqual((job.status, job.errors), (UploadStatusChoices.FAILED, ['Broken file']))
+        self.assertFalse(job.file)
+
+        # Files with errors fail too
+        self.enqueue('code,currency_code,en\nCO,XXX,Colombia\n')
+        job = run_job(claim_next_job())
+        self.assertEqual(job.status, UploadStatusChoices.FAILED)
+        self.assertEqual(len(job.errors), 1)
+        self.assertFalse(Country.objects.exists())
+
+    def test_worker(self):
+        self.enqueue()
+        self.enqueue()
+        out = StringIO()
+        call_command('run_upload_worker', '--once', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+        self.assertEqual(
+            set(UploadJob.objects.values_list('status', flat=True)), {UploadStatusChoices.DONE}
+        )
+
+    def test_status_endpoint(self):
+        user = User.objects.create_user('admin', password='secret')
+        self.client.force_login(user)
+        self.enqueue()
+        job = run_job(claim_next_job())
+        response = self.client.get('/upload-jobs/%d/' % job.pk)
+        self.assertEqual(response.json()['status'], UploadStatusChoices.DONE)
+        self.assertEqual(response.json()['rows_read'], 2)
+        self.assertEqual(self.client.get('/upload-jobs/0/').status_code, 404)
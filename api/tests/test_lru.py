@@ -0,0 +1,42 @@
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from api.lru import LRUCache
+
+
+class LRUCacheTests(SimpleTestCase):
+
+    def test_least_recently_used_are_evicted(self):
+        lru = LRUCache(2, 60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+        lru.set('c', 3)
+        self.assertEqual(len(lru), 2)
+        self.assertIsNone(lru.get('b'))
+        self.assertEqual((lru.get('a'), lru.get('c')), (1, 3))
+
+        # Setting an entry again counts as using it
+        lru.set('a', 4)
+        lru.set('d', 5)
+        self.assertEqual((lru.get('a'), lru.get('c'), lru.get('d', 0)), (4, None, 5))
+
+    def test_entries_expire(self):
+        lru = LRUCache(2, 60)
+        with mock.patch('api.lru.time.monotonic', return_value=100):
+            lru.set('a', 1)
+        with mock.patch('api.lru.time.monotonic', return_value=159):
+            self.assertEqual(lru.get('a'), 1)
+        with mock.patch('api.lru.time.monotonic', return_value=161):
+            self.assertEqual(lru.get('a', 'expired'), 'expired')
+        self.assertEqual(len(lru), 0)
+
+    def test_disabled(self):
+        lru = LRUCache(0, 60)
+        lru.set('a', 1)
+        self.assertIsNone(lru.get('a'))
+        lru = LRUCache(1, 60)
+        lru.set('a', 1)
+        lru.clear()
+        self.assertIsNone(lru.get('a'))
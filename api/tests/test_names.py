@@ -0,0 +1,51 @@
+from django.test import TestCase
+
+from api.models import (
+    Country, Region, City, CountryTranslation, RegionTranslation, CityTranslation
+)
+
+
+class EnglishNamesTests(TestCase):
+    """Places keep a copy of their English translation's name"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.colombia = Country.objects.create(code='CO', currency_code='COP')
+        cls.cundinamarca = Region.objects.create(code='CUN', country=cls.colombia)
+        cls.bogota = City.objects.create(
+            code='11001', region=cls.cundinamarca, country=cls.colombia
+        )
+
+    def names(self, place):
+        place.refresh_from_db()
+        return place.name, place.search_name
+
+    def test_translations(self):
+        for place, translations, field in [
+                (self.colombia, CountryTranslation, 'country'),
+                (self.cundinamarca, RegionTranslation, 'region'),
+                (self.bogota, CityTranslation, 'city')]:
+            self.assertEqual(self.names(place), ('', ''))
+            english = translations.objects.create(
+                **{field: place}, language_code='en', name='Ñandú Éste'
+            )
+            self.assertEqual(self.names(place), ('Ñandú Éste', 'nandu este'))
+
+            # Other languages are left alone
+            spanish = translations.objects.create(
+                **{field: place}, language_code='es', name='Otro'
+            )
+            spanish.delete()
+            self.assertEqual(self.names(place)[0], 'Ñandú Éste')
+
+            english.name = 'Renamed'
+            english.save(update_fields=['name'])
+            self.assertEqual(self.names(place), ('Renamed', 'renamed'))
+
+            english.delete()
+            self.assertEqual(self.names(place), ('', ''))
+
+    def test_str(self):
+        self.assertEqual(str(self.bogota), '11001')
+        CityTranslation.objects.create(city=self.bogota, language_code='en', name='Bogota')
+        self.assertEqual(str(City.objects.get()), 'Bogota')
@@ -0,0 +1,98 @@
+from django.db.models import BooleanField, Case, F, FloatField, Value, When
+from django.test import SimpleTestCase, TestCase
+
+from api.models import Country, City
+from api.pagination import decode_cursor, encode_cursor
+from api.search import cities_page
+
+
+class CursorTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        for position in [
+                {'id': 7},
+                {'id': 7, 'p': True, 's': 0.25},
+                {'id': 7, 'p': False, 's': None},
+                {'o': 40},
+                {'n': 110111, 'z': '110111'}]:
+            self.assertEqual(decode_cursor(encode_cursor(position)), position)
+
+    def test_invalid_cursors(self):
+        for token in [
+                '', 'not a cursor', '!!!', encode_cursor([1, 2]),
+                encode_cursor({'id': '7'}), encode_cursor({'id': 7, 'p': True}),
+                encode_cursor({'id': 7, 'p': 1, 's': 0.5}),
+                encode_cursor({'id': 7, 'p': True, 's': '0.5'}),
+                encode_cursor({'o': -20}), encode_cursor({'o': 20, 'id': 7}),
+                encode_cursor({'n': '1', 'z': '1'})]:
+            with self.assertRaises(ValueError):
+                decode_cursor(token)
+
+
+class CitiesPageTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        # Code: (prefix match, similarity), with ties and missing similarities
+        cls.ranks = {
+            'A': (True, 0.9), 'B': (True, 0.5), 'C': (True, 0.5), 'D': (True, None),
+            'E': (True, None), 'F': (False, 0.7), 'G': (False, 0.7), 'H': (False, None),
+            'I': (False, 0.2), 'J': (False, None),
+        }
+        for code in sorted(cls.ranks, reverse=True):
+            City.objects.create(code=code, country=colombia)
+
+    def ranked(self):
+        return City.objects.annotate(
+            prefix_match=Case(
+                *[When(code=code, then=Value(prefix)) for code, (prefix, _s) in self.ranks.items()],
+                output_field=BooleanField()
+            ),
+            similarity=Case(
+                *[
+                    When(code=code, then=Value(similarity))
+                    for code, (_p, similarity) in self.ranks.items() if similarity is not None
+                ],
+                default=None,
+                output_field=FloatField()
+            )
+        ).order_by('-prefix_match', F('similarity').desc(nulls_last=True), 'pk')
+
+    def pages(self, queryset, limit):
+        """Ids of all the pages, and the number of pages"""
+        city_ids, pages, position = [], 0, None
+        while True:
+            page, position = cities_page(queryset, limit, position)
+            city_ids.extend(page)
+            pages += 1
+            if position is None:
+                return city_ids, pages
+            # As the clients get it
+            position = decode_cursor(encode_cursor(position))
+
+    def test_ranked_pages(self):
+        everything = list(self.ranked().values_list('pk', flat=True))
+        # Cities were created backwards, ties go by id
+        self.assertEqual(
+            [City.objects.get(pk=city_id).code for city_id in everything],
+            ['A', 'C', 'B', 'E', 'D', 'G', 'F', 'I', 'J', 'H']
+        )
+        for limit in range(1, len(everything) + 2):
+            city_ids, pages = self.pages(self.ranked(), limit)
+            self.assertEqual(city_ids, everything)
+            self.assertEqual(pages, max(1, -(-len(everything) // limit)))
+
+    def test_unranked_pages(self):
+        everything = list(City.objects.order_by('pk').values_list('pk', flat=True))
+        for limit in (1, 3, 10, 11):
+            self.assertEqual(self.pages(City.objects.order_by('pk'), limit)[0], everything)
+
+    def test_offset_pages(self):
+        everything = list(City.objects.order_by('pk').values_list('pk', flat=True))
+        city_ids, position = cities_page(City.objects.order_by('pk'), 4, {'o': 4})
+        self.assertEqual(city_ids, everything[4:8])
+        self.assertEqual(position, {'o': 8})
+        city_ids, position = cities_page(City.objects.order_by('pk'), 4, {'o': 8})
+        self.assertEqual(city_ids, everything[8:])
+        self.assertIsNone(position)
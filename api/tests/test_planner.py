@@ -0,0 +1,121 @@
+from django.test import SimpleTestCase, TestCase
+
+from api.models import Country, Region, City, CityTranslation, ZipCode
+from api.pagination import encode_cursor
+from api.planner import (
+    CitiesPlan, PlanError, SHAPE_AREA, SHAPE_CODE, SHAPE_NAME,
+    SHAPE_NAME_COUNTRY, SHAPE_NAME_REGION, SHAPE_NAME_REGION_COUNTRY,
+    SHAPE_ZIP, is_flat, parse_limit
+)
+
+
+class ParamsTests(SimpleTestCase):
+
+    def test_parse_limit(self):
+        self.assertEqual(parse_limit(None), 20)
+        self.assertEqual(parse_limit('abc'), 20)
+        self.assertEqual(parse_limit('abc', 10), 10)
+        self.assertEqual(parse_limit('5'), 5)
+        self.assertEqual(parse_limit('0'), 1)
+        self.assertEqual(parse_limit('-3'), 1)
+        self.assertEqual(parse_limit('500'), 50)
+
+    def test_is_flat(self):
+        self.assertTrue(is_flat({'mode': 'flat'}))
+        self.assertFalse(is_flat({'mode': 'full'}))
+        self.assertFalse(is_flat({}))
+
+
+class CitiesPlanTests(SimpleTestCase):
+
+    def plan(self, **params):
+        return CitiesPlan.from_params('en', params)
+
+    def test_shapes(self):
+        for q, shape in [
+                ('110111', SHAPE_ZIP),
+                ('05001', SHAPE_ZIP),
+                ('1101110', SHAPE_CODE),
+                ('CO-DC', SHAPE_NAME),
+                ('SP1234', SHAPE_CODE),
+                ('santa fe 2', SHAPE_NAME),
+                (', cundinamarca', SHAPE_AREA),
+                (',, colombia', SHAPE_AREA),
+                ('bogota', SHAPE_NAME),
+                ('bogota, cundinamarca', SHAPE_NAME_REGION),
+                ('bogota,, colombia', SHAPE_NAME_COUNTRY),
+                ('bogota, cundinamarca, colombia', SHAPE_NAME_REGION_COUNTRY)]:
+            self.assertEqual(self.plan(q=q).shape, shape, q)
+
+    def test_params(self):
+        plan = self.plan(q='Bogotá, Cundinamarca', extra_lang='es', limit='5', mode='flat')
+        self.assertEqual(plan.queries, ('bogota', 'cundinamarca', ''))
+        self.assertEqual((plan.language, plan.extra_lang), ('en', 'es'))
+        self.assertEqual((plan.limit, plan.flat, plan.position), (5, True, None))
+
+        self.assertIsNone(self.plan(q='bogota', extra_lang='en').extra_lang)
+        self.assertIsNone(self.plan(q='bogota', extra_lang='xx').extra_lang)
+        self.assertEqual(CitiesPlan.from_params('en', {'q': 'bogota'}, 10).limit, 10)
+
+    def test_nothing_to_look_up(self):
+        self.assertIsNone(self.plan())
+        self.assertIsNone(self.plan(q='bo'))
+
+    def test_invalid_requests(self):
+        with self.assertRaises(PlanError):
+            CitiesPlan.from_params('xx', {'q': 'bogota'})
+        with self.assertRaises(PlanError):
+            self.plan(q='bogota', cursor='not a cursor')
+
+    def test_cursors_must_fit_the_shape(self):
+        keyset = encode_cursor({'id': 7, 'p': True, 's': 0.5})
+        offset = encode_cursor({'o': 20})
+        unranked = encode_cursor({'id': 7})
+
+        self.assertEqual(self.plan(q='bogota', cursor=keyset).position['id'], 7)
+        self.assertEqual(self.plan(q='bogota, cun', cursor=offset).position, {'o': 20})
+        self.assertEqual(self.plan(q='110111', cursor=unranked).position, {'id': 7})
+        self.assertEqual(self.plan(q=', cundinamarca', cursor=unranked).position, {'id': 7})
+        for q, cursor in [
+                ('bogota', unranked), ('110111', keyset), ('110111', offset),
+                (', cundinamarca', keyset)]:
+            with self.assertRaises(PlanError):
+                self.plan(q=q, cursor=cursor)
+
+    def test_log_entries(self):
+        plan = self.plan(q='Bogotá,, Colombia', extra_lang='es', limit='5', mode='flat')
+        self.assertEqual(plan.log_entry, '["es","bogota","","colombia",5,true]')
+        replanned = CitiesPlan.from_log_entry('en', plan.log_entry)
+        self.assertEqual(
+            (replanned.extra_lang, replanned.queries, replanned.limit, replanned.flat),
+            ('es', ('bogota', '', 'colombia'), 5, True)
+        )
+        self.assertEqual(replanned.shape, SHAPE_NAME_COUNTRY)
+        entry = self.plan(q='bogota').log_entry
+        self.assertIsNone(CitiesPlan.from_log_entry('en', entry).extra_lang)
+
+    def test_cache_keys(self):
+        plan = self.plan(q='bogota')
+        self.assertEqual(plan.cache_key, self.plan(q='Bogotá').cache_key)
+        self.assertNotEqual(plan.cache_key, self.plan(q='bogota', mode='flat').cache_key)
+        self.assertNotEqual(plan.cache_key, self.plan(q='bogota', limit='5').cache_key)
+        spanish = CitiesPlan.from_params('es', {'q': 'bogota'})
+        self.assertNotEqual(plan.cache_key, spanish.cache_key)
+
+
+class ExecuteTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        cundinamarca = Region.objects.create(code='CUN', country=colombia)
+        cls.bogota = City.objects.create(code='11001', region=cundinamarca, country=colombia)
+        CityTranslation.objects.create(city=cls.bogota, language_code='en', name='Bogota')
+        ZipCode.objects.create(city=cls.bogota, zip_code='110111')
+
+    def test_code_lookups(self):
+        for q in ('110111', '11001'):
+            self.assertEqual(
+                CitiesPlan.from_params('en', {'q': q}).execute(), ([self.bogota.pk], None)
+            )
+        self.assertEqual(CitiesPlan.from_params('en', {'q': '999999'}).execute(), ([], None))
@@ -0,0 +1,75 @@
+from django.test import TestCase
+
+from api.models import (
+    Country, Region, City, CountryTranslation, RegionTranslation,
+    CityTranslation, ZipCode
+)
+from api.search import search_cities, search_city_codes
+
+
+class SearchCitiesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        CountryTranslation.objects.create(country=colombia, language_code='en', name='Colombia')
+        antioquia = Region.objects.create(code='ANT', country=colombia)
+        RegionTranslation.objects.create(region=antioquia, language_code='en', name='Antioquia')
+        cundinamarca = Region.objects.create(code='CUN', country=colombia)
+        RegionTranslation.objects.create(
+            region=cundinamarca, language_code='en', name='Cundinamarca'
+        )
+
+        for code, region, name in [
+                ('05001', antioquia, 'Medellín'),
+                ('05088', antioquia, 'Bello'),
+                ('11001', cundinamarca, 'Bogotá'),
+                ('25001', cundinamarca, 'Isabel'),
+                ('25754', cundinamarca, 'San Bernardo del Bello')]:
+            city = City.objects.create(code=code, region=region, country=colombia)
+            CityTranslation.objects.create(city=city, language_code='en', name=name)
+        ZipCode.objects.create(city=City.objects.get(code='11001'), zip_code='110111')
+
+    def search(self, *queries):
+        return list(
+            search_cities(City.objects.all(), 'en', *queries).values_list('code', flat=True)
+        )
+
+    def test_names_are_matched_without_accents_anywhere_in_them(self):
+        self.assertEqual(self.search('bogota'), ['11001'])
+        self.assertEqual(self.search('ogot'), ['11001'])
+
+    def test_prefix_matches_come_first_then_the_most_similar_names(self):
+        self.assertEqual(self.search('bel'), ['05088', '25001', '25754'])
+
+    def test_zip_codes_and_codes_are_matched(self):
+        self.assertEqual(self.search('110111'), ['11001'])
+        self.assertEqual(self.search('05001'), ['05001'])
+
+    def test_region_section(self):
+        self.assertEqual(self.search('bel', 'antioquia'), ['05088'])
+        self.assertEqual(self.search('bel', 'cun'), ['25001', '25754'])
+
+    def test_region_section_may_be_the_country(self):
+        self.assertEqual(self.search('bel', 'colombia'), ['05088', '25001', '25754'])
+        self.assertEqual(self.search('bel', 'peru'), [])
+
+    def test_region_and_country_sections(self):
+        self.assertEqual(self.search('bel', 'antioquia', 'colombia'), ['05088'])
+        self.assertEqual(self.search('bel', 'colombia', 'antioquia'), [])
+
+    def test_area_only_is_ordered_by_id(self):
+        codes = self.search('', 'cundinamarca')
+        self.assertEqual(codes, ['11001', '25001', '25754'])
+
+    def test_search_city_codes(self):
+        def codes(*args, **kwargs):
+            return list(
+                search_city_codes(City.objects.all(), 'en', *args, **kwargs).values_list(
+                    'code', flat=True
+                )
+            )
+
+        self.assertEqual(codes('110111'), ['11001'])
+        self.assertEqual(codes('110111', zip_codes=False), [])
+        self.assertEqual(codes('05001', 'cundinamarca'), [])
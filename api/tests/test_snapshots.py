@@ -0,0 +1,169 @@
+import gzip
+import json
+import math
+import shutil
+import tempfile
+import zipfile
+from array import array
+from io import StringIO
+from unittest import mock
+
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+
+from api import snapshots
+from api.changes import latest_change
+from api.models import (
+    Country, Region, City, CityTranslation, CountryTranslation, ZipCode,
+    PlaceSnapshot
+)
+from api.snapshots import build_snapshot, current_snapshot, open_snapshot
+
+
+class SnapshotTests(TransactionTestCase):
+    """The dump runs in its own REPEATABLE READ transaction"""
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.colombia = Country.objects.create(code='CO', currency_code='COP')
+        CountryTranslation.objects.create(
+            country=self.colombia, language_code='en', name='Colombia'
+        )
+        self.cundinamarca = Region.objects.create(code='CUN', country=self.colombia)
+        self.bogota = City.objects.create(
+            code='11001', region=self.cundinamarca, country=self.colombia,
+            latitude=4.711, longitude=-74.0721
+        )
+        CityTranslation.objects.create(city=self.bogota, language_code='es', name='Bogotá')
+        CityTranslation.objects.create(city=self.bogota, language_code='en', name='Bogota')
+        ZipCode.objects.create(city=self.bogota, zip_code='110111')
+        self.soacha = City.objects.create(code='25754', country=self.colombia)
+
+    def read(self, manifest, file_format):
+        with open_snapshot(manifest, file_format) as snapshot:
+            return snapshot.read()
+
+    def test_manifest(self):
+        manifest = build_snapshot()
+        self.assertEqual(manifest, current_snapshot())
+        self.assertEqual(manifest['change'], latest_change())
+        for file_format, snapshot in manifest['files'].items():
+            content = self.read(manifest, file_format)
+            self.assertEqual(snapshot['size'], len(content))
+            self.assertTrue(default_storage.exists(snapshot['name']))
+
+    def test_jsonl(self):
+        manifest = build_snapshot()
+        lines = gzip.decompress(self.read(manifest, 'jsonl')).decode('utf-8').splitlines()
+        records = [json.loads(line) for line in lines]
+        self.assertEqual(
+            [(record['type'], record['id']) for record in records],
+            [
+                ('country', self.colombia.pk), ('region', self.cundinamarca.pk),
+                ('city', self.bogota.pk), ('city', self.soacha.pk)
+            ]
+        )
+        self.assertEqual(records[2]['names'], {'en': 'Bogota', 'es': 'Bogotá'})
+        self.assertEqual(records[2]['zip_codes'], ['110111'])
+        self.assertEqual(records[3]['region_id'], None)
+
+    def test_columns(self):
+        # Chunks smaller than the tables, the columns go on across them
+        with mock.patch.object(snapshots, 'CHUNK_SIZE', 1):
+            manifest = build_snapshot()
+        with zipfile.ZipFile(open_snapshot(manifest, 'columns')) as archive:
+            schema = json.loads(archive.read('schema.json'))
+
+            def column(table, name, typecode):
+                values = array(typecode)
+                values.frombytes(archive.read('%s/%s' % (table, name)))
+                return list(values)
+
+            self.assertEqual(schema['city']['rows'], 2)
+            self.assertEqual(schema['city']['columns']['code'], 'string')
+            self.assertEqual(schema['city']['columns']['region_id'], 'int64')
+            self.assertEqual(schema['city']['columns']['latitude'], 'float64')
+            self.assertEqual(column('city', 'id.i8', 'q'), [self.bogota.pk, self.soacha.pk])
+            self.assertEqual(column('city', 'region_id.i8', 'q'), [self.cundinamarca.pk, 0])
+            latitudes = column('city', 'latitude.f8', 'd')
+            self.assertAlmostEqual(latitudes[0], 4.711)
+            self.assertTrue(math.isnan(latitudes[1]))
+
+            self.assertEqual(schema['city_name']['rows'], 2)
+            data = archive.read('city_name/name.utf8')
+            offsets = column('city_name', 'name.offsets.i8', 'q')
+            self.assertEqual(
+                [data[start:end].decode('utf-8') for start, end in zip([0] + offsets, offsets)],
+                ['Bogotá', 'Bogota']
+            )
+
+    def test_the_same_data_give_the_same_files(self):
+        first = build_snapshot()
+        second = build_snapshot()
+        self.assertEqual(first['files'], second['files'])
+        ZipCode.objects.create(city=self.bogota, zip_code='110121')
+        self.assertNotEqual(build_snapshot()['files'], first['files'])
+
+    def test_old_files_are_deleted(self):
+        first = build_snapshot()
+        names = [snapshot['name'] for snapshot in first['files'].values()]
+        ZipCode.objects.create(city=self.bogota, zip_code='110121')
+        # The previous snapshot is kept for the downloads still running
+        build_snapshot()
+        self.assertTrue(all(default_storage.exists(name) for name in names))
+
+        ZipCode.objects.create(city=self.bogota, zip_code='110131')
+        latest = build_snapshot()
+        self.assertEqual(PlaceSnapshot.objects.count(), 2)
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+        self.assertTrue(all(
+            default_storage.exists(snapshot['name']) for snapshot in latest['files'].values()
+        ))
+
+    def test_repeatable_read(self):
+        levels = []
+
+        def records(kind, *args):
+            with connection.cursor() as cursor:
+                cursor.execute('SHOW transaction_isolation')
+                levels.append(cursor.fetchone()[0])
+            return iter([])
+
+        with mock.patch.object(snapshots, 'place_records', records):
+            build_snapshot()
+        self.assertEqual(set(levels), {'repeatable read'})
+
+    def test_command(self):
+        out = StringIO()
+        call_command('places_snapshot', stdout=out)
+        self.assertIn('jsonl: snapshots/places-', out.getvalue())
+
+    def test_endpoints(self):
+        self.assertEqual(self.client.get('/snapshot/').status_code, 404)
+        self.assertEqual(self.client.get('/snapshot/jsonl/').status_code, 404)
+        manifest = build_snapshot()
+
+        response = self.client.get('/snapshot/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(
+            response.json()['files']['jsonl']['url'].endswith('/snapshot/jsonl/')
+        )
+        self.assertEqual(self.client.get(
+            '/snapshot/', HTTP_IF_NONE_MATCH=response['ETag']
+        ).status_code, 304)
+
+        response = self.client.get('/snapshot/columns/')
+        self.assertEqual(b''.join(response.streaming_content), self.read(manifest, 'columns'))
+        self.assertEqual(response['ETag'], '"%s"' % manifest['files']['columns']['sha256'])
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(self.client.get(
+            '/snapshot/columns/', HTTP_IF_NONE_MATCH=response['ETag']
+        ).status_code, 304)
+        self.assertEqual(self.client.get('/snapshot/csv/').status_code, 404)
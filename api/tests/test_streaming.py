@@ -0,0 +1,130 @@
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TransactionTestCase
+
+from api.helpers import stream_uploaded_cities, stream_uploaded_regions
+from api.models import (
+    Country, Region, City, CityDocument, CityTranslation, RegionTranslation,
+    PlaceChange, PlaceKindChoices
+)
+
+
+def uploaded(*rows):
+    content = '\n'.join(','.join(row) for row in rows) + '\n'
+    return SimpleUploadedFile('places.csv', content.encode('utf-8'))
+
+
+class StreamingImportTests(TransactionTestCase):
+    """The imports run in their own transactions, their staging tables are dropped on commit"""
+
+    def setUp(self):
+        self.colombia = Country.objects.create(code='CO', currency_code='COP')
+
+    def test_regions(self):
+        headers = ['code', 'local_code', 'country_code', 'en', 'es']
+        report = stream_uploaded_regions(uploaded(
+            headers,
+            ['ANT', '05', 'CO', 'Antioquia', 'Antioquia'],
+            ['CUN', '25', 'CO', 'Cundinamarca', 'Cundinamarca'],
+        ), 'CO')
+        self.assertEqual((report.inserted, report.updated, report.unchanged), (2, 0, 0))
+
+        report = stream_uploaded_regions(uploaded(
+            headers,
+            ['ANT', '05', 'CO', 'Antioquia', 'Antioquia'],
+            ['CUN', '25', '', 'Cundinamarca', 'Cundinamarca Departamento'],
+            ['DC', '11', 'CO', 'Bogotá', 'Bogotá'],
+        ), 'CO')
+        self.assertEqual((report.inserted, report.updated, report.unchanged), (1, 1, 1))
+
+        bogota = Region.objects.get(code='DC')
+        self.assertEqual(
+            (bogota.local_code, bogota.name, bogota.search_name), ('11', 'Bogotá', 'bogota')
+        )
+        self.assertEqual(
+            RegionTranslation.objects.get(region__code='CUN', language_code='es').search_name,
+            'cundinamarca departamento'
+        )
+
+    def test_cities(self):
+        antioquia = Region.objects.create(code='ANT', country=self.colombia)
+        cundinamarca = Region.objects.create(code='CUN', country=self.colombia)
+        headers = ['code', 'region_code', 'country_code', 'en', 'es']
+        rows_read = []
+        report = stream_uploaded_cities(uploaded(
+            headers,
+            ['05001', 'ANT', 'CO', 'Medellín', 'Medellín'],
+            ['11001', 'ANT', 'CO', 'Bogota', 'Bogotá'],
+            ['', '', '', '', ''],
+        ), 'CO', rows_read.append)
+        self.assertEqual((report.inserted, report.updated, report.unchanged), (2, 0, 0))
+        self.assertEqual(rows_read, [3])
+
+        bogota = City.objects.get(code='11001')
+        CityDocument.objects.create(city=bogota, language_code='en', body='{}')
+        PlaceChange.objects.all().delete()
+        report = stream_uploaded_cities(uploaded(
+            headers,
+            ['05001', 'ANT', 'CO', 'Medellín', 'Medellín'],
+            ['11001', 'CUN', 'CO', 'Bogotá', 'Bogotá'],
+            ['05088', 'ANT', 'CO', 'Bello', 'Bello'],
+        ), 'CO')
+        self.assertEqual((report.inserted, report.updated, report.unchanged), (1, 1, 1))
+
+        bogota.refresh_from_db()
+        self.assertEqual(bogota.region, cundinamarca)
+        self.assertEqual((bogota.name, bogota.search_name), ('Bogotá', 'bogota'))
+        self.assertEqual(
+            CityTranslation.objects.get(city=bogota, language_code='es').search_name, 'bogota'
+        )
+        self.assertEqual(City.objects.get(code='05088').region, antioquia)
+        self.assertFalse(CityDocument.objects.filter(city=bogota).exists())
+        self.assertEqual(
+            set(PlaceChange.objects.values_list('kind', 'place_id')),
+            {
+                (PlaceKindChoices.CITY, bogota.pk),
+                (PlaceKindChoices.CITY, City.objects.get(code='05088').pk),
+            }
+        )
+
+    def test_errors_roll_the_import_back(self):
+        Region.objects.create(code='ANT', country=self.colombia)
+        report = stream_uploaded_cities(uploaded(
+            ['code', 'region_code', 'country_code', 'en'],
+            ['05001', 'ANT', 'CO', 'Medellín'],
+            ['11001', 'CUN', 'CO', 'Bogotá'],
+            ['150001', 'ANT', 'PE', 'Lima'],
+        ), 'CO')
+        self.assertEqual(len(report.errors), 2)
+        self.assertFalse(City.objects.exists())
+
+        report = stream_uploaded_cities(
+            uploaded(['code', 'region_code', 'country_code', 'xx']), 'CO'
+        )
+        self.assertEqual(len(report.errors), 1)
+        report = stream_uploaded_cities(uploaded(['code', 'region_code', 'country_code']), 'PE')
+        self.assertEqual(len(report.errors), 1)
+
+    def test_values_longer_than_their_columns(self):
+        Region.objects.create(code='ANT', country=self.colombia)
+        report = stream_uploaded_cities(uploaded(
+            ['code', 'region_code', 'country_code', 'en', 'es'],
+            ['05001', 'ANT', 'CO', 'Medellín', 'Medellín'],
+            ['05001123456', 'ANT', 'CO', 'Bello', 'Bello'],
+            ['05088', 'ANT', 'CO', 'Bello', 'B' * 251],
+        ), 'CO')
+        self.assertEqual([str(error) for error in report.errors], [
+            "Line 3: the code is longer than 10 characters",
+            "Line 4: the name in es is longer than 250 characters",
+        ])
+        self.assertFalse(City.objects.exists())
+
+        report = stream_uploaded_regions(uploaded(
+            ['code', 'local_code', 'country_code', 'en'],
+            ['ANTI', '05', 'CO', 'Antioquia'],
+            ['CUN', '2' * 21, 'CO', 'Cundinamarca'],
+        ), 'CO')
+        self.assertEqual([str(error) for error in report.errors], [
+            "Line 2: the code is longer than 3 characters",
+            "Line 3: the local code is longer than 20 characters",
+        ])
+        self.assertEqual(Region.objects.count(), 1)
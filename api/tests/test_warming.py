@@ -0,0 +1,102 @@
+from io import StringIO
+from unittest import mock, skipIf
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TransactionTestCase, override_settings
+
+from api import caching
+from api.caching import popular_cities_queries, record_cities_query
+from api.models import Country, Region, City, CityTranslation
+from api.planner import CitiesPlan
+from api.warming import warm_after_upload, warm_cities_cache
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+
+@skipIf(fakeredis is None, 'The request log needs a Redis server, or fakeredis')
+class CitiesWarmingTests(TransactionTestCase):
+    """The pool's threads open their own connections, the data must be committed"""
+
+    def clear_caches(self):
+        cache.clear()
+        caching.local_cities.clear()
+
+    def setUp(self):
+        # Drop the queries other tests counted but didn't write
+        caching._flush_pending()
+        self.clear_caches()
+        self.redis = fakeredis.FakeRedis()
+        patcher = mock.patch('api.caching.get_redis_connection', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        cundinamarca = Region.objects.create(code='CUN', country=colombia)
+        for code, name in [('11001', 'Bogotá'), ('25754', 'Soacha'), ('25175', 'Chía')]:
+            city = City.objects.create(code=code, region=cundinamarca, country=colombia)
+            CityTranslation.objects.create(city=city, language_code='en', name=name)
+
+    def request(self, q, times=1):
+        for _time in range(times):
+            self.client.get('/cities/en/', {'q': q})
+
+    def test_popular_queries(self):
+        self.request('Bogotá', 3)
+        self.request('soacha', 2)
+        self.request('chia')
+        self.client.get('/cities/en/', {'q': 'chia', 'cursor': 'not counted'})
+        self.assertEqual(popular_cities_queries('en', 2), [
+            CitiesPlan.from_params('en', {'q': 'bogota'}).log_entry,
+            CitiesPlan.from_params('en', {'q': 'soacha'}).log_entry,
+        ])
+        self.assertEqual(len(popular_cities_queries('en', 10)), 3)
+        self.assertEqual(popular_cities_queries('es', 10), [])
+
+    def test_the_log_is_trimmed_on_every_flush(self):
+        with mock.patch.object(caching, 'POPULAR_MAX_QUERIES', 3):
+            for number in range(3):
+                record_cities_query('en', 'query %d' % number)
+                record_cities_query('en', 'query %d' % number)
+            caching._flush_pending()
+            for number in range(3, 8):
+                record_cities_query('en', 'query %d' % number)
+            caching._flush_pending()
+        key = cache.make_key(caching.POPULAR_KEY % 'en')
+        self.assertEqual(self.redis.zcard(key), 3)
+        self.assertEqual(
+            popular_cities_queries('en', 10), ['query 2', 'query 1', 'query 0']
+        )
+
+    def test_warm_up(self):
+        self.request('bogota', 2)
+        self.request('soacha')
+        self.clear_caches()
+        # Queries of the log that can't be planned anymore are skipped
+        record_cities_query('en', '["xx"]')
+        # Cached again by a request
+        self.request('bogota')
+
+        report = warm_cities_cache(['en'], workers=2)
+        self.assertEqual(
+            (report.queries, report.warmed, report.cached, report.failed), (2, 1, 1, 0)
+        )
+        for q in ('bogota', 'soacha'):
+            self.assertIsNotNone(cache.get(CitiesPlan.from_params('en', {'q': q}).cache_key))
+
+        report = warm_cities_cache(['en'], top=1)
+        self.assertEqual((report.queries, report.warmed, report.cached), (1, 0, 1))
+
+        out = StringIO()
+        call_command('warm_cities_cache', '--language', 'en', stdout=out)
+        self.assertIn('Already cached: 2', out.getvalue())
+
+    def test_warm_after_upload(self):
+        self.request('bogota')
+        with override_settings(PLACES_WARM_AFTER_UPLOAD=False):
+            self.assertIsNone(warm_after_upload())
+        with override_settings(PLACES_WARM_AFTER_UPLOAD=True):
+            self.assertEqual(warm_after_upload().queries, 1)
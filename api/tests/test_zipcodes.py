@@ -0,0 +1,130 @@
+import json
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from api import caching
+from api.models import (
+    Country, Region, City, CountryTranslation, RegionTranslation,
+    CityTranslation, ZipCode
+)
+from api.zipcodes import get_zip_code_documents, zip_codes_page
+
+
+class ZipCodesTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        CountryTranslation.objects.create(country=colombia, language_code='en', name='Colombia')
+        cundinamarca = Region.objects.create(code='CUN', country=colombia)
+        RegionTranslation.objects.create(
+            region=cundinamarca, language_code='es', name='Cundinamarca'
+        )
+        bogota = City.objects.create(code='11001', region=cundinamarca, country=colombia)
+        CityTranslation.objects.create(city=bogota, language_code='en', name='Bogota')
+        CityTranslation.objects.create(city=bogota, language_code='es', name='Bogotá')
+        for zip_code in ['110111', '110121', '110911', '111011', '050001', '011011']:
+            ZipCode.objects.create(city=bogota, zip_code=zip_code)
+
+    def setUp(self):
+        # Documents are cached by zip code and language
+        cache.clear()
+
+    def all_pages(self, limit, *args):
+        zip_codes, position = [], None
+        while True:
+            page, position = zip_codes_page(limit, *args, position=position)
+            zip_codes.extend(page)
+            if position is None:
+                return zip_codes
+
+    def test_prefix(self):
+        self.assertEqual(zip_codes_page(10, '1101'), (['110111', '110121'], None))
+        self.assertEqual(zip_codes_page(10, '2'), ([], None))
+
+    def test_range(self):
+        self.assertEqual(zip_codes_page(10, '', 110111, 110911)[0], ['110111', '110121', '110911'])
+        self.assertEqual(zip_codes_page(10, '11', None, 110120)[0], ['110111'])
+        self.assertEqual(zip_codes_page(10, '0', 20000)[0], ['050001'])
+        self.assertEqual(zip_codes_page(10, '', 110912)[0], ['111011'])
+
+    def test_pages(self):
+        everything = ['011011', '050001', '110111', '110121', '110911', '111011']
+        self.assertEqual(zip_codes_page(2, '', 0)[1], {'n': 50001, 'z': '050001'})
+        for limit in range(1, 8):
+            self.assertEqual(self.all_pages(limit, '', 0), everything)
+
+    def test_documents(self):
+        documents = get_zip_code_documents(['110111', '999999'], 'es')
+        self.assertEqual(list(documents), ['110111'])
+        self.assertEqual(json.loads(documents['110111']), {
+            'zip_code': '110111',
+            'city': {
+                'id': City.objects.get().pk,
+                'code': '11001',
+                'name': 'Bogotá',
+                'region': {'code': 'CUN', 'name': 'Cundinamarca'},
+                'country': {'code': 'CO', 'name': None, 'currency_code': 'COP'},
+            },
+        })
+        english = json.loads(get_zip_code_documents(['110111'], 'en')['110111'])
+        self.assertEqual(english['city']['name'], 'Bogota')
+        self.assertEqual(english['city']['region']['name'], None)
+        self.assertEqual(english['city']['country']['name'], 'Colombia')
+
+    def test_endpoints(self):
+        response = self.client.get('/zip/', {'prefix': '11', 'limit': 2})
+        self.assertEqual([document['zip_code'] for document in response.json()], [
+            '110111', '110121'
+        ])
+        self.assertIn('rel="next"', response['Link'])
+        self.assertEqual(self.client.get('/zip/', {'prefix': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get('/zip/').status_code, 400)
+
+        response = self.client.post(
+            '/zip/', {'zip_codes': ['110111', '999999'], 'language': 'es'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.json()['999999'], None)
+        self.assertEqual(response.json()['110111']['city']['name'], 'Bogotá')
+
+
+class ZipCodeLookupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        colombia = Country.objects.create(code='CO', currency_code='COP')
+        cls.bogota = City.objects.create(code='11001', country=colombia)
+        CityTranslation.objects.create(city=cls.bogota, language_code='es', name='Bogotá')
+        ZipCode.objects.create(city=cls.bogota, zip_code='110111')
+
+    def setUp(self):
+        cache.clear()
+        # The version starts over in the cleared cache, read it again
+        caching._dataset_state['state'] = None
+
+    def test_lookup(self):
+        response = self.client.get('/zip/110111/', {'language': 'es'})
+        self.assertEqual(response.json()['city']['name'], 'Bogotá')
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age=', response['Cache-Control'])
+        self.assertEqual(self.client.get('/zip/110111/').json()['city']['name'], None)
+
+        self.assertEqual(self.client.get('/zip/999999/').status_code, 404)
+        self.assertEqual(
+            self.client.get('/zip/110111/', {'language': 'xx'}).status_code, 400
+        )
+
+    def test_documents_and_misses_are_cached(self):
+        get_zip_code_documents(['110111', '999999'], 'es')
+        with self.assertNumQueries(0):
+            documents = get_zip_code_documents(['110111', '999999'], 'es')
+        self.assertEqual(list(documents), ['110111'])
+
+        # Until the data change, the version is bumped once they're committed
+        ZipCode.objects.create(city=self.bogota, zip_code='999999')
+        caching._bump_dataset_version()
+        self.assertEqual(
+            sorted(get_zip_code_documents(['110111', '999999'], 'es')), ['110111', '999999']
+        )
@@ -4,6 +4,22 @@ from . import views
 urlpatterns = [
     # Api urls
     path('cities/<str:language>/', views.api_cities_list, name='cities-list'),
+    path('cities/<str:language>/batch/', views.api_cities_batch, name='cities-batch'),
+    path('cities/<str:language>/nearest/', views.api_nearest_cities, name='cities-nearest'),
+    path('cities/<str:language>/within/', views.api_cities_within, name='cities-within'),
+    path('browse/<str:language>/', views.api_browse_countries, name='browse-countries'),
+    path('browse/<str:language>/<str:country>/', views.api_browse_regions, name='browse-regions'),
+    path(
+        'browse/<str:language>/<str:country>/<str:region>/',
+        views.api_browse_cities,
+        name='browse-cities'
+    ),
+    path('reverse/', views.api_reverse_geocode, name='reverse-geocode'),
+    path('zip/', views.api_zip_codes, name='zip-codes'),
+    path('zip/<str:zip_code>/', views.api_zip_code, name='zip-code'),
+    path('snapshot/', views.api_snapshot, name='snapshot'),
+    path('snapshot/<str:file_format>/', views.api_snapshot_file, name='snapshot-file'),
+    path('changes/', views.api_changes, name='changes'),
 
     # Upload
     path('upload-countries/', views.upload_country, name='upload-countries'),
@@ -12,4 +28,5 @@ urlpatterns = [
     path('download-regions/<int:empty>/', views.download_regions, name='download-regions'),
     path('upload-cities/', views.upload_cities, name='upload-cities'),
     path('download-cities/<int:empty>/', views.download_cities, name='download-cities'),
+    path('upload-jobs/<int:pk>/', views.upload_job_status, name='upload-job'),
 ]
@@ -1,32 +1,71 @@
-import django_excel
+import json
+import time
 
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from django.db.models import Prefetch, Q
 from django.shortcuts import render
-from django.http import HttpResponseRedirect, HttpResponse
 from django.urls import reverse
-from django.views.decorators.cache import cache_page
 from django.conf import settings
-from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
 
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
 
+from api import geocoding
+from api.browse import get_listing
+from api.caching import (
+    get_cached_cities, get_many_cached_cities, set_many_cached_cities,
+    record_cities_query
+)
+from api.changes import ChangesExpired, changes_since, parse_position
+from api.compression import encode_response
+from api.conditional import changes_condition, dataset_condition, dataset_etag
+from api.documents import get_city_documents_by_id, join_documents
+from api.exports import (
+    export_languages, countries_rows, regions_rows, cities_rows,
+    streaming_export_response
+)
 from api.models import *
-from api.serializers import CitySerializer
+from api.serializers import UploadJobSerializer
 from api.forms import UploadFile
-from api.helpers import (
-    handle_uploaded_countries, handle_uploaded_regions, handle_uploaded_cities
-)
-
-
-CACHE_TTL = getattr(settings, 'CACHE_TTL', DEFAULT_TIMEOUT)
-
-
-@cache_page(CACHE_TTL)
+from api.normalization import split_search_query
+from api.pagination import decode_cursor, encode_cursor, next_page_link
+from api.planner import CitiesPlan, PlanError, is_flat, parse_limit
+from api.renderers import dumps
+from api.search import nearest_cities, cities_within
+from api.snapshots import SNAPSHOT_FORMATS, current_snapshot, open_snapshot
+from api.jobs import enqueue_upload
+from api.zipcodes import get_zip_code_documents, zip_codes_page
+
+
+# Most queries and zip codes resolved by a single batch request
+BATCH_MAX_ITEMS = 500
+
+ZIP_MAX_AGE = getattr(settings, 'PLACES_ZIP_MAX_AGE', 60 * 60)
+# Most zip codes listed in a single page of the prefix/range queries
+ZIP_PAGE_MAX_SIZE = 1000
+# Largest radius (km) of the cities within a radius queries
+MAX_RADIUS = 500
+# Clients and CDNs may keep the current snapshot for PLACES_SNAPSHOT_MAX_AGE
+# seconds, then revalidate it through its ETag
+SNAPSHOT_MAX_AGE = getattr(settings, 'PLACES_SNAPSHOT_MAX_AGE', 60 * 60)
+
+
+def _cities_response(request, body, next_cursor=None, encoded=None):
+    response = HttpResponse(body, content_type='application/json')
+    if next_cursor:
+        response['Link'] = next_page_link(request, next_cursor)
+    if encoded:
+        # Set before encoding, so it's weakened along with the content
+        response['ETag'] = dataset_etag(request)
+        encode_response(request, response, encoded)
+    return response
+
+
+@dataset_condition
 @api_view(['GET'])
 def api_cities_list(request, language):
     """
@@ -34,129 +73,568 @@ def api_cities_list(request, language):
     information, like region and country it belongs to, with their respective
     translations, the zip_codes if there is any, currency code and flag of
     the country.
+
+    Results come in pages of 'limit' cities, when there are more of them
+    the response has a 'Link' header with the url of the next page, which
+    carries an opaque 'cursor' parameter. A query with no city section,
+    e.g. ', , Colombia', pages through all the cities of a country.
+
+    With 'mode=flat' places have just a 'name' (and an 'extra_name' in
+    'extra_lang') instead of their translations lists.
     """
-    if request.method == 'GET':
+    started = time.monotonic()
+    try:
+        plan = CitiesPlan.from_params(language, request.GET)
+    except PlanError as error:
+        return Response(
+            {'error': str(error)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if plan is None:
+        return Response([])
 
-        q = request.GET.get('q', None)
-        # We ensure 2 characters at least for a searching query
-        if q and len(q) <= 2:
-            q = None
-        extra_lang = request.GET.get('extra_lang', language)
+    if not plan.cursor:
+        # First pages are the ones warmed up, see api.warming
+        record_cities_query(plan.language, plan.log_entry)
 
-        # Limiting the list so we don't overload the database
-        limit = request.GET.get('limit', 20)
-        if limit > 50:
-            limit = 50
+    page = get_cached_cities(plan.cache_key)
+    if page is not None:
+        plan.log(started, cached=True)
+        return _cities_response(request, *page)
 
-        if language not in LanguageChoices.values:
-            return Response(
-                {
-                    'error': _('We currently do not support the \'%s\''
-                               ' language, or that is not a'
-                               ' valid code') % language
-                },
-                status=status.HTTP_400_BAD_REQUEST
+    # Cities are already rendered, we only have to put them together
+    page, cities = plan.render()
+    plan.log(started, cached=False, cities=cities)
+    return _cities_response(request, *page)
+
+
+@api_view(['POST'])
+def api_cities_batch(request, language):
+    """
+    Resolves many city queries, and/or zip codes, in a single request. The
+    body is a JSON object like:
+
+        {
+            "queries": ["Bogota", "Medellin, Antioquia"],
+            "zip_codes": ["110111"],
+            "extra_lang": "es",
+            "limit": 1
+        }
+
+    and the response has the cities found for every input, keyed by it:
+
+        {
+            "queries": {"Bogota": [...], "Medellin, Antioquia": [...]},
+            "zip_codes": {"110111": {...}}
+        }
+
+    where unknown zip codes map to null. Queries are deduplicated once
+    normalized, the ones already cached are taken from the cache and the
+    cities of all the others are rendered at once. Only the best match is
+    returned per query unless a 'limit' is given.
+    """
+    if language not in LanguageChoices.values:
+        return Response(
+            {
+                'error': _('We currently do not support the \'%s\''
+                           ' language, or that is not a'
+                           ' valid code') % language
+            },
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    queries = request.data.get('queries', [])
+    zip_codes = request.data.get('zip_codes', [])
+    if not (isinstance(queries, list) and isinstance(zip_codes, list)
+            and all(isinstance(value, str) for value in queries + zip_codes)):
+        return Response(
+            {'error': _('The queries and zip codes must be lists of strings')},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(queries) + len(zip_codes) > BATCH_MAX_ITEMS:
+        return Response(
+            {'error': _('At most %s queries and zip codes can be resolved'
+                        ' at once') % BATCH_MAX_ITEMS},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    extra_lang = request.data.get('extra_lang')
+    if extra_lang == language or extra_lang not in LanguageChoices.values:
+        extra_lang = None
+
+    limit = parse_limit(request.data.get('limit'), default=1)
+    flat = is_flat(request.data)
+
+    queries = list(dict.fromkeys(queries))
+    zip_codes = list(dict.fromkeys(zip_codes))
+
+    # Inputs sharing the same plan (normalized sections) are resolved once
+    plans, plan_keys = {}, {}
+    for q in queries:
+        if len(q) > 2:
+            plan = CitiesPlan(
+                language, extra_lang, split_search_query(q), limit, flat=flat
             )
+            plans.setdefault(plan.cache_key, plan)
+            plan_keys[q] = plan.cache_key
+    cached = get_many_cached_cities(list(plans))
+    bodies = {key: page[0] for key, page in cached.items()}
+
+    found = {
+        key: plan.execute() for key, plan in plans.items() if key not in bodies
+    }
+    zip_cities = dict(
+        ZipCode.objects.filter(
+            zip_code__in={zip_code.strip() for zip_code in zip_codes}
+        ).values_list('zip_code', 'city_id')
+    )
 
-        if extra_lang or extra_lang == language or extra_lang not in LanguageChoices.values:
-            extra_lang = None
-
-        # Query sets to prefetch the data, we don't have to apply distinct in
-        # here because we already checked whether extra_lang was different
-        # than language or not
-        cities_translations_queryset = CityTranslation.objects.filter(language_code=language)
-        regions_translations_queryset = RegionTranslation.objects.filter(language_code=language)
-        countries_translations_queryset = CountryTranslation.objects.filter(language_code=language)
-        if extra_lang:
-            cities_translations_queryset = CityTranslation.objects.filter(
-                Q(language_code=language) | Q(language_code=extra_lang)
+    city_ids = set(zip_cities.values())
+    for ids, _next_position in found.values():
+        city_ids.update(ids)
+    documents = get_city_documents_by_id(city_ids, language, extra_lang, flat)
+
+    pages = {}
+    for key, (ids, next_position) in found.items():
+        bodies[key] = join_documents(
+            [documents[city_id] for city_id in ids if city_id in documents]
+        )
+        pages[key] = (
+            bodies[key],
+            encode_cursor(next_position) if next_position else None
+        )
+    set_many_cached_cities(pages)
+
+    body = '{"queries":{%s},"zip_codes":{%s}}' % (
+        ','.join(
+            '%s:%s' % (json.dumps(q), bodies[plan_keys[q]] if q in plan_keys else '[]')
+            for q in queries
+        ),
+        ','.join(
+            '%s:%s' % (
+                json.dumps(zip_code),
+                documents.get(zip_cities.get(zip_code.strip()), 'null')
             )
-            regions_translations_queryset = RegionTranslation.objects.filter(
-                Q(language_code=language) | Q(language_code=extra_lang)
+            for zip_code in zip_codes
+        )
+    )
+    return HttpResponse(body, content_type='application/json')
+
+
+def _point(request):
+    """Parses the 'lat' and 'lon' query parameters, returns None if they're not valid"""
+    try:
+        latitude = float(request.GET.get('lat', ''))
+        longitude = float(request.GET.get('lon', ''))
+    except ValueError:
+        return None
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    return latitude, longitude
+
+
+def _located_cities(request, language, finder):
+    """
+    Shared body of the nearby cities views, 'finder' gets the point and the
+    limit and returns the (distance, city id) pairs to render
+    """
+    if language not in LanguageChoices.values:
+        return Response(
+            {
+                'error': _('We currently do not support the \'%s\''
+                           ' language, or that is not a'
+                           ' valid code') % language
+            },
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    point = _point(request)
+    if point is None:
+        return Response(
+            {'error': _('A valid latitude (lat) and longitude (lon) are required')},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    extra_lang = request.GET.get('extra_lang')
+    if extra_lang == language or extra_lang not in LanguageChoices.values:
+        extra_lang = None
+
+    limit = parse_limit(request.GET.get('limit'))
+
+    distances = finder(point, limit)
+    documents = get_city_documents_by_id(
+        [city_id for _distance, city_id in distances],
+        language,
+        extra_lang,
+        is_flat(request.GET)
+    )
+    body = '[%s]' % ','.join(
+        '{"distance":%s,"city":%s}' % (round(distance, 3), documents[city_id])
+        for distance, city_id in distances if city_id in documents
+    )
+    return HttpResponse(body, content_type='application/json')
+
+
+@dataset_condition
+@api_view(['GET'])
+def api_nearest_cities(request, language):
+    """
+    Lists the 'limit' cities nearest to the point given by the 'lat' and
+    'lon' query parameters, with their distance to it in kilometers, up to
+    PLACES_NEAREST_MAX_DISTANCE kilometers away
+    """
+    return _located_cities(
+        request,
+        language,
+        lambda point, limit: nearest_cities(City.objects.all(), *point, limit)
+    )
+
+
+@dataset_condition
+@api_view(['GET'])
+def api_cities_within(request, language):
+    """
+    Lists the cities within 'radius' kilometers (10 by default) of the point
+    given by the 'lat' and 'lon' query parameters, nearest first, with their
+    distance to it
+    """
+    try:
+        radius = float(request.GET.get('radius', 10))
+    except ValueError:
+        radius = -1
+    if not 0 < radius <= MAX_RADIUS:
+        return Response(
+            {'error': _('The radius must be a number of kilometers between 0'
+                        ' and %s') % MAX_RADIUS},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return _located_cities(
+        request,
+        language,
+        lambda point, limit: cities_within(
+            City.objects.all(), *point, radius, limit
+        )
+    )
+
+
+@dataset_condition
+@api_view(['GET'])
+def api_reverse_geocode(request):
+    """
+    Maps the point given by the 'lat' and 'lon' query parameters to its
+    city, region and country, named in 'language' (English by default).
+    Places containing the point come first, otherwise it's the nearest city,
+    with its distance to the point in kilometers, and its region and country
+    """
+    language = request.GET.get('language', 'en')
+    if language not in LanguageChoices.values:
+        return Response(
+            {'error': _('We currently do not support that language')},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    point = _point(request)
+    if point is None:
+        return Response(
+            {'error': _('A valid latitude (lat) and longitude (lon) are required')},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return Response(geocoding.engine.reverse(*point, language))
+
+
+def _zip_code_language(data):
+    language = data.get('language', 'en')
+    return language if language in LanguageChoices.values else None
+
+
+@dataset_condition
+@api_view(['GET'])
+def api_zip_code(request, zip_code):
+    """
+    Looks up a zip code, returns a compact document with the city it belongs
+    to, along with its region and country, named in the 'language' given as
+    a query parameter (English by default)
+    """
+    language = _zip_code_language(request.GET)
+    if language is None:
+        return Response(
+            {'error': _('We currently do not support that language')},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    zip_code = zip_code.strip()
+    document = get_zip_code_documents([zip_code], language).get(zip_code)
+    if document is None:
+        return Response(
+            {'error': _('The zip code %s does not exist') % zip_code},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    response = HttpResponse(document, content_type='application/json')
+    patch_cache_control(response, public=True, max_age=ZIP_MAX_AGE)
+    return response
+
+
+@dataset_condition
+@api_view(['GET', 'POST'])
+def api_zip_codes(request):
+    """
+    GET lists the zip codes starting with a 'prefix', and/or whose numeric
+    value is in the range given by 'from' and 'to' (both included), e.g.
+    /zip/?prefix=110 or /zip/?from=110111&to=110999. Results are ordered by
+    value and come in pages of 'limit' zip codes (100 by default), with a
+    'Link' header pointing to the next page, if any.
+
+    POST looks up many zip codes at once, the body is a JSON object like
+    {"zip_codes": ["110111", "050001"], "language": "es"}, and the response
+    maps every zip code to its document (see api_zip_code), or to null when
+    it doesn't exist.
+
+    Both take a 'language' for the names (English by default)
+    """
+    data = request.GET if request.method == 'GET' else request.data
+    language = _zip_code_language(data)
+    if language is None:
+        return Response(
+            {'error': _('We currently do not support that language')},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    if request.method == 'GET':
+        prefix = request.GET.get('prefix', '').strip()
+        start = request.GET.get('from', '').strip()
+        end = request.GET.get('to', '').strip()
+        if not (prefix or start or end) or not all(
+                value.isdigit() for value in (prefix, start, end) if value):
+            return Response(
+                {'error': _('A numeric prefix, or a from/to range, is required')},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            countries_translations_queryset = CountryTranslation.objects.filter(
-                Q(language_code=language) | Q(language_code=extra_lang)
+
+        try:
+            limit = max(min(int(request.GET.get('limit', 100)), ZIP_PAGE_MAX_SIZE), 1)
+        except ValueError:
+            limit = 100
+
+        cursor = request.GET.get('cursor', '')
+        try:
+            position = decode_cursor(cursor) if cursor else None
+            if position is not None and 'z' not in position:
+                raise ValueError('Not a zip codes cursor')
+        except ValueError:
+            return Response(
+                {'error': _('The cursor is not valid')},
+                status=status.HTTP_400_BAD_REQUEST
             )
 
-        prefetch = [
-            Prefetch(
-                'city_translations',
-                queryset=cities_translations_queryset
-            ),
-            Prefetch(
-                'country__country_translations',
-                queryset=countries_translations_queryset
-            ),
-            Prefetch(
-                'region__region_translations',
-                queryset=regions_translations_queryset
-            ),
-            Prefetch(
-               'zip_codes',
+        zip_codes, next_position = zip_codes_page(
+            limit,
+            prefix,
+            int(start) if start else None,
+            int(end) if end else None,
+            position
+        )
+        documents = get_zip_code_documents(zip_codes, language)
+        body = '[%s]' % ','.join(
+            documents[zip_code] for zip_code in zip_codes if zip_code in documents
+        )
+        return _cities_response(
+            request, body, encode_cursor(next_position) if next_position else None
+        )
+
+    zip_codes = request.data.get('zip_codes', [])
+    if not (isinstance(zip_codes, list)
+            and all(isinstance(value, str) for value in zip_codes)):
+        return Response(
+            {'error': _('The zip codes must be a list of strings')},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(zip_codes) > BATCH_MAX_ITEMS:
+        return Response(
+            {'error': _('At most %s zip codes can be looked up at once')
+             % BATCH_MAX_ITEMS},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    zip_codes = list(dict.fromkeys(zip_code.strip() for zip_code in zip_codes))
+    documents = get_zip_code_documents(zip_codes, language)
+    body = '{%s}' % ','.join(
+        '%s:%s' % (json.dumps(zip_code), documents.get(zip_code, 'null'))
+        for zip_code in zip_codes
+    )
+    return HttpResponse(body, content_type='application/json')
+
+
+def _browse_response(request, language, *codes):
+    """Shared body of the browse views, see api.browse.get_listing"""
+    if language not in LanguageChoices.values:
+        return Response(
+            {
+                'error': _('We currently do not support the \'%s\''
+                           ' language, or that is not a'
+                           ' valid code') % language
+            },
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    listing = get_listing(language, *codes)
+    if listing is None:
+        return Response(
+            {'error': _('The place with code %s does not exist') % '/'.join(codes)},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    body, encoded = listing
+    return _cities_response(request, body, encoded=encoded)
+
+
+@dataset_condition
+@api_view(['GET'])
+def api_browse_countries(request, language):
+    """
+    Lists all the countries, sorted by their name in 'language', with the
+    number of regions and cities they have, e.g. for the first of a set of
+    cascading dropdowns
+    """
+    return _browse_response(request, language)
+
+
+@dataset_condition
+@api_view(['GET'])
+def api_browse_regions(request, language, country):
+    """
+    Lists the regions of a country, given by its code, sorted by their name
+    in 'language', with the number of cities they have
+    """
+    return _browse_response(request, language, country)
+
+
+@dataset_condition
+@api_view(['GET'])
+def api_browse_cities(request, language, country, region):
+    """
+    Lists the cities of a region, given by its country's code and its own,
+    sorted by their name in 'language', with their ids and the number of
+    zip codes they have
+    """
+    return _browse_response(request, language, country, region)
+
+
+def _snapshot_or_404():
+    manifest = current_snapshot()
+    if manifest is None:
+        return None, Response(
+            {'error': _('There is no snapshot of the dataset yet')},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    return manifest, None
+
+
+@api_view(['GET'])
+def api_snapshot(request):
+    """
+    Describes the current snapshot of the whole dataset: its dataset
+    version, when it was built, and its files (name, SHA-256 and size) with
+    the URL to download each one of them
+    """
+    manifest, error = _snapshot_or_404()
+    if error:
+        return error
+
+    etag = '"%s"' % '-'.join(
+        snapshot['sha256'][:16] for _format, snapshot in sorted(manifest['files'].items())
+    )
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        for file_format, snapshot in manifest['files'].items():
+            snapshot['url'] = request.build_absolute_uri(
+                reverse('snapshot-file', args=[file_format])
             )
-        ]
-
-        if q:
-            # We can get a sequence of queries separated by semi-colons
-            # with this order: City, Region (or Country), Country
-            # if only one section is passed, that will always be the city,
-            # the second section could be either the region or the country, and,
-            # if a third section is passed, that will always be the country
-            region_query = None
-            country_query = None
-            queries = list(map(lambda x: x.strip(), q.split(',', 2)))
-            # Should always exists if 'q' is passed
-            city_query = queries[0]
-            if len(queries) >= 2:
-                region_query = queries[1]
-            if len(queries) >= 3:
-                country_query = queries[2]
-
-            city_list = City.objects.prefetch_related(*prefetch).all()
-            if city_query:
-                city_list = city_list.filter(
-                    # Q(city_translations__name__unaccent__istartswith=city_query)
-                    Q(city_translations__name__icontains=city_query)
-                    & Q(city_translations__language_code=language)
-                    | Q(zip_codes__zip_code=city_query)
-                    | Q(code=city_query)
-                )
-            if region_query and not country_query:
-                city_list = city_list.filter(
-                    # Q(region__region_translations__name__unaccent__istartswith=region_query)
-                    Q(region__region_translations__name__icontains=region_query)
-                    & Q(region__region_translations__language_code=language)
-                    | Q(region__code__iexact=region_query)
-                    # | Q(country__country_translations__name__unaccent__istartswith=region_query)
-                    | Q(country__country_translations__name__icontains=region_query)
-                    & Q(country__country_translations__language_code=language)
-                    | Q(country__code__iexact=region_query)
-                )
-            else:
-                if region_query and country_query:
-                    city_list = city_list.filter(
-                        # Q(region__region_translations__name__unaccent__istartswith=region_query)
-                        Q(region__region_translations__name__icontains=region_query)
-                        & Q(region__region_translations__language_code=language)
-                        | Q(region__code__iexact=region_query),
-                        # Q(country__country_translations__name__unaccent__istartswith=country_query)
-                        Q(country__country_translations__name__icontains=country_query)
-                        & Q(country__country_translations__language_code=language)
-                        | Q(country__code__iexact=country_query)
-                    )
-                if country_query and not region_query:
-                    city_list = city_list.filter(
-                        # Q(country__country_translations__name__unaccent__istartswith=country_query)
-                        Q(country__country_translations__name__icontains=country_query)
-                        & Q(country__country_translations__language_code=language)
-                        | Q(country__code__iexact=country_query)
-                    )
-
-            city_list = city_list.distinct()[:limit]
-            serializer = CitySerializer(city_list, many=True)
-            return Response(serializer.data)
-        else:
-            return Response([])
+        response = HttpResponse(json.dumps(manifest), content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=SNAPSHOT_MAX_AGE)
+    return response
+
+
+@api_view(['GET'])
+def api_snapshot_file(request, file_format):
+    """
+    Downloads a file of the current snapshot, 'jsonl' (gzipped JSON lines,
+    a record per place) or 'columns' (zip archive, a member per column).
+    The ETag is the SHA-256 of the file, so clients revalidating it only get
+    it again when a new snapshot was built out of different data
+    """
+    if file_format not in SNAPSHOT_FORMATS:
+        return Response(
+            {'error': _('The snapshot formats are %s') % ', '.join(SNAPSHOT_FORMATS)},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    manifest, error = _snapshot_or_404()
+    if error:
+        return error
+
+    snapshot = manifest['files'][file_format]
+    etag = '"%s"' % snapshot['sha256']
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = FileResponse(
+            open_snapshot(manifest, file_format),
+            as_attachment=True,
+            filename=snapshot['name'].rsplit('/', 1)[-1],
+            content_type=SNAPSHOT_FORMATS[file_format][1]
+        )
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=SNAPSHOT_MAX_AGE)
+    return response
+
+
+@changes_condition
+@api_view(['GET'])
+def api_changes(request):
+    """
+    Feed of the changes of the places data after a position, e.g.
+    /changes/?since=812-1234, with the current record of every place that
+    changed (see api_snapshot_file), or a 'deleted' record. Start from the
+    'change' of a snapshot, then follow 'version' while 'more' is true.
+    Changes are only kept for a while, a position too old gets 410 Gone,
+    start over from a new snapshot then
+    """
+    since = request.GET.get('since', '')
+    try:
+        parse_position(since)
+    except ValueError:
+        return Response(
+            {'error': _('\'since\' must be the version of the last change you got')},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        changes = changes_since(since)
+    except ChangesExpired:
+        return Response(
+            {'error': _('These changes are not kept anymore, start over from the snapshot')},
+            status=status.HTTP_410_GONE
+        )
+    return HttpResponse(dumps(changes), content_type='application/json')
+
+
+@login_required
+@api_view(['GET'])
+def upload_job_status(request, pk):
+    """
+    Reports the status of an upload job, its progress, the rows inserted,
+    updated and unchanged, the errors found and the rows imported per second
+    """
+    try:
+        job = UploadJob.objects.get(pk=pk)
+    except UploadJob.DoesNotExist:
+        return Response(
+            {'error': _('The upload job %s does not exist') % pk},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    return Response(UploadJobSerializer(job).data)
+
+
+def _export_format(request):
+    """Downloads are xlsx files unless a csv one is requested"""
+    return 'csv' if request.GET.get('format') == 'csv' else 'xlsx'
 
 
 @login_required
@@ -168,16 +646,11 @@ def upload_country(request):
     if request.method == 'POST':
         file = UploadFile(request.POST, request.FILES)
         if file.is_valid():
-            errors = handle_uploaded_countries(request.FILES['file'])
-            if errors:
-                return render(request, 'UploadCountries.html', {
-                    "file": file,
-                    "errors": errors
-                })
-            else:
-                return HttpResponseRedirect(
-                    reverse('cities-list', kwargs={'language': 'en'})
-                )
+            job = enqueue_upload(UploadKindChoices.COUNTRIES, request.FILES['file'])
+            return render(request, 'UploadCountries.html', {
+                "file": UploadFile(),
+                "job": job
+            })
     else:
         file = UploadFile()
 
@@ -187,58 +660,42 @@ def upload_country(request):
 
 
 @login_required
+@dataset_condition
 def download_countries(request, empty):
     """
     Downloads the file for uploading later the countries' information. It could
     be a filled file, with all the information already in the database, or an
     and empty file, only with the required file schema
     """
-    countries = Country.objects.prefetch_related(
-        'country_translations'
-    ).all()
-    headers = ['code', 'currency_code']
-
-    language_choices = LanguageChoices.values
-    language_choices.sort()
-    for language_code in language_choices:
-        headers.append(language_code)
-
-    countries_list = [headers]
-    if not empty:
-        for country in countries:
-            country_row = [country.code, country.currency_code]
-            for translation in country.country_translations.all().order_by('language_code'):
-                country_row.append(translation.name)
-            countries_list.append(country_row)
-    return django_excel.make_response_from_array(
-        countries_list,
-        'xls',
-        file_name="Countries - %(date)s" % {
-            "date": timezone.now().strftime("%d-%M-%Y")
-        }
+    languages = export_languages()
+    headers = ['code', 'currency_code'] + languages
+    rows = [] if empty else countries_rows(languages)
+
+    file_name = "Countries - %(date)s" % {
+        "date": timezone.now().strftime("%d-%m-%Y")
+    }
+    return streaming_export_response(
+        headers, rows, _export_format(request), file_name
     )
 
 
 @login_required
 def upload_regions(request):
 
-    all_countries = CountryTranslation.objects.filter(language_code='en')
+    all_countries = Country.objects.order_by('name', 'code')
 
     if request.method == 'POST':
         country_code = request.POST.get('country', '')
         file = UploadFile(request.POST, request.FILES)
         if file.is_valid():
-            errors = handle_uploaded_regions(request.FILES['file'], country_code)
-            if errors:
-                return render(request, 'UploadRegions.html', {
-                    "file": file,
-                    "errors": errors,
-                    'countries': all_countries
-                })
-            else:
-                return HttpResponseRedirect(
-                    reverse('cities-list', kwargs={'language': 'en'})
-                )
+            job = enqueue_upload(
+                UploadKindChoices.REGIONS, request.FILES['file'], country_code
+            )
+            return render(request, 'UploadRegions.html', {
+                "file": UploadFile(),
+                "job": job,
+                'countries': all_countries
+            })
     else:
         file = UploadFile()
 
@@ -249,37 +706,21 @@ def upload_regions(request):
 
 
 @login_required
+@dataset_condition
 def download_regions(request, empty):
 
     country_code = request.GET.get('country', '')
     if country_code:
-        regions = Region.objects.prefetch_related(
-            'region_translations', 'country'
-        ).filter(country__code=country_code)
-
-        headers = ['code', 'local_code', 'country_code']
-
-        language_choices = LanguageChoices.values
-        language_choices.sort()
-        for language_code in language_choices:
-            headers.append(language_code)
-
-        regions_list = [headers]
-        if not empty:
-            for region in regions:
-                region_row = [region.code, region.local_code, region.country.code]
-                for translation in region.region_translations.all().order_by('language_code'):
-                    region_row.append(translation.name)
-                regions_list.append(region_row)
+        languages = export_languages()
+        headers = ['code', 'local_code', 'country_code'] + languages
+        rows = [] if empty else regions_rows(country_code, languages)
 
         file_name = "Regions%(country)s - %(date)s" % {
             'date': timezone.now().strftime("%d-%m-%Y"),
             'country': " - %s" % country_code if country_code else ''
         }
-        return django_excel.make_response_from_array(
-            regions_list,
-            'xls',
-            file_name=file_name
+        return streaming_export_response(
+            headers, rows, _export_format(request), file_name
         )
     return HttpResponse(_('You must specify the regions\' country'))
 
@@ -287,23 +728,20 @@ def download_regions(request, empty):
 @login_required
 def upload_cities(request):
 
-    all_countries = CountryTranslation.objects.filter(language_code='en')
+    all_countries = Country.objects.order_by('name', 'code')
 
     if request.method == 'POST':
         country_code = request.POST.get('country', '')
         file = UploadFile(request.POST, request.FILES)
         if file.is_valid():
-            errors = handle_uploaded_cities(request.FILES['file'], country_code)
-            if errors:
-                return render(request, 'UploadCities.html', {
-                    "file": file,
-                    "errors": errors,
-                    'countries': all_countries,
-                })
-            else:
-                return HttpResponseRedirect(
-                    reverse('cities-list', kwargs={'language': 'en'})
-                )
+            job = enqueue_upload(
+                UploadKindChoices.CITIES, request.FILES['file'], country_code
+            )
+            return render(request, 'UploadCities.html', {
+                "file": UploadFile(),
+                "job": job,
+                'countries': all_countries,
+            })
     else:
         file = UploadFile()
 
@@ -314,37 +752,20 @@ def upload_cities(request):
 
 
 @login_required
+@dataset_condition
 def download_cities(request, empty):
 
     country_code = request.GET.get('country', '')
     if country_code:
-        cities = City.objects.prefetch_related(
-            'city_translations', 'region', 'country'
-        ).filter(country__code=country_code)
-
-        headers = ['code', 'region_code', 'country_code']
-
-        language_choices = LanguageChoices.values
-        language_choices.sort()
-        for language_code in language_choices:
-            headers.append(language_code)
-
-        cities_list = [headers]
-        if not empty:
-            for city in cities:
-                city_row = [city.code, city.region.code, city.country.code]
-                for translation in city.city_translations.all().order_by('language_code'):
-                    city_row.append(translation.name)
-                cities_list.append(city_row)
+        languages = export_languages()
+        headers = ['code', 'region_code', 'country_code'] + languages
+        rows = [] if empty else cities_rows(country_code, languages)
 
         file_name = "Cities%(country)s - %(date)s" % {
             'date': timezone.now().strftime("%d-%m-%Y"),
             'country': " - %s" % country_code if country_code else ''
         }
-        return django_excel.make_response_from_array(
-            cities_list,
-            'xls',
-            file_name=file_name
+        return streaming_export_response(
+            headers, rows, _export_format(request), file_name
         )
     return HttpResponse(_('You must specify the cities\' country'))
-
@@ -0,0 +1,92 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+
+from api.caching import popular_cities_queries, uncached_keys
+from api.models import LanguageChoices
+from api.planner import CitiesPlan, PlanError
+
+__author__ = 'Bezur'
+
+__all__ = ['WarmingReport', 'warm_cities_cache', 'warm_after_upload']
+
+logger = logging.getLogger(__name__)
+
+WARM_TOP = getattr(settings, 'PLACES_WARM_TOP', 200)
+WARM_WORKERS = getattr(settings, 'PLACES_WARM_WORKERS', 4)
+
+
+class WarmingReport(object):
+    """What a warm up of the cities cache did"""
+
+    def __init__(self):
+        self.queries = 0
+        self.cached = 0
+        self.warmed = 0
+        self.failed = 0
+        self.seconds = 0
+
+    def __str__(self):
+        return '%d queries: %d warmed, %d already cached, %d failed in %.2f seconds' % (
+            self.queries, self.warmed, self.cached, self.failed, self.seconds
+        )
+
+
+def _warm(plan):
+    try:
+        plan.render()
+        return True
+    except Exception:
+        logger.exception('Could not warm up the cities query %s', plan.log_entry)
+        return False
+    finally:
+        # Every thread of the pool opens its own connection
+        connection.close()
+
+
+def warm_cities_cache(languages=None, top=WARM_TOP, workers=WARM_WORKERS):
+    """
+    Caches the first page of the 'top' most requested queries of the cities
+    endpoint of every language (all of them by default), the ones that
+    aren't cached yet, 'workers' queries at a time. Returns a WarmingReport
+    """
+    started = time.monotonic()
+    report = WarmingReport()
+
+    plans = {}
+    for language in languages or LanguageChoices.values:
+        for entry in popular_cities_queries(language, top):
+            try:
+                plan = CitiesPlan.from_log_entry(language, entry)
+            except (PlanError, TypeError, ValueError):
+                continue
+            plans.setdefault(plan.cache_key, plan)
+    report.queries = len(plans)
+
+    missing = uncached_keys(list(plans))
+    report.cached = report.queries - len(missing)
+    if missing:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for warmed in pool.map(_warm, [plans[key] for key in missing]):
+                if warmed:
+                    report.warmed += 1
+                else:
+                    report.failed += 1
+
+    report.seconds = time.monotonic() - started
+    return report
+
+
+def warm_after_upload():
+    """
+    Uploads bump the dataset version, so nothing is cached afterwards, when
+    PLACES_WARM_AFTER_UPLOAD is set the popular queries are cached again
+    """
+    if not getattr(settings, 'PLACES_WARM_AFTER_UPLOAD', False):
+        return None
+    report = warm_cities_cache()
+    logger.info('Cities cache warmed up after the upload: %s', report)
+    return report
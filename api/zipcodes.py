@@ -0,0 +1,131 @@
+from django.db.models import F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import NullIf
+
+from api.caching import get_cached_zip_codes, set_cached_zip_codes
+from api.models import (
+    ZipCode, CityTranslation, RegionTranslation, CountryTranslation,
+    LanguageChoices
+)
+from api.renderers import dumps
+
+__author__ = 'Bezur'
+
+__all__ = [
+    'render_zip_code_documents', 'get_zip_code_documents', 'zip_codes_page'
+]
+
+
+def _name(translations, language, place, **filters):
+    if language == LanguageChoices.ENGLISH:
+        # Kept on the places themselves, see AbstractPlace.name
+        return NullIf(F('%sname' % place), Value(''))
+    return Subquery(
+        translations.objects.filter(
+            language_code=language, **filters
+        ).values('name')[:1]
+    )
+
+
+def render_zip_code_documents(zip_codes, language):
+    """
+    Renders the compact documents of the zip codes: the owning city, its
+    region and its country, with their names in 'language'. It's a single
+    query over the zip code unique index, the names are looked up by the
+    (language_code, owner) unique indexes of the translations, or joined
+    along with the places in English
+    """
+    rows = ZipCode.objects.filter(zip_code__in=zip_codes).annotate(
+        city_name=_name(
+            CityTranslation, language, 'city__', city=OuterRef('city_id')
+        ),
+        region_name=_name(
+            RegionTranslation, language, 'city__region__',
+            region=OuterRef('city__region_id')
+        ),
+        country_name=_name(
+            CountryTranslation, language, 'city__country__',
+            country=OuterRef('city__country_id')
+        ),
+    ).values_list(
+        'zip_code', 'city_id', 'city__code', 'city_name', 'city__region__code',
+        'region_name', 'city__country__code', 'country_name',
+        'city__country__currency_code'
+    )
+
+    documents = {}
+    for (zip_code, city_id, city_code, city_name, region_code, region_name,
+         country_code, country_name, currency_code) in rows:
+        documents[zip_code] = dumps({
+            'zip_code': zip_code,
+            'city': {
+                'id': city_id,
+                'code': city_code,
+                'name': city_name,
+                'region': {
+                    'code': region_code,
+                    'name': region_name,
+                } if region_code is not None else None,
+                'country': {
+                    'code': country_code,
+                    'name': country_name,
+                    'currency_code': currency_code,
+                },
+            },
+        })
+    return documents
+
+
+def get_zip_code_documents(zip_codes, language):
+    """
+    Returns a dictionary with the documents of the zip codes, by zip code,
+    unknown zip codes are left out. Documents (and misses) are cached per
+    zip code and language
+    """
+    documents = get_cached_zip_codes(zip_codes, language)
+    missing = [zip_code for zip_code in zip_codes if zip_code not in documents]
+    if missing:
+        rendered = render_zip_code_documents(missing, language)
+        set_cached_zip_codes(
+            {zip_code: rendered.get(zip_code, '') for zip_code in missing},
+            language
+        )
+        documents.update(rendered)
+    return {
+        zip_code: document
+        for zip_code, document in documents.items() if document
+    }
+
+
+def zip_codes_page(limit, prefix='', start=None, end=None, position=None):
+    """
+    Returns a page of the zip codes starting with 'prefix' and/or whose
+    numeric value is between 'start' and 'end' (both included), ordered by
+    that value, along with the position of the next page, if any.
+
+    Prefixes are looked up through the pattern ops index of the zip codes,
+    and ranges and pages through the (number, zip_code) one, which covers
+    the whole query
+    """
+    zip_codes = ZipCode.objects.filter(number__isnull=False)
+    if prefix:
+        zip_codes = zip_codes.filter(zip_code__startswith=prefix)
+    if start is not None:
+        zip_codes = zip_codes.filter(number__gte=start)
+    if end is not None:
+        zip_codes = zip_codes.filter(number__lte=end)
+    if position:
+        zip_codes = zip_codes.filter(
+            Q(number__gt=position['n'])
+            | Q(number=position['n'], zip_code__gt=position['z'])
+        )
+
+    rows = list(
+        zip_codes.order_by('number', 'zip_code').values_list(
+            'number', 'zip_code'
+        )[:limit + 1]
+    )
+    page = [zip_code for _number, zip_code in rows[:limit]]
+    if len(rows) <= limit:
+        return page, None
+    number, zip_code = rows[limit - 1]
+    return page, {'n': number, 'z': zip_code}
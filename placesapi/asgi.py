@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'placesapi.settings')
 
 application = get_asgi_application()
+
+# Loads the in-memory reverse geocoding structures before serving requests,
+# only the servers do it, not the management commands
+from api.geocoding import preload  # noqa: E402
+preload()
@@ -49,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.compression.CompressionMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -142,7 +143,7 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 # Django Rest Framework
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
+        'api.renderers.FastJSONRenderer',
     )
 }
 
@@ -171,6 +172,62 @@ CACHES = {
 
 CACHE_TTL = 60 * 1440
 
+# Cities pages are also kept in the memory of every worker (api/caching.py),
+# at most PLACES_LOCAL_CACHE_SIZE of them for PLACES_LOCAL_CACHE_TTL seconds.
+# Workers check the dataset version every PLACES_VERSION_CHECK_INTERVAL
+# seconds, so changes take up to that long to reach all of them
+PLACES_LOCAL_CACHE_SIZE = 1000
+PLACES_LOCAL_CACHE_TTL = 60
+PLACES_VERSION_CHECK_INTERVAL = 1
+
+
+# In-process autocomplete index for the cities endpoint (api/autocomplete.py),
+# every worker keeps its own copy in memory, and checks every
+# PLACES_AUTOCOMPLETE_REFRESH seconds if it has to be rebuilt, which is done
+# in a background thread
+PLACES_AUTOCOMPLETE = False
+PLACES_AUTOCOMPLETE_REFRESH = 30
+
+# Uploaded files from this size on (in bytes) are imported with the
+# streaming import (api.helpers.stream_uploaded_regions/cities)
+PLACES_STREAMING_IMPORT_SIZE = 5 * 1024 * 1024
+
+# Zip code lookups (api/zipcodes.py) are cached for PLACES_ZIP_CACHE_TTL
+# seconds, and clients may keep them for PLACES_ZIP_MAX_AGE seconds
+PLACES_ZIP_CACHE_TTL = 60 * 60 * 24 * 7
+PLACES_ZIP_MAX_AGE = 60 * 60
+
+# In-memory reverse geocoding (api/geocoding.py), loaded by every worker at
+# startup (wsgi.py, asgi.py, passenger_wsgi.py) and rebuilt in a background
+# thread, when the data change, every PLACES_GEOCODING_REFRESH seconds
+PLACES_GEOCODING_PRELOAD = True
+PLACES_GEOCODING_REFRESH = 30
+
+# Nearest cities queries (api/search.py) only look for cities up to
+# PLACES_NEAREST_MAX_DISTANCE km away from the point
+PLACES_NEAREST_MAX_DISTANCE = 2000
+
+# Warming up of the cities cache (api/warming.py, warm_cities_cache command):
+# the first pages of the PLACES_WARM_TOP most requested queries of every
+# language, PLACES_WARM_WORKERS at a time, also after every upload if
+# PLACES_WARM_AFTER_UPLOAD is set
+PLACES_WARM_TOP = 200
+PLACES_WARM_WORKERS = 4
+PLACES_WARM_AFTER_UPLOAD = True
+
+# Snapshots of the whole dataset (see the places_snapshot command), clients
+# may keep the current one for PLACES_SNAPSHOT_MAX_AGE seconds
+PLACES_SNAPSHOT_MAX_AGE = 60 * 60
+
+# Running upload jobs whose worker gave no sign of life for
+# PLACES_UPLOAD_JOB_TIMEOUT seconds are queued again (see api.jobs)
+PLACES_UPLOAD_JOB_TIMEOUT = 5 * 60
+
+# The changes feed keeps PLACES_CHANGES_RETENTION_DAYS days of changes (see
+# the prune_place_changes command), clients further behind start over from
+# a snapshot
+PLACES_CHANGES_RETENTION_DAYS = 30
+
 try:
     from .local_settings import *
 except ImportError: